@@ -3,11 +3,12 @@ from store.models import Product
 from django.contrib import messages
 from decimal import Decimal
 from django.contrib.auth.decorators import login_required
+from core import metrics
 from .models import CartItem
 
 @login_required(login_url='signin')
 def cart_page(request):
-    cart_items = CartItem.objects.filter(user=request.user).select_related('product')
+    cart_items = CartItem.objects.filter(user=request.user).select_related('product__category', 'product__color')
     products = []
     subtotal = 0
 
@@ -24,6 +25,7 @@ def cart_page(request):
     tax = subtotal * Decimal('0.05')  # 5% VAT (UAE standard)
     total = subtotal + shipping + tax
 
+    metrics.CHECKOUT.inc(step=metrics.CART_VIEWED)
     return render(request, "cart/cart.html", {
         "cart_items": products,
         "subtotal": subtotal,
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.utils import timezone
 from django.db import models
-from .models import AboutPage, ContactPage, ContactService, ContactMessage, Homepage, NewsletterSubscriber, Newsletter, SocialMedia
+from . import content_cache
+from .models import AboutPage, ContactPage, ContactService, ContactMessage, Homepage, NewsletterSubscriber, Newsletter, SocialMedia, CustomerSegment, SiteCounter
 
 @admin.register(AboutPage)
 class AboutPageAdmin(admin.ModelAdmin):
@@ -57,13 +58,13 @@ class NewsletterSubscriberAdmin(admin.ModelAdmin):
 
 @admin.register(Newsletter)
 class NewsletterAdmin(admin.ModelAdmin):
-    list_display = ("subject", "status", "created_at", "scheduled_at", "sent_at", "sent_count")
-    list_filter = ("status", "created_at", "sent_at")
+    list_display = ("subject", "status", "target_segment", "created_at", "scheduled_at", "sent_at", "sent_count")
+    list_filter = ("status", "target_segment", "created_at", "sent_at")
     search_fields = ("subject", "content")
     readonly_fields = ("sent_at", "sent_count")
     fieldsets = (
         ('Newsletter Details', {
-            'fields': ('subject', 'status', 'scheduled_at')
+            'fields': ('subject', 'status', 'target_segment', 'scheduled_at')
         }),
         ('Content', {
             'fields': ('content', 'html_content'),
@@ -85,6 +86,22 @@ class NewsletterAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 
+@admin.register(CustomerSegment)
+class CustomerSegmentAdmin(admin.ModelAdmin):
+    list_display = ("email", "segment", "recency_score", "frequency_score", "monetary_score", "computed_at")
+    list_filter = ("segment",)
+    search_fields = ("email",)
+    readonly_fields = ("email", "recency_days", "frequency", "monetary", "recency_score",
+                       "frequency_score", "monetary_score", "segment", "computed_at")
+
+
+@admin.register(SiteCounter)
+class SiteCounterAdmin(admin.ModelAdmin):
+    list_display = ("key", "value", "updated_at")
+    search_fields = ("key",)
+    readonly_fields = ("key", "value", "updated_at")
+
+
 @admin.register(SocialMedia)
 class SocialMediaAdmin(admin.ModelAdmin):
     list_display = ("platform", "url", "is_active", "display_order", "get_icon_preview")
@@ -115,12 +132,14 @@ class SocialMediaAdmin(admin.ModelAdmin):
     def activate_links(self, request, queryset):
         """Activate selected social media links"""
         updated = queryset.update(is_active=True)
+        content_cache.invalidate()
         self.message_user(request, f'Successfully activated {updated} social media link(s).')
     activate_links.short_description = 'Activate selected links'
 
     def deactivate_links(self, request, queryset):
         """Deactivate selected social media links"""
         updated = queryset.update(is_active=False)
+        content_cache.invalidate()
         self.message_user(request, f'Successfully deactivated {updated} social media link(s).')
     deactivate_links.short_description = 'Deactivate selected links'
 
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Registers the system checks
+        from . import checks
+        from .signals import connect_content_cache_signals, connect_counter_signals, connect_page_cache_signals
+        connect_counter_signals()
+        connect_content_cache_signals()
+        connect_page_cache_signals()
+
+        from django.conf import settings
+        if settings.TRACING_ENABLED:
+            from . import tracing
+            tracing.install()
@@ -0,0 +1,147 @@
+"""
+Static asset build and serving helpers.
+
+build_assets collects static files through the manifest storage (hashed,
+cache-busting names), minifies the project's own CSS/JS and writes
+pre-compressed .gz (and .br when the optional brotli package is installed)
+siblings. serve_asset() hands those files out with the best encoding the
+client accepts, and with far-future immutable caching for hashed names.
+"""
+import gzip
+import mimetypes
+import os
+import re
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.xml', '.map')
+# Small files gain nothing from compression
+MIN_COMPRESS_SIZE = 256
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=60'
+
+STRING_RE = r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+CSS_COMMENT_RE = re.compile(rf'({STRING_RE})|/\*.*?\*/', re.S)
+CSS_SPLIT_RE = re.compile(f'({STRING_RE})')
+
+
+def minify_css(css):
+    """Strip comments and redundant whitespace, leaving strings untouched"""
+    css = CSS_COMMENT_RE.sub(lambda match: match.group(1) or '', css)
+    parts = CSS_SPLIT_RE.split(css)
+    for index in range(0, len(parts), 2):
+        code = re.sub(r'\s+', ' ', parts[index])
+        code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+        # Only whitespace after a colon: "a :hover" and "a:hover" are different selectors
+        code = re.sub(r':\s+', ':', code)
+        parts[index] = code.replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+def minify_js(js):
+    """
+    Conservative JS minification: drop indentation and blank lines only.
+    Anything smarter needs a real parser (regex literals, ASI, template strings).
+    """
+    return '\n'.join(line.strip() for line in js.splitlines() if line.strip())
+
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+
+def minify_file(path):
+    """Minify a file in place; returns (size_before, size_after)"""
+    minifier = MINIFIERS[os.path.splitext(path)[1]]
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    minified = minifier(source)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(minified)
+    return len(source.encode()), len(minified.encode())
+
+
+def compress_file(path):
+    """
+    Write .gz (and .br if available) next to a file when it makes it smaller.
+    Returns {encoding: compressed_size} for the variants written.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return {}
+
+    variants = {'gzip': ('.gz', gzip.compress(data, compresslevel=9, mtime=0))}
+    if brotli is not None:
+        variants['br'] = ('.br', brotli.compress(data, quality=11))
+
+    written = {}
+    for encoding, (suffix, compressed) in variants.items():
+        if len(compressed) < len(data) * 0.95:
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            written[encoding] = len(compressed)
+    return written
+
+
+def accepted_encodings(header):
+    """Encodings from an Accept-Encoding header, leaving out those with q=0"""
+    accepted = set()
+    for item in header.split(','):
+        name, *params = item.strip().split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if name and quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def serve_asset(request, path, root, immutable_names=()):
+    """
+    Serve a collected static file, or return None if it does not exist.
+    Pre-compressed siblings are used when the client accepts them.
+    """
+    try:
+        full_path = safe_join(root, path)
+    except SuspiciousFileOperation:
+        return None
+    if not os.path.isfile(full_path):
+        return None
+
+    stat = os.stat(full_path)
+    if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    served_path, encoding = full_path, None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if candidate in accepted and os.path.isfile(full_path + suffix):
+            served_path, encoding = full_path + suffix, candidate
+            break
+
+    content_type, _ = mimetypes.guess_type(full_path)
+    response = FileResponse(open(served_path, 'rb'), content_type=content_type or 'application/octet-stream')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if path in immutable_names else REVALIDATE_CACHE_CONTROL
+    return response
@@ -0,0 +1,33 @@
+"""
+System checks for settings the caching layers depend on.
+
+The page cache, fragment cache, content cache and dashboard stats keep
+versions, locks and shared counters in the default cache. With a
+process-local backend each worker sees its own copy, so invalidations made
+in one process never reach the others. Run as part of `check --deploy`.
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Backends whose entries live inside a single process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Warning(
+            f"The default cache ({backend.rsplit('.', 1)[-1]}) is local to each process.",
+            hint=(
+                'The page, fragment and content caches and the dashboard stats lock rely on a cache shared by '
+                'every worker; point CACHES["default"] at Redis or Memcached in production.'
+            ),
+            id='core.W001',
+        )
+    ]
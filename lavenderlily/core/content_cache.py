@@ -0,0 +1,97 @@
+"""
+Cache for the rarely changing site-content records.
+
+Homepage, AboutPage, ContactPage (with its services) and the active social
+media links are loaded once and kept both in this process and in the shared
+cache. Every entry is stored under the current content version; saving or
+deleting any of these records bumps the version (see core.signals), so all
+processes pick up the change on their next read. The process-local copy only
+costs one cache lookup of the version key per read.
+
+With the default per-process LocMemCache, invalidation only reaches the
+process that made the change; configure a shared CACHES backend in
+production.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from . import metrics
+from .models import AboutPage, ContactPage, Homepage, SocialMedia
+
+VERSION_KEY = 'core:content:version'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+HOMEPAGE = 'homepage'
+ABOUT_PAGE = 'about'
+CONTACT_PAGE = 'contact'
+SOCIAL_MEDIA = 'social_media'
+
+LOADERS = {
+    HOMEPAGE: lambda: Homepage.objects.first(),
+    ABOUT_PAGE: lambda: AboutPage.objects.first(),
+    CONTACT_PAGE: lambda: ContactPage.objects.prefetch_related('services').first(),
+    SOCIAL_MEDIA: lambda: list(SocialMedia.objects.filter(is_active=True).order_by('display_order')),
+}
+
+_lock = threading.Lock()
+_local = {}
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(VERSION_KEY, version, None):
+            version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def get_content(name):
+    """Return the cached record (or list) for name, loading it on a miss"""
+    version = _current_version()
+    entry = _local.get(name)
+    if entry is not None and entry[0] == version:
+        metrics.CACHE_REQUESTS.inc(cache='content', result='hit')
+        return entry[1]
+
+    key = f'core:content:{name}:{version}'
+    cached = cache.get(key)
+    metrics.CACHE_REQUESTS.inc(cache='content', result='miss' if cached is None else 'hit')
+    if cached is None:
+        # Wrapped in a tuple so a missing record (None) is cached too
+        cached = (LOADERS[name](),)
+        cache.set(key, cached, CACHE_TIMEOUT)
+
+    with _lock:
+        _local[name] = (version, cached[0])
+    return cached[0]
+
+
+def get_homepage():
+    return get_content(HOMEPAGE)
+
+
+def get_about_page():
+    return get_content(ABOUT_PAGE)
+
+
+def get_contact_page():
+    return get_content(CONTACT_PAGE)
+
+
+def get_social_media_links():
+    return get_content(SOCIAL_MEDIA)
+
+
+def _bump_version():
+    cache.set(VERSION_KEY, time.time_ns(), None)
+    with _lock:
+        _local.clear()
+
+
+def invalidate():
+    """Drop every cached content record once the current transaction commits"""
+    transaction.on_commit(_bump_version)
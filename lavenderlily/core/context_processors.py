@@ -1,6 +1,6 @@
 from django.db import models
 from cart.models import CartItem, WishlistItem
-from .models import SocialMedia
+from .content_cache import get_social_media_links
 
 def cart_wishlist_counts(request):
     if request.user.is_authenticated:
@@ -12,7 +12,7 @@ def cart_wishlist_counts(request):
         wishlist_count = 0
 
     # Get active social media links for footer
-    social_media_links = SocialMedia.objects.filter(is_active=True).order_by('display_order')
+    social_media_links = get_social_media_links()
 
     return {
         "cart_count": cart_count,
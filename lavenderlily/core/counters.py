@@ -0,0 +1,223 @@
+"""
+Materialized site-wide counters.
+
+SiteCounter rows hold running totals (orders per status, active subscribers,
+unreplied messages, users, products per category) that the signal handlers
+in core.signals keep current with F() increments. Reading a counter is a
+cache hit or a primary-key lookup instead of a COUNT over the whole table.
+
+Rows are seeded from the source tables the first time they are read, and
+reconcile() recomputes every family to correct drift, e.g. after bulk
+updates that bypass model signals.
+"""
+from collections import Counter, namedtuple
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from .models import SiteCounter
+
+CACHE_PREFIX = 'core:counter:'
+CACHE_TIMEOUT = 60 * 60
+
+ORDERS_TOTAL = 'orders:total'
+SUBSCRIBERS_TOTAL = 'subscribers:total'
+SUBSCRIBERS_ACTIVE = 'subscribers:active'
+MESSAGES_TOTAL = 'messages:total'
+MESSAGES_UNREPLIED = 'messages:unreplied'
+USERS_TOTAL = 'users:total'
+USERS_ACTIVE = 'users:active'
+USERS_STAFF = 'users:staff'
+PRODUCTS_TOTAL = 'products:total'
+
+
+def order_status_key(status):
+    return f'orders:status:{status}'
+
+
+def category_products_key(category_id):
+    return f'products:category:{category_id}'
+
+
+def _count_orders():
+    from orders.models import Order
+
+    values = {order_status_key(status): 0 for status, _ in Order.STATUS_CHOICES}
+    for status, count in Order.objects.values_list('status').annotate(count=Count('id')).order_by():
+        values[order_status_key(status)] = count
+    values[ORDERS_TOTAL] = sum(values.values())
+    return values
+
+
+def _count_subscribers():
+    from .models import NewsletterSubscriber
+
+    return _conditional_counts(NewsletterSubscriber, {SUBSCRIBERS_TOTAL: None, SUBSCRIBERS_ACTIVE: Q(is_active=True)})
+
+
+def _count_messages():
+    from .models import ContactMessage
+
+    return _conditional_counts(ContactMessage, {MESSAGES_TOTAL: None, MESSAGES_UNREPLIED: Q(is_replied=False)})
+
+
+def _count_users():
+    from django.contrib.auth.models import User
+
+    return _conditional_counts(User, {
+        USERS_TOTAL: None, USERS_ACTIVE: Q(is_active=True), USERS_STAFF: Q(is_staff=True),
+    })
+
+
+def _count_products():
+    from store.models import Category
+
+    values = {
+        category_products_key(category_id): count
+        for category_id, count in Category.objects.values_list('pk').annotate(count=Count('product')).order_by()
+    }
+    values[PRODUCTS_TOTAL] = sum(values.values())
+    return values
+
+
+def _conditional_counts(model, filters):
+    """Count rows for several filters in one query; a None filter counts every row"""
+    counts = model.objects.aggregate(**{
+        f'count_{index}': Count('pk', filter=condition) for index, condition in enumerate(filters.values())
+    })
+    return dict(zip(filters, counts.values()))
+
+
+CounterFamily = namedtuple('CounterFamily', 'model prefix fields keys compute')
+
+# model label, key prefix, fields the keys are derived from, keys for one instance, recount from scratch
+FAMILIES = (
+    CounterFamily(
+        'orders.Order', 'orders:', ('status',),
+        lambda order: (ORDERS_TOTAL, order_status_key(order.status)),
+        _count_orders,
+    ),
+    CounterFamily(
+        'core.NewsletterSubscriber', 'subscribers:', ('is_active',),
+        lambda subscriber: (SUBSCRIBERS_TOTAL,) + ((SUBSCRIBERS_ACTIVE,) if subscriber.is_active else ()),
+        _count_subscribers,
+    ),
+    CounterFamily(
+        'core.ContactMessage', 'messages:', ('is_replied',),
+        lambda message: (MESSAGES_TOTAL,) + (() if message.is_replied else (MESSAGES_UNREPLIED,)),
+        _count_messages,
+    ),
+    CounterFamily(
+        'auth.User', 'users:', ('is_active', 'is_staff'),
+        lambda user: (USERS_TOTAL,) + ((USERS_ACTIVE,) if user.is_active else ()) + ((USERS_STAFF,) if user.is_staff else ()),
+        _count_users,
+    ),
+    CounterFamily(
+        'store.Product', 'products:', ('category_id',),
+        lambda product: (PRODUCTS_TOTAL, category_products_key(product.category_id)),
+        _count_products,
+    ),
+)
+
+FAMILIES_BY_MODEL = {family.model: family for family in FAMILIES}
+
+
+def counter_keys(family, instance):
+    """Counter keys an instance contributes to, or None if its fields were not loaded"""
+    if any(field not in instance.__dict__ for field in family.fields):
+        return None
+    return family.keys(instance)
+
+
+def _cache_key(key):
+    return CACHE_PREFIX + key
+
+
+def _invalidate(keys):
+    keys = [_cache_key(key) for key in keys]
+    # Readers keep seeing the committed value until the change is committed
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def update_counters(deltas):
+    """Apply {key: delta} with one F() update per changed counter"""
+    changed = [key for key, delta in deltas.items() if delta]
+    for key in changed:
+        # Missing rows are left alone; they are seeded from the source table on first read
+        SiteCounter.objects.filter(key=key).update(value=F('value') + deltas[key])
+    if changed:
+        _invalidate(changed)
+
+
+def diff_keys(old_keys, new_keys):
+    """Deltas turning the counters of old_keys into those of new_keys"""
+    deltas = Counter(new_keys)
+    deltas.subtract(Counter(old_keys))
+    return deltas
+
+
+def get_counters(keys):
+    """Return {key: value}, reading the cache first and the SiteCounter table for misses"""
+    keys = list(dict.fromkeys(keys))
+    cached = cache.get_many([_cache_key(key) for key in keys])
+    values = {key: cached[_cache_key(key)] for key in keys if _cache_key(key) in cached}
+
+    missing = [key for key in keys if key not in values]
+    if missing:
+        found = dict(SiteCounter.objects.filter(key__in=missing).values_list('key', 'value'))
+        unseeded = [key for key in missing if key not in found]
+        if unseeded:
+            seeded, _ = reconcile(families=[family for family in FAMILIES if any(key.startswith(family.prefix) for key in unseeded)])
+            found.update({key: seeded.get(key, 0) for key in unseeded})
+        cache.set_many({_cache_key(key): found[key] for key in missing}, CACHE_TIMEOUT)
+        values.update(found)
+
+    return values
+
+
+def get_counter(key):
+    return get_counters([key])[key]
+
+
+def reconcile(families=FAMILIES):
+    """
+    Recompute the given counter families from their source tables and store the results.
+    Returns ({key: value} for every recomputed counter, {key: (stored, actual)} for the ones that drifted).
+    """
+    values = {}
+    for family in families:
+        values.update(family.compute())
+    if not values:
+        return values, {}
+
+    with transaction.atomic():
+        # Rows no longer produced by a family (e.g. a deleted category) are dropped
+        stale = Q()
+        for family in families:
+            stale |= Q(key__startswith=family.prefix)
+        SiteCounter.objects.filter(stale).exclude(key__in=values).delete()
+
+        existing = dict(SiteCounter.objects.filter(key__in=values).values_list('key', 'value'))
+        SiteCounter.objects.bulk_create(
+            [SiteCounter(key=key, value=value) for key, value in values.items() if key not in existing],
+            ignore_conflicts=True,
+        )
+        drift = {
+            key: (existing[key], value) for key, value in values.items()
+            if key in existing and existing[key] != value
+        }
+        for key, (_, value) in drift.items():
+            SiteCounter.objects.filter(key=key).update(value=value)
+    _invalidate(values)
+    return values, drift
+
+
+class CountedPaginator(Paginator):
+    """Paginator that takes its total from a SiteCounter instead of a COUNT query"""
+
+    def __init__(self, object_list, per_page, counter=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        if counter is not None:
+            self.count = get_counter(counter)
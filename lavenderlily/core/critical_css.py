@@ -0,0 +1,181 @@
+"""
+Per-page critical CSS.
+
+build_critical_css renders each storefront page, collects the tags, classes
+and ids its HTML uses and keeps only the style.css rules whose selectors can
+match them. {% critical_stylesheet %} inlines that subset in <head> and loads
+the full stylesheet without blocking the first paint.
+
+Selector matching is deliberately generous: pseudo-classes, pseudo-elements
+and attribute selectors are ignored, so a rule is kept whenever its tags,
+classes and ids all occur on the page. State classes added later by
+JavaScript are covered by the full stylesheet once it has loaded.
+"""
+import os
+import re
+import threading
+from html.parser import HTMLParser
+
+from django.conf import settings
+
+from .assets import minify_css
+
+PSEUDO_RE = re.compile(r'::?[\w-]+(\((?:[^()]|\([^()]*\))*\))?')
+ATTRIBUTE_RE = re.compile(r'\[[^\]]*\]')
+CLASS_RE = re.compile(r'\.([\w-]+)')
+ID_RE = re.compile(r'#([\w-]+)')
+TAG_RE = re.compile(r'(?:^|[\s>+~])([a-zA-Z][\w-]*)')
+ANIMATION_RE = re.compile(r'animation(?:-name)?:([^;}]+)')
+
+# Grouping at-rules whose bodies are filtered rule by rule
+GROUPING_AT_RULES = ('@media', '@supports', '@container', '@layer')
+
+
+class _UsageParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.tags = {'html', 'body'}
+        self.classes = set()
+        self.ids = set()
+
+    def handle_starttag(self, tag, attrs):
+        self.tags.add(tag)
+        for name, value in attrs:
+            if name == 'class' and value:
+                self.classes.update(value.split())
+            elif name == 'id' and value:
+                self.ids.add(value)
+
+
+def page_usage(html_pages):
+    """Return (tags, classes, ids) used across the given HTML documents"""
+    parser = _UsageParser()
+    for html in html_pages:
+        parser.feed(html)
+    parser.close()
+    return parser.tags, parser.classes, parser.ids
+
+
+def selector_matches(selector, usage):
+    tags, classes, ids = usage
+    simplified = ATTRIBUTE_RE.sub('', PSEUDO_RE.sub('', selector))
+    return (
+        all(name in classes for name in CLASS_RE.findall(simplified))
+        and all(name in ids for name in ID_RE.findall(simplified))
+        and all(name.lower() in tags for name in TAG_RE.findall(simplified))
+    )
+
+
+def _split_top_level(text, separator):
+    parts, depth, start, quote = [], 0, 0, None
+    for index, char in enumerate(text):
+        if quote:
+            if char == quote and text[index - 1] != '\\':
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:index])
+            start = index + 1
+    parts.append(text[start:])
+    return parts
+
+
+def parse_rules(css):
+    """
+    Split minified CSS into (prelude, body) pairs. Statements without a body
+    (@import, @charset) have body None; grouping at-rules keep their raw body.
+    """
+    rules, index, length = [], 0, len(css)
+    while index < length:
+        brace = css.find('{', index)
+        semicolon = css.find(';', index)
+        if brace == -1:
+            break
+        if css[index] == '@' and semicolon != -1 and semicolon < brace:
+            rules.append((css[index:semicolon].strip(), None))
+            index = semicolon + 1
+            continue
+
+        depth, quote, position = 0, None, brace
+        while position < length:
+            char = css[position]
+            if quote:
+                if char == quote and css[position - 1] != '\\':
+                    quote = None
+            elif char in '"\'':
+                quote = char
+            elif char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if depth == 0:
+                    break
+            position += 1
+        rules.append((css[index:brace].strip(), css[brace + 1:position]))
+        index = position + 1
+    return rules
+
+
+def _filter(rules, usage):
+    kept, keyframes = [], {}
+    for prelude, body in rules:
+        if body is None:
+            kept.append(f'{prelude};')
+        elif prelude.startswith('@keyframes') or prelude.startswith('@-webkit-keyframes'):
+            keyframes[prelude.split(None, 1)[1].strip()] = f'{prelude}{{{body}}}'
+        elif prelude.startswith(GROUPING_AT_RULES):
+            inner, inner_keyframes = _filter(parse_rules(body), usage)
+            keyframes.update(inner_keyframes)
+            if inner:
+                kept.append(f'{prelude}{{{"".join(inner)}}}')
+        elif prelude.startswith('@'):
+            # @font-face, @page, @property...: small and not selector based
+            kept.append(f'{prelude}{{{body}}}')
+        else:
+            selectors = [s.strip() for s in _split_top_level(prelude, ',') if selector_matches(s.strip(), usage)]
+            if selectors:
+                kept.append(f'{",".join(selectors)}{{{body}}}')
+    return kept, keyframes
+
+
+def extract(css, html_pages):
+    """Return the minified subset of css needed to render html_pages"""
+    kept, keyframes = _filter(parse_rules(minify_css(css)), page_usage(html_pages))
+    critical = ''.join(kept)
+
+    animations = set()
+    for value in ANIMATION_RE.findall(critical):
+        animations.update(re.split(r'[\s,]+', value.strip()))
+    critical += ''.join(rule for name, rule in keyframes.items() if name in animations)
+    return critical
+
+
+def critical_path(template_name):
+    """Where the critical CSS for a template is written, e.g. store/shop.html -> store/shop.css"""
+    return os.path.join(settings.CRITICAL_CSS_DIR, os.path.splitext(template_name)[0] + '.css')
+
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+def load(template_name):
+    """Return the critical CSS for a template, or None if none was built"""
+    path = critical_path(template_name)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+
+    entry = _loaded.get(path)
+    if entry is None or entry[0] != mtime:
+        with open(path, encoding='utf-8') as f:
+            entry = (mtime, f.read())
+        with _lock:
+            _loaded[path] = entry
+    return entry[1]
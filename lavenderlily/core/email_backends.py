@@ -0,0 +1,56 @@
+"""
+Mail backend that counts what the real backend delivers.
+
+Set EMAIL_BACKEND to core.email_backends.InstrumentedEmailBackend and
+INSTRUMENTED_EMAIL_BACKEND to the backend that actually sends. Messages
+with a List-Unsubscribe header are counted as newsletters, the rest as
+transactional mail (order and account emails). Each batch is also a span
+of the current request trace (core.tracing).
+"""
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+from . import metrics, tracing
+
+NEWSLETTER = 'newsletter'
+TRANSACTIONAL = 'transactional'
+
+
+def message_kind(message):
+    return NEWSLETTER if 'List-Unsubscribe' in message.extra_headers else TRANSACTIONAL
+
+
+class InstrumentedEmailBackend(BaseEmailBackend):
+    def __init__(self, fail_silently=False, **kwargs):
+        super().__init__(fail_silently=fail_silently)
+        self.backend = get_connection(settings.INSTRUMENTED_EMAIL_BACKEND, fail_silently=fail_silently, **kwargs)
+
+    def open(self):
+        return self.backend.open()
+
+    def close(self):
+        return self.backend.close()
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        kinds = [message_kind(message) for message in email_messages]
+        started = time.perf_counter()
+        attributes = {'email.kind': kinds[0], 'email.messages': len(email_messages), 'email.backend': settings.INSTRUMENTED_EMAIL_BACKEND}
+        try:
+            with tracing.span(tracing.SMTP, 'email.send', attributes):
+                sent = self.backend.send_messages(email_messages) or 0
+        except Exception:
+            for kind in kinds:
+                metrics.EMAILS.inc(kind=kind, result='failed')
+            raise
+        finally:
+            metrics.EMAIL_SEND_DURATION.observe(time.perf_counter() - started, kind=kinds[0])
+
+        # Backends only report how many were sent; a short count means the last ones failed
+        for index, kind in enumerate(kinds):
+            metrics.EMAILS.inc(kind=kind, result='sent' if index < sent else 'failed')
+        return sent
@@ -0,0 +1,117 @@
+"""
+Template fragment cache used by {% cachedfragment %}.
+
+A fragment declares the models it is built from. Its cache key includes the
+current version of each of those models (the same per-model versions the
+page cache uses, bumped on every save/delete), so a fragment can never be
+served stale and needs no TTL tuning: a change simply moves readers to a
+new key and the old entry ages out.
+
+Hit/miss counts are kept per fragment in this process and added to shared
+counters in the cache every few seconds; fragment_stats() reports both.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.utils.html import format_html
+
+from . import metrics, page_cache
+
+FRAGMENT_KEY_PREFIX = 'core:fragment:'
+STATS_KEY_PREFIX = 'core:fragment:stats:'
+STATS_INDEX_KEY = 'core:fragment:stats:names'
+
+# Old versions of a fragment are never read again, this only bounds how long they linger
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+STATS_FLUSH_SECONDS = 10
+
+HIT = 'hits'
+MISS = 'misses'
+
+_lock = threading.Lock()
+_pending = Counter()
+_last_flush = time.monotonic()
+
+
+def fragment_key(name, tags, vary_on=()):
+    versions = page_cache.get_tag_versions(tags)
+    parts = [name, *(f'{tag}={versions[tag]}' for tag in sorted(versions)), *map(str, vary_on)]
+    return FRAGMENT_KEY_PREFIX + name + ':' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def get_fragment(key):
+    return cache.get(key)
+
+
+def set_fragment(key, html):
+    """Store a freshly rendered fragment; returns the cached (hole-stripped) copy"""
+    html = page_cache.strip_holes(html)
+    cache.set(key, html, FRAGMENT_TIMEOUT)
+    return html
+
+
+def fill_fragment(html, context):
+    """Re-render the holes and CSRF token of a cached fragment for the current visitor"""
+    html = page_cache.HOLE_MARKER_RE.sub(lambda match: page_cache.render_hole(context, match.group(1)), html)
+    if page_cache.CSRF_MARKER in html:
+        request = context.get('request')
+        token = get_token(request) if request is not None else ''
+        html = html.replace(page_cache.CSRF_MARKER, format_html(
+            '<input type="hidden" name="csrfmiddlewaretoken" value="{}">', token
+        ))
+    return html
+
+
+def record(name, outcome):
+    """Count a hit or miss; pushes the counts to the cache when due"""
+    global _last_flush
+
+    metrics.CACHE_REQUESTS.inc(cache='fragment', result='hit' if outcome == HIT else 'miss')
+    with _lock:
+        _pending[(name, outcome)] += 1
+        due = time.monotonic() - _last_flush >= STATS_FLUSH_SECONDS
+        if due:
+            pending = dict(_pending)
+            _pending.clear()
+            _last_flush = time.monotonic()
+
+    if due:
+        _flush(pending)
+
+
+def _stats_key(name, outcome):
+    return f'{STATS_KEY_PREFIX}{name}:{outcome}'
+
+
+def _flush(pending):
+    names = set(cache.get(STATS_INDEX_KEY) or ())
+    for (name, outcome), count in pending.items():
+        key = _stats_key(name, outcome)
+        if not cache.add(key, count, None):
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                cache.set(key, count, None)
+        names.add(name)
+    cache.set(STATS_INDEX_KEY, sorted(names), None)
+
+
+def fragment_stats():
+    """Return {name: {'hits', 'misses', 'hit_rate'}} across all processes (plus this one's unflushed counts)"""
+    with _lock:
+        pending = dict(_pending)
+
+    names = set(cache.get(STATS_INDEX_KEY) or ()) | {name for name, _ in pending}
+    shared = cache.get_many([_stats_key(name, outcome) for name in names for outcome in (HIT, MISS)])
+
+    stats = {}
+    for name in sorted(names):
+        hits = shared.get(_stats_key(name, HIT), 0) + pending.get((name, HIT), 0)
+        misses = shared.get(_stats_key(name, MISS), 0) + pending.get((name, MISS), 0)
+        total = hits + misses
+        stats[name] = {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0}
+    return stats
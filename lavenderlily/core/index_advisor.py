@@ -0,0 +1,401 @@
+"""
+Missing-index advice from a log of executed queries.
+
+A query log is JSON lines, one statement per line: {"sql": ..., "params":
+[...], "count": executions, "time_ms": total time}; count and time_ms are
+optional. `manage.py advise_indexes --bench --save-log FILE` writes one from
+the benchmark views, and anything that records SQL with its parameters
+(QueryRecorder(keep_params=True) for instance) can produce one.
+
+Statements are grouped by fingerprint (core.queries.fingerprint) and one
+sample of each SELECT is replayed and EXPLAINed on the configured database.
+Full table scans, sorts the database has to do itself (filesort, temp
+B-tree for ORDER BY) and temporary tables on tables with at least min_rows
+rows are turned into an index proposal for the model behind the table:
+equality columns first, then one range column, then the ORDER BY columns
+when they all belong to that table. Columns only compared with a leading
+wildcard LIKE (icontains) cannot use a B-tree index and are left out.
+
+The estimated impact is rows read per execution with and without the index
+(table size divided by the number of distinct values of the equality
+columns, a tenth of that for a range, at most LIMIT + OFFSET when the index
+also gives the order), times how often the statements ran.
+"""
+import hashlib
+import json
+import re
+import time
+
+from django.apps import apps
+from django.db import connection, models
+
+from .queries import fingerprint
+
+# Apps whose models the advisor proposes indexes for; contrib tables are left alone
+PROJECT_APPS = ('core', 'store', 'cart', 'orders')
+
+FULL_SCAN = 'full scan'
+SORT = 'sort'
+TEMPORARY = 'temporary table'
+
+# Fraction of the rows a range predicate is assumed to keep
+RANGE_SELECTIVITY = 0.1
+
+QUOTE = '["`]?'
+TABLE_RE = re.compile(rf'\b(?:FROM|JOIN)\s+{QUOTE}(\w+){QUOTE}(?:\s+(?:AS\s+)?{QUOTE}([A-Z]\d+){QUOTE})?', re.I)
+PREDICATE_RE = re.compile(
+    rf'{QUOTE}(\w+){QUOTE}\.{QUOTE}(\w+){QUOTE}\s*(=|>=|<=|>|<|IN\s*\(|LIKE)\s*(%s)', re.I,
+)
+ORDER_BY_RE = re.compile(r'\bORDER BY\s+(.*?)(?=\bLIMIT\b|\bOFFSET\b|\)|$)', re.I | re.S)
+ORDER_COLUMN_RE = re.compile(rf'{QUOTE}(\w+){QUOTE}\.{QUOTE}(\w+){QUOTE}(?:\s+(ASC|DESC))?', re.I)
+LIMIT_RE = re.compile(r'\bLIMIT\s+(\d+)(?:\s+OFFSET\s+(\d+))?', re.I)
+# Negated predicates and aggregate filters cannot narrow an index lookup
+UNINDEXABLE_GROUP_RE = re.compile(r'\b(?:NOT|FILTER)\s*\(', re.I)
+SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)(.*)$')
+
+
+def load_log(path):
+    """Statements from a JSON-lines query log"""
+    statements = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+                statements.append({
+                    'sql': entry['sql'],
+                    'params': entry.get('params') or [],
+                    'count': int(entry.get('count', 1)),
+                    'time_ms': entry.get('time_ms'),
+                })
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f'{path}:{number}: not a query log line ({e})')
+    return statements
+
+
+def from_recorder(recorder):
+    """Statements a QueryRecorder(keep_params=True) saw"""
+    return [
+        {
+            'sql': sql,
+            'params': list(recorder.samples[sql][1] or []) if sql in recorder.samples else None,
+            'count': recorder.statements[sql],
+            'time_ms': round(total * 1000, 3),
+        }
+        for sql, (total, slowest) in recorder.statement_times.items()
+    ]
+
+
+def write_log(statements, path):
+    with open(path, 'w') as f:
+        for statement in statements:
+            f.write(json.dumps(statement, default=str) + '\n')
+
+
+def group_selects(statements):
+    """{digest: statement} with counts and times summed per fingerprint; one replayable sample each"""
+    groups = {}
+    for statement in statements:
+        if statement['params'] is None or not statement['sql'].lstrip().upper().startswith('SELECT'):
+            continue
+        normalized = fingerprint(statement['sql'])
+        digest = hashlib.sha1(normalized.encode()).hexdigest()
+        group = groups.get(digest)
+        if group is None:
+            groups[digest] = {**statement, 'fingerprint': normalized, 'time_ms': statement['time_ms']}
+        else:
+            group['count'] += statement['count']
+            if statement['time_ms'] is not None:
+                group['time_ms'] = (group['time_ms'] or 0) + statement['time_ms']
+    return groups
+
+
+# Plans
+
+def replay(sql, params):
+    """Run a statement once; returns milliseconds"""
+    with connection.cursor() as cursor:
+        started = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        return (time.perf_counter() - started) * 1000
+
+
+def explain(sql, params):
+    """(plan text, [(problem, table or alias or None, detail)]) for one statement on the configured database"""
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        if vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return json.dumps(plan, indent=2), list(_postgresql_problems(plan[0]['Plan']))
+        if vendor == 'mysql':
+            cursor.execute(f'EXPLAIN {sql}', params)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return '\n'.join(' '.join(f'{key}={value}' for key, value in row.items()) for row in rows), _mysql_problems(rows)
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+        rows = cursor.fetchall()
+    return '\n'.join(' '.join(str(column) for column in row) for row in rows), _sqlite_problems(rows)
+
+
+def _sqlite_problems(rows):
+    problems = []
+    for row in rows:
+        detail = row[-1]
+        match = SQLITE_SCAN_RE.match(detail)
+        if match and match.group(1) not in ('CONSTANT', 'SUBQUERY') and 'USING' not in match.group(2):
+            problems.append((FULL_SCAN, match.group(1), detail))
+        elif detail.startswith('USE TEMP B-TREE FOR') and 'ORDER BY' in detail:
+            problems.append((SORT, None, detail))
+        elif detail.startswith('USE TEMP B-TREE FOR'):
+            problems.append((TEMPORARY, None, detail))
+    return problems
+
+
+def _mysql_problems(rows):
+    problems = []
+    for row in rows:
+        table, extra = row.get('table'), row.get('Extra') or ''
+        if row.get('type') == 'ALL':
+            problems.append((FULL_SCAN, table, f"type=ALL rows={row.get('rows')}"))
+        if 'Using filesort' in extra:
+            problems.append((SORT, table, extra))
+        if 'Using temporary' in extra:
+            problems.append((TEMPORARY, table, extra))
+    return problems
+
+
+def _postgresql_problems(node):
+    if node['Node Type'] == 'Seq Scan':
+        yield FULL_SCAN, node.get('Alias') or node['Relation Name'], f"Seq Scan on {node['Relation Name']}"
+    elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+        yield SORT, None, f"Sort on {', '.join(node.get('Sort Key', []))}"
+    for child in node.get('Plans', ()):
+        yield from _postgresql_problems(child)
+
+
+# Candidate columns
+
+def table_aliases(sql):
+    """{name or alias used in the statement: table}"""
+    aliases = {}
+    for table, alias in TABLE_RE.findall(sql):
+        aliases.setdefault(table, table)
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+
+def unindexable_spans(sql):
+    """(start, end) of every NOT (...) and FILTER (...) group in the statement"""
+    spans = []
+    for match in UNINDEXABLE_GROUP_RE.finditer(sql):
+        depth = 0
+        for end in range(match.end() - 1, len(sql)):
+            depth += {'(': 1, ')': -1}.get(sql[end], 0)
+            if depth == 0:
+                break
+        spans.append((match.start(), end))
+    return spans
+
+
+def candidate_columns(sql, params, table, aliases):
+    """(equality columns, range columns, [(order column, descending)], columns skipped) for one table"""
+    names = {name for name, target in aliases.items() if target == table}
+    spans = unindexable_spans(sql)
+    equality, ranges, skipped = [], [], []
+    for match in PREDICATE_RE.finditer(sql):
+        qualifier, column, operator = match.group(1), match.group(2), match.group(3).upper()
+        if qualifier not in names or any(start <= match.start() < end for start, end in spans):
+            continue
+        if operator == 'LIKE':
+            value = params[sql[:match.start(4)].count('%s')] if params else None
+            if not isinstance(value, str) or value.startswith('%'):
+                skipped.append(column)
+                continue
+            ranges.append(column)
+        elif operator == '=' or operator.startswith('IN'):
+            equality.append(column)
+        else:
+            ranges.append(column)
+
+    order = []
+    for clause in ORDER_BY_RE.findall(sql):
+        items = ORDER_COLUMN_RE.findall(clause)
+        # An ORDER BY that mixes tables cannot come from one index
+        if items and all(aliases.get(qualifier) == table for qualifier, _, _ in items):
+            order = [(column, (direction or '').upper() == 'DESC') for _, column, direction in items]
+    return list(dict.fromkeys(equality)), list(dict.fromkeys(ranges)), order, skipped
+
+
+def index_columns(equality, ranges, order):
+    """
+    ([(column, descending)], whether the index gives the ORDER BY): equalities,
+    then the ORDER BY if no range comes between, else one range column.
+    """
+    columns = [(column, False) for column in equality]
+    order = [(column, descending) for column, descending in order if column not in equality]
+    if order and (not ranges or ranges[0] == order[0][0]) and len(columns) + len(order) <= 4:
+        return columns + order, True
+    if ranges:
+        columns.append((ranges[0], False))
+    return columns[:4], False
+
+
+# Database statistics
+
+class TableStats:
+    def __init__(self):
+        self._rows = {}
+        self._distinct = {}
+
+    def rows(self, table):
+        if table not in self._rows:
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+                self._rows[table] = cursor.fetchone()[0]
+        return self._rows[table]
+
+    def distinct(self, table, columns):
+        key = (table, tuple(columns))
+        if key not in self._distinct:
+            quoted = ', '.join(connection.ops.quote_name(column) for column in columns)
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT COUNT(*) FROM (SELECT DISTINCT {quoted} FROM {connection.ops.quote_name(table)}) d')
+                self._distinct[key] = cursor.fetchone()[0]
+        return self._distinct[key]
+
+    def covering_index(self, table, columns):
+        """Name of an existing index whose leading columns are these, or None"""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        for name, constraint in constraints.items():
+            if (constraint['index'] or constraint['unique'] or constraint['primary_key']) and \
+                    constraint['columns'][:len(columns)] == columns:
+                return name
+        return None
+
+
+def models_by_table():
+    return {
+        model._meta.db_table: model
+        for model in apps.get_models()
+        if model._meta.app_label in PROJECT_APPS and not model._meta.auto_created
+    }
+
+
+def field_name(model, column):
+    for field in model._meta.concrete_fields:
+        if field.column == column:
+            return field.name
+    return None
+
+
+def estimate_rows(stats, table, equality, ranges, columns, ordered, sql):
+    """Rows an execution would read through the proposed index"""
+    rows = stats.rows(table)
+    estimate = rows / max(stats.distinct(table, equality), 1) if equality else rows
+    if ranges and ranges[0] in [column for column, _ in columns]:
+        estimate *= RANGE_SELECTIVITY
+    limit = LIMIT_RE.search(sql)
+    if ordered and limit:
+        # Rows come out of the index in ORDER BY order, so the read stops at the LIMIT
+        estimate = min(estimate, int(limit.group(1)) + int(limit.group(2) or 0))
+    return max(int(estimate), 1)
+
+
+def advise(statements, min_rows):
+    """
+    Explain every distinct SELECT in statements and propose indexes.
+    Returns (proposals, notes, analysed statements).
+    """
+    groups = group_selects(statements)
+    stats = TableStats()
+    tables = models_by_table()
+    proposals, notes, analysed = {}, [], []
+
+    for digest, statement in groups.items():
+        sql, params = statement['sql'], statement['params']
+        try:
+            replay_ms = replay(sql, params)
+            plan, problems = explain(sql, params)
+        except Exception as e:
+            notes.append(f"Could not replay {statement['fingerprint'][:120]}: {e}")
+            continue
+        if statement['time_ms'] is None:
+            statement['time_ms'] = replay_ms * statement['count']
+        statement.update(plan=plan, problems=problems, replay_ms=replay_ms)
+        analysed.append(statement)
+
+        aliases = table_aliases(sql)
+        order_tables = {aliases.get(qualifier) for clause in ORDER_BY_RE.findall(sql)
+                        for qualifier, _, _ in ORDER_COLUMN_RE.findall(clause)} - {None}
+        first_table = TABLE_RE.search(sql)
+        affected = {}
+        for problem, name, detail in problems:
+            if name is not None:
+                table = aliases.get(name, name)
+            elif len(order_tables) == 1:
+                # SQLite and PostgreSQL do not say which table a sort is for; the ORDER BY does
+                table = next(iter(order_tables))
+            else:
+                table = first_table.group(1) if first_table else None
+            if table is not None:
+                affected.setdefault(table, set()).add(problem)
+
+        for table, kinds in affected.items():
+            if stats.rows(table) < min_rows:
+                continue
+            model = tables.get(table)
+            if model is None:
+                notes.append(f"{', '.join(sorted(kinds))} on {table} ({stats.rows(table):,} rows), which is not a project model")
+                continue
+            equality, ranges, order, skipped = candidate_columns(sql, params, table, aliases)
+            columns, ordered = index_columns(equality, ranges, order)
+            if not columns:
+                reason = f"only matched with a leading-wildcard LIKE on {', '.join(skipped)}" if skipped else 'no filter or order on it'
+                notes.append(f"{', '.join(sorted(kinds))} on {table} in {statement['fingerprint'][:100]}...: {reason}")
+                continue
+            plain = [column for column, _ in columns]
+            existing = stats.covering_index(table, plain)
+            if existing:
+                notes.append(
+                    f"{', '.join(sorted(kinds))} on {table} although index {existing} already leads with "
+                    f"({', '.join(plain)})"
+                )
+                continue
+
+            fields = []
+            for column, descending in columns:
+                name = field_name(model, column)
+                if name is None:
+                    break
+                fields.append(f'-{name}' if descending else name)
+            else:
+                # An index read backwards gives the reverse order, so (a, -b) and (-a, b) are one index
+                key = (model, tuple(fields) if not fields[0].startswith('-') else
+                       tuple(field[1:] if field.startswith('-') else f'-{field}' for field in fields))
+                proposal = proposals.get(key)
+                if proposal is None:
+                    index = models.Index(fields=fields)
+                    index.set_name_with_model(model)
+                    proposal = proposals[key] = {
+                        'model': model, 'table': table, 'fields': fields, 'name': index.name,
+                        'rows': stats.rows(table), 'problems': set(), 'statements': 0, 'executions': 0,
+                        'time_ms': 0.0, 'rows_before': 0, 'rows_after': 0,
+                    }
+                rows_after = estimate_rows(stats, table, equality, ranges, columns, ordered, sql)
+                proposal['problems'] |= kinds
+                proposal['statements'] += 1
+                proposal['executions'] += statement['count']
+                proposal['time_ms'] += statement['time_ms']
+                proposal['rows_before'] += stats.rows(table) * statement['count']
+                proposal['rows_after'] += rows_after * statement['count']
+
+    ranked = sorted(proposals.values(), key=lambda proposal: proposal['rows_before'] - proposal['rows_after'], reverse=True)
+    return ranked, notes, analysed
@@ -0,0 +1,124 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from core import index_advisor
+from core.management.commands.bench import VIEWS, Command as BenchCommand
+from core.queries import QueryRecorder
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a query log (or the benchmark views), EXPLAIN every distinct SELECT and propose Meta.indexes '
+        'for the full scans, sorts and temporary tables found on large tables'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', action='append', default=[], metavar='FILE', help='JSON-lines query log to replay')
+        parser.add_argument('--bench', action='store_true', help="Capture the queries of the bench command's views")
+        parser.add_argument('--save-log', metavar='FILE', help='Also write the statements analysed as a query log')
+        parser.add_argument(
+            '--min-rows', type=int, default=1000, help='Ignore problems on tables with fewer rows than this',
+        )
+
+    def handle(self, *args, **options):
+        if not options['log'] and not options['bench']:
+            raise CommandError('Give at least one --log FILE or --bench')
+
+        statements = []
+        for path in options['log']:
+            try:
+                statements += index_advisor.load_log(path)
+            except (OSError, ValueError) as e:
+                raise CommandError(str(e))
+        if options['bench']:
+            statements += self.capture_bench()
+        if options['save_log']:
+            index_advisor.write_log(statements, options['save_log'])
+            self.stdout.write(f"Query log written to {options['save_log']}")
+
+        proposals, notes, analysed = index_advisor.advise(statements, options['min_rows'])
+        executions = sum(statement['count'] for statement in analysed)
+        select_ms = sum(statement['time_ms'] for statement in analysed) or 1
+        self.stdout.write(
+            f'Analysed {len(analysed)} distinct SELECT statements ({executions:,} executions) on {connection.vendor}'
+        )
+        if options['verbosity'] >= 2:
+            self.show_problems(analysed)
+
+        if not proposals:
+            self.stdout.write(self.style.SUCCESS(f"No missing indexes on tables of {options['min_rows']:,}+ rows"))
+        else:
+            self.show_proposals(proposals, select_ms)
+        if notes:
+            self.stdout.write('\nNot advised:')
+            for note in dict.fromkeys(notes):
+                self.stdout.write(f'  - {note}')
+
+    def capture_bench(self):
+        """Run each benchmark view once and return the statements it ran"""
+        bench = BenchCommand(stdout=self.stdout, stderr=self.stderr)
+        recorder = QueryRecorder(keep_params=True)
+        overrides = {
+            'DEBUG': False,
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+            'QUERY_INSTRUMENTATION_ENABLED': False,
+            # Cached pages and fragments would hide the queries behind them
+            'PAGE_CACHE_ENABLED': False,
+        }
+        with override_settings(**overrides):
+            clients, samples = bench.prepare()
+            with recorder.install():
+                for name, url_name, visitor, sample, query in VIEWS:
+                    url = bench.build_url(url_name, sample, query, samples)
+                    if url is None:
+                        continue
+                    # The statements a failing view ran before it failed are still worth analysing
+                    try:
+                        clients[visitor].get(url)
+                    except Exception as e:
+                        self.stderr.write(f'{name}: {url} failed: {e}')
+        return index_advisor.from_recorder(recorder)
+
+    def show_problems(self, analysed):
+        for statement in sorted(analysed, key=lambda statement: statement['time_ms'], reverse=True):
+            if not statement['problems']:
+                continue
+            self.stdout.write(
+                f"\n{statement['count']} x, {statement['time_ms']:.1f} ms: {statement['fingerprint'][:300]}"
+            )
+            for problem, table, detail in statement['problems']:
+                self.stdout.write(f"    {problem}{f' on {table}' if table else ''}: {detail}")
+
+    def show_proposals(self, proposals, select_ms):
+        by_model = {}
+        for proposal in proposals:
+            by_model.setdefault(proposal['model'], []).append(proposal)
+
+        for model, model_proposals in by_model.items():
+            self.stdout.write(
+                f"\n{model._meta.label}  ({model._meta.db_table}, {model_proposals[0]['rows']:,} rows)\n"
+                f"    class Meta:\n        indexes = ["
+            )
+            for proposal in model_proposals:
+                executions = proposal['executions']
+                self.stdout.write(
+                    f"            # {' + '.join(sorted(proposal['problems']))} in {proposal['statements']} statement(s): "
+                    f"~{proposal['rows_before'] // executions:,} -> ~{proposal['rows_after'] // executions:,} rows read "
+                    f"per execution, {executions:,} executions, {proposal['time_ms'] / select_ms:.0%} of SELECT time"
+                )
+                self.stdout.write(f'            {self.index_code(proposal)},')
+            self.stdout.write('        ]')
+
+        self.stdout.write('\nMigration operations:')
+        for proposal in [proposal for model_proposals in by_model.values() for proposal in model_proposals]:
+            self.stdout.write(
+                f"        migrations.AddIndex(\n"
+                f"            model_name='{proposal['model']._meta.model_name}',\n"
+                f"            index={self.index_code(proposal)},\n"
+                f"        ),"
+            )
+
+    def index_code(self, proposal):
+        return f"models.Index(fields={proposal['fields']!r}, name='{proposal['name']}')"
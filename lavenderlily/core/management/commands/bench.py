@@ -0,0 +1,234 @@
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from cart.models import CartItem
+from core.models import ContactMessage
+from core.queries import QueryRecorder
+from orders.models import Order
+from store.models import Category, Product
+
+ANONYMOUS = 'anonymous'
+CUSTOMER = 'customer'
+STAFF = 'staff'
+
+# (benchmark name, url name, visitor, sample the URL argument comes from, query string)
+VIEWS = [
+    ('home', 'home', ANONYMOUS, None, None),
+    ('about', 'about', ANONYMOUS, None, None),
+    ('contact', 'contact', ANONYMOUS, None, None),
+    ('size_chart', 'size_chart', ANONYMOUS, None, None),
+    ('shop', 'shop', CUSTOMER, None, None),
+    ('shop_search', 'shop', CUSTOMER, None, {'q': 'linen'}),
+    ('shop_category', 'shop', CUSTOMER, None, {'category': 'category'}),
+    ('shop_deep_page', 'shop', CUSTOMER, None, {'page': 50}),
+    ('product_detail', 'product_detail', CUSTOMER, 'product', None),
+    ('cart', 'cart', CUSTOMER, None, None),
+    ('checkout', 'checkout', CUSTOMER, None, None),
+    ('profile', 'profile', CUSTOMER, None, None),
+    ('order_detail', 'order_detail', CUSTOMER, 'order', None),
+    ('admin_dashboard', 'admin_dashboard', STAFF, None, None),
+    ('dashboard_charts', 'dashboard_charts', STAFF, None, None),
+    ('fragment_cache_stats', 'fragment_cache_stats', STAFF, None, None),
+    ('manage_orders', 'manage_orders', STAFF, None, None),
+    ('manage_users', 'manage_users', STAFF, None, None),
+    ('manage_messages', 'manage_messages', STAFF, None, None),
+    ('message_detail', 'message_detail', STAFF, 'message', None),
+    ('manage_homepage', 'manage_homepage', STAFF, None, None),
+    ('manage_contact_page', 'manage_contact_page', STAFF, None, None),
+    ('manage_about_page', 'manage_about_page', STAFF, None, None),
+    ('manage_newsletters', 'manage_newsletters', STAFF, None, None),
+    ('manage_subscribers', 'manage_subscribers', STAFF, None, None),
+    ('manage_products', 'manage_products', STAFF, None, None),
+    ('add_product', 'add_product', STAFF, None, None),
+    ('edit_product', 'edit_product', STAFF, 'product', None),
+    ('manage_categories', 'manage_categories', STAFF, None, None),
+    ('manage_colors', 'manage_colors', STAFF, None, None),
+]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=settings.BASE_DIR, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every storefront and staff view: p50/p95/p99 latency, queries and peak memory, as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per view')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per view first')
+        parser.add_argument('--only', nargs='+', metavar='NAME', help='Benchmark only these views')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Print the change against an earlier JSON result file')
+        parser.add_argument('--no-page-cache', action='store_true', help='Disable the full-page cache')
+
+    def handle(self, *args, **options):
+        views = VIEWS
+        if options['only']:
+            unknown = set(options['only']) - {name for name, *_ in VIEWS}
+            if unknown:
+                raise CommandError(f"Unknown view(s): {', '.join(sorted(unknown))}")
+            views = [view for view in VIEWS if view[0] in options['only']]
+
+        overrides = {
+            # DEBUG would record every query in connection.queries and skew time and memory
+            'DEBUG': False,
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+            'QUERY_INSTRUMENTATION_ENABLED': False,
+        }
+        if options['no_page_cache']:
+            overrides['PAGE_CACHE_ENABLED'] = False
+
+        with override_settings(**overrides):
+            clients, samples = self.prepare()
+            results = {}
+            for name, url_name, visitor, sample, query in views:
+                url = self.build_url(url_name, sample, query, samples)
+                if url is None:
+                    self.stdout.write(self.style.WARNING(f'{name}: skipped, no sample data'))
+                    continue
+                results[name] = self.measure(clients[visitor], url, options)
+                self.report(name, results[name])
+
+        document = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'iterations': options['iterations'],
+                'page_cache': not options['no_page_cache'] and settings.PAGE_CACHE_ENABLED,
+                'rows': {
+                    'products': Product.objects.count(),
+                    'users': User.objects.count(),
+                    'orders': Order.objects.count(),
+                },
+            },
+            'views': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(document, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def prepare(self):
+        staff = User.objects.filter(is_staff=True, is_active=True).first()
+        # A shopper with something in the cart, so checkout renders instead of redirecting
+        customer_id = CartItem.objects.filter(user__is_staff=False).values_list('user', flat=True).first()
+        if staff is None or customer_id is None:
+            raise CommandError('Needs a staff user and a customer with a cart (run seed_benchmark_data)')
+        customer = User.objects.get(pk=customer_id)
+
+        clients = {ANONYMOUS: Client(), CUSTOMER: Client(), STAFF: Client()}
+        clients[CUSTOMER].force_login(customer)
+        clients[STAFF].force_login(staff)
+
+        category = Category.objects.order_by('pk').first()
+        samples = {
+            'product': Product.objects.order_by('pk').values_list('pk', flat=True).first(),
+            'order': Order.objects.filter(user=customer).values_list('pk', flat=True).first(),
+            'message': ContactMessage.objects.order_by('pk').values_list('pk', flat=True).first(),
+            'category': category.name if category else None,
+        }
+        return clients, samples
+
+    def build_url(self, url_name, sample, query, samples):
+        args = []
+        if sample:
+            if samples[sample] is None:
+                return None
+            args = [samples[sample]]
+        url = reverse(url_name, args=args)
+        if query:
+            query = {key: samples.get(value, value) if isinstance(value, str) else value for key, value in query.items()}
+            url += '?' + urlencode(query)
+        return url
+
+    def measure(self, client, url, options):
+        for _ in range(options['warmup']):
+            self.get(client, url)
+
+        timings, query_counts = [], []
+        for _ in range(options['iterations']):
+            recorder = QueryRecorder()
+            with recorder.install():
+                started = time.perf_counter()
+                self.get(client, url)
+                timings.append((time.perf_counter() - started) * 1000)
+            query_counts.append(recorder.count)
+
+        # A separate pass, since tracemalloc slows everything down
+        tracemalloc.start()
+        try:
+            self.get(client, url)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        timings.sort()
+        return {
+            'url': url,
+            'p50_ms': round(percentile(timings, 0.50), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+            'mean_ms': round(sum(timings) / len(timings), 2),
+            'queries': max(query_counts),
+            'peak_memory_kb': round(peak / 1024),
+        }
+
+    def get(self, client, url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'{url} returned {response.status_code}')
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:<22} p50 {result['p50_ms']:>8.1f}ms  p95 {result['p95_ms']:>8.1f}ms  "
+            f"p99 {result['p99_ms']:>8.1f}ms  {result['queries']:>4} queries  {result['peak_memory_kb']:>7,} KB"
+        )
+
+    def compare(self, path, results):
+        with open(path) as f:
+            baseline = json.load(f)
+        self.stdout.write(f"Compared with {path} (commit {baseline['meta'].get('commit')}):")
+        for name, result in results.items():
+            before = baseline['views'].get(name)
+            if before is None:
+                continue
+            change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+            line = (
+                f"{name:<22} p50 {before['p50_ms']:.1f} -> {result['p50_ms']:.1f}ms ({change:+.0f}%)  "
+                f"queries {before['queries']} -> {result['queries']}"
+            )
+            style = self.style.ERROR if change > 10 or result['queries'] > before['queries'] else self.style.SUCCESS
+            self.stdout.write(style(line))
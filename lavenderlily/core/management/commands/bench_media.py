@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.views.static import serve as static_serve
+
+from core.media import serve_media
+
+SIZES = {'20KB': 20 * 1024, '500KB': 500 * 1024, '5MB': 5 * 1024 * 1024}
+
+
+class Command(BaseCommand):
+    help = 'Compare media serving throughput of core.media with the django.views.static helper'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+
+    def handle(self, *args, **options):
+        root = tempfile.mkdtemp(prefix='bench-media-')
+        try:
+            for label, size in SIZES.items():
+                with open(os.path.join(root, f'{label}.bin'), 'wb') as f:
+                    f.write(os.urandom(size))
+            self.run_scenarios(root, options['requests'])
+        finally:
+            shutil.rmtree(root)
+
+    def run_scenarios(self, root, count):
+        factory = RequestFactory()
+        views = [('static()', static_serve), ('serve_media', serve_media)]
+
+        for label, size in SIZES.items():
+            path = f'{label}.bin'
+            etag = serve_media(factory.get('/'), path, root)['ETag']
+            scenarios = [
+                ('full', {}),
+                ('revalidate', {'HTTP_IF_NONE_MATCH': etag}),
+                ('range 64KB', {'HTTP_RANGE': 'bytes=0-65535'}),
+            ]
+            for scenario, headers in scenarios:
+                results = []
+                for name, view in views:
+                    request = factory.get('/', **headers)
+                    elapsed, sent, status = self.measure(view, request, path, root, count)
+                    results.append(f'{name} {count / elapsed:,.0f} req/s {sent / elapsed / 2 ** 20:,.0f} MB/s [{status}]')
+                self.stdout.write(f'{label:>5} {scenario:<10} ' + ' | '.join(results))
+
+        self.stdout.write(self.style.SUCCESS(
+            'In-process numbers; under a WSGI server full responses also get sendfile() via wsgi.file_wrapper'
+        ))
+
+    def measure(self, view, request, path, root, count):
+        sent = 0
+        started = time.perf_counter()
+        for _ in range(count):
+            response = view(request, path, document_root=root)
+            for chunk in response:
+                sent += len(chunk)
+            response.close()
+        return time.perf_counter() - started, sent, response.status_code
@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+from core.newsletter_render import CompiledNewsletter
+
+SAMPLE_HTML = """
+<h1>Hello {{ name }},</h1>
+<p>Our new spring collection has arrived. Discover flowing dresses and linen sets
+crafted for warm evenings.</p>
+<p><a href="https://lavenderlily.ae/store/">Shop the collection</a></p>
+<p style="font-size: 12px">This email was sent to {{ email }}.
+<a href="{{ unsubscribe_url }}">Unsubscribe</a></p>
+<img src="https://lavenderlily.ae/t/{{ token }}.gif" width="1" height="1" alt="">
+"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmark personalised newsletter rendering against the Django template engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=1_000_000,
+            help='Number of personalised bodies to render',
+        )
+        parser.add_argument(
+            '--template-count',
+            type=int,
+            default=20_000,
+            help='Number of bodies rendered with the Django template engine for comparison',
+        )
+
+    def handle(self, *args, **options):
+        count = options['count']
+        template_count = options['template_count']
+
+        compiled = CompiledNewsletter('Spring is here, {{ name }}', '', SAMPLE_HTML)
+        started = time.perf_counter()
+        total_bytes = 0
+        for subscriber_id in range(1, count + 1):
+            values = compiled.merge_values(subscriber_id, f'user{subscriber_id}@example.com', 'Aisha', 1)
+            subject, body = compiled.render(values)
+            total_bytes += len(body)
+        compiled_seconds = time.perf_counter() - started
+
+        self.stdout.write(
+            f'Compiled renderer: {count} bodies in {compiled_seconds:.2f}s '
+            f'({count / compiled_seconds:,.0f}/sec, {total_bytes / 1024 / 1024:.1f} MB)'
+        )
+
+        if template_count:
+            template = Template(SAMPLE_HTML)
+            started = time.perf_counter()
+            for subscriber_id in range(1, template_count + 1):
+                values = compiled.merge_values(subscriber_id, f'user{subscriber_id}@example.com', 'Aisha', 1)
+                template.render(Context(values))
+            template_seconds = time.perf_counter() - started
+            template_rate = template_count / template_seconds
+
+            self.stdout.write(
+                f'Django templates:  {template_count} bodies in {template_seconds:.2f}s ({template_rate:,.0f}/sec)'
+            )
+            self.stdout.write(
+                self.style.SUCCESS(f'Speedup: {(count / compiled_seconds) / template_rate:.1f}x')
+            )
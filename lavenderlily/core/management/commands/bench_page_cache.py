@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+
+class Command(BaseCommand):
+    help = 'Load test a public page with the page cache disabled and enabled, and report the throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url-name', default='home', help='Name of the URL to request')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per run')
+        parser.add_argument('--concurrency', type=int, default=4, help='Number of concurrent clients')
+        parser.add_argument(
+            '--username',
+            help='Also benchmark as this (logged-in) user, exercising the personalized holes',
+        )
+
+    def handle(self, *args, **options):
+        url = reverse(options['url_name'])
+        visitors = [('anonymous', None)]
+        if options['username']:
+            try:
+                visitors.append((options['username'], User.objects.get(username=options['username'])))
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['username']}' does not exist")
+
+        for label, user in visitors:
+            uncached = self.run(url, user, options, enabled=False)
+            cached = self.run(url, user, options, enabled=True)
+            self.stdout.write(f'{label}: uncached {uncached:,.0f} req/s, cached {cached:,.0f} req/s')
+            self.stdout.write(self.style.SUCCESS(f'{label}: {cached / uncached:.1f}x throughput with the page cache'))
+
+    def run(self, url, user, options, enabled):
+        clients = []
+        for _ in range(options['concurrency']):
+            client = Client()
+            if user is not None:
+                client.force_login(user)
+            clients.append(client)
+
+        per_client = max(options['requests'] // len(clients), 1)
+
+        def load(client):
+            for _ in range(per_client):
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} returned {response.status_code}')
+
+        with override_settings(PAGE_CACHE_ENABLED=enabled):
+            cache.clear()
+            # Warm up: fills the page cache and any lazily loaded content
+            load_one = clients[0].get(url)
+            if load_one.status_code != 200:
+                raise CommandError(f'{url} returned {load_one.status_code}')
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+                list(pool.map(load, clients))
+            elapsed = time.perf_counter() - started
+
+        return per_client * len(clients) / elapsed
@@ -0,0 +1,61 @@
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import FileSystemFinder
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from core import assets
+
+
+class Command(BaseCommand):
+    help = 'Collect static files with hashed names, minify the project CSS/JS and write .gz/.br variants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-minify', action='store_true', help='Skip minification')
+        parser.add_argument('--clear', action='store_true', help='Clear STATIC_ROOT before collecting')
+
+    def handle(self, *args, **options):
+        call_command('collectstatic', interactive=False, clear=options['clear'], verbosity=0)
+        root = str(settings.STATIC_ROOT)
+
+        if not options['no_minify']:
+            self.minify(root)
+
+        compressed = {'files': 0, 'bytes': 0, 'gzip': 0, 'br': 0}
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                if not filename.endswith(assets.COMPRESSIBLE_EXTENSIONS):
+                    continue
+                path = os.path.join(directory, filename)
+                written = assets.compress_file(path)
+                if written:
+                    compressed['files'] += 1
+                    compressed['bytes'] += os.path.getsize(path)
+                    for encoding, size in written.items():
+                        compressed[encoding] += size
+
+        summary = f"Compressed {compressed['files']} files: {compressed['bytes'] / 1024:.0f} KB"
+        summary += f" -> gzip {compressed['gzip'] / 1024:.0f} KB"
+        if assets.brotli is not None:
+            summary += f", brotli {compressed['br'] / 1024:.0f} KB"
+        else:
+            summary += ' (install brotli for .br variants)'
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def minify(self, root):
+        """Minify the project's own CSS/JS, both the plain and the hashed copies"""
+        hashed_names, _ = staticfiles_storage.load_manifest()
+        for name, _ in FileSystemFinder().list([]):
+            extension = os.path.splitext(name)[1]
+            if extension not in assets.MINIFIERS or name.endswith(('.min.css', '.min.js')):
+                continue
+
+            # The hash reflects the source file, so it still changes whenever the source does
+            sizes = None
+            for collected in {name, hashed_names.get(name, name)}:
+                path = os.path.join(root, collected)
+                if os.path.isfile(path):
+                    sizes = assets.minify_file(path)
+            if sizes:
+                self.stdout.write(f'{name}: {sizes[0] / 1024:.1f} KB -> {sizes[1] / 1024:.1f} KB minified')
@@ -0,0 +1,107 @@
+import gzip
+import os
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from cart.models import CartItem
+from core import critical_css
+from core.models import UserAddress
+from store.models import Category, Color, Product, Size
+
+# (template, url name)
+PAGES = [
+    ('core/index.html', 'home'),
+    ('store/shop.html', 'shop'),
+    ('store/productdetail.html', 'product_detail'),
+    ('cart/cart.html', 'cart'),
+    ('orders/checkout.html', 'checkout'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Extract the style.css rules each storefront page uses, for inlining by {% critical_stylesheet %}'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stylesheet', default='style.css', help='Static path of the stylesheet to split')
+
+    def handle(self, *args, **options):
+        source = finders.find(options['stylesheet'])
+        if source is None:
+            raise CommandError(f"Static file '{options['stylesheet']}' not found")
+        with open(source, encoding='utf-8') as f:
+            css = f.read()
+
+        pages = self.render_pages()
+
+        full_size = len(css.encode())
+        for template_name, html_pages in pages.items():
+            critical = critical_css.extract(css, html_pages)
+            path = critical_css.critical_path(template_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(critical)
+
+            size = len(critical.encode())
+            self.stdout.write(
+                f'{template_name}: {size / 1024:.1f} KB inlined '
+                f'({len(gzip.compress(critical.encode())) / 1024:.1f} KB gzip), '
+                f'{(full_size - size) / 1024:.1f} KB of {full_size / 1024:.1f} KB deferred '
+                f'({100 * (1 - size / full_size):.0f}% less render-blocking CSS)'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Critical CSS written to {settings.CRITICAL_CSS_DIR}'))
+
+    def render_pages(self):
+        """
+        Render every page anonymously and as a shopper with a cart, against
+        throwaway fixture data; nothing is left in the database or cache.
+        """
+        isolated_cache = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'build-critical-css',
+        }}
+        pages = {}
+        with override_settings(CACHES=isolated_cache, PAGE_CACHE_ENABLED=False), transaction.atomic():
+            product, shopper = self.create_fixtures()
+            anonymous, logged_in = Client(), Client()
+            logged_in.force_login(shopper)
+
+            for template_name, url_name in PAGES:
+                url = reverse(url_name, args=[product.pk] if url_name == 'product_detail' else [])
+                # Login-only pages redirect the anonymous client; those responses are skipped
+                responses = [client.get(url) for client in (anonymous, logged_in)]
+                pages[template_name] = [
+                    response.content.decode(response.charset) for response in responses if response.status_code == 200
+                ]
+                if not pages[template_name]:
+                    raise CommandError(f'{url} returned {responses[-1].status_code}')
+
+            transaction.set_rollback(True)
+        return pages
+
+    def create_fixtures(self):
+        category = Category.objects.create(name='Critical CSS Category')
+        color = Color.objects.create(name='Critical CSS Color', hex_code='#b57edc')
+        size, _ = Size.objects.get_or_create(name='M')
+        products = [
+            Product.objects.create(
+                name=f'Critical CSS Dress {i}', variant_group='critical-css', category=category,
+                color=color, price=Decimal('199.00'), description='Fixture', image_main='products/fixture.jpg',
+            )
+            for i in range(4)
+        ]
+        products[0].sizes.add(size)
+
+        shopper = User.objects.create_user('critical-css-shopper', 'critical-css@example.com')
+        UserAddress.objects.create(
+            user=shopper, full_name='Critical CSS', phone='0500000000', address_line='1 Fixture Street',
+            city='Dubai', state='Dubai', postal_code='00000', country='UAE', is_default=True,
+        )
+        CartItem.objects.create(user=shopper, product=products[0], quantity=2)
+        return products[0], shopper
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from core.models import CustomerSegment
+from core.segments import compute_customer_segments
+
+
+class Command(BaseCommand):
+    help = 'Recompute RFM customer segments from order history (run nightly)'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        summary = compute_customer_segments()
+        elapsed = time.monotonic() - started
+
+        labels = dict(CustomerSegment.SEGMENT_CHOICES)
+        for segment, count in summary.items():
+            self.stdout.write(f'{labels[segment]}: {count}')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Scored {sum(summary.values())} customers in {elapsed:.2f}s'
+            )
+        )
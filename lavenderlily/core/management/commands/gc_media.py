@@ -0,0 +1,129 @@
+import os
+import time
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+
+from core import content_cache, page_cache
+from core.signals import CONTENT_MODELS
+from core.storage import BLOB_DIR, BLOB_TMP_DIR, ContentAddressedStorage, is_blob
+
+
+def file_fields():
+    """(model, field name) for every file field stored in the content-addressed storage"""
+    return [
+        (model, field.name)
+        for model in apps.get_models()
+        for field in model._meta.concrete_fields
+        if isinstance(field, models.FileField) and isinstance(field.storage, ContentAddressedStorage)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Delete content-addressed media blobs that no database row references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Blobs checked and deleted per batch')
+        parser.add_argument(
+            '--grace', type=int, default=3600,
+            help="Seconds before an unreferenced blob may be deleted (its row may not be committed yet)",
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+        parser.add_argument(
+            '--adopt', action='store_true',
+            help='First move files saved before content addressing into blobs, merging duplicates',
+        )
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        if not isinstance(storage, ContentAddressedStorage):
+            raise CommandError('The default storage is not core.storage.ContentAddressedStorage')
+
+        fields = file_fields()
+        if options['adopt']:
+            self.adopt(storage, fields, options['dry_run'])
+
+        cutoff = time.time() - options['grace']
+        referenced = self.referenced_names(fields)
+        candidates = [
+            (name, size) for name, size, mtime in self.walk_blobs(storage)
+            if name not in referenced and mtime < cutoff
+        ]
+
+        deleted = reclaimed = 0
+        for start in range(0, len(candidates), options['batch_size']):
+            batch = dict(candidates[start:start + options['batch_size']])
+            # Rows saved since the scan started may reference a candidate again
+            for model, field_name in fields:
+                for name in model._default_manager.filter(**{f'{field_name}__in': batch}).values_list(field_name, flat=True):
+                    batch.pop(name, None)
+            for name, size in batch.items():
+                if not options['dry_run']:
+                    storage.delete_blob(name)
+                deleted += 1
+                reclaimed += size
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {deleted} unreferenced blobs ({reclaimed / 1024:.0f} KB); {len(referenced)} referenced files kept'
+        ))
+
+    def referenced_names(self, fields):
+        names = set()
+        for model, field_name in fields:
+            names.update(
+                model._default_manager.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                .values_list(field_name, flat=True).iterator()
+            )
+        return names
+
+    def walk_blobs(self, storage):
+        """Yield (name, size, mtime) for every blob, including abandoned temporary uploads"""
+        root = storage.path(BLOB_DIR)
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                full_path = os.path.join(directory, filename)
+                name = os.path.relpath(full_path, storage.location).replace(os.sep, '/')
+                if is_blob(name) or name.startswith(BLOB_TMP_DIR + '/'):
+                    stat = os.stat(full_path)
+                    yield name, stat.st_size, stat.st_mtime
+
+    def adopt(self, storage, fields, dry_run):
+        """Rewrite references to pre-existing files so they point at blobs, then remove the originals"""
+        adopted, saved = 0, 0
+        for name in sorted(self.referenced_names(fields)):
+            if is_blob(name) or not storage.exists(name):
+                continue
+            size = storage.size(name)
+            if dry_run:
+                self.stdout.write(f'Would adopt {name}')
+                continue
+
+            with storage.open(name) as f:
+                new_name = storage.save(name, File(f))
+            duplicate = is_referenced(new_name, fields)
+            with transaction.atomic():
+                changed = set()
+                for model, field_name in fields:
+                    if model._default_manager.filter(**{field_name: name}).update(**{field_name: new_name}):
+                        changed.add(model)
+                # UPDATE skips post_save, so retire cached pages, fragments and content records here
+                for model in changed:
+                    page_cache.bump_tag(model._meta.label_lower)
+                if any(model._meta.label in CONTENT_MODELS for model in changed):
+                    content_cache.invalidate()
+            storage.delete(name)
+            adopted += 1
+            if duplicate:
+                saved += size
+            self.stdout.write(f'{name} -> {new_name}')
+
+        if adopted:
+            self.stdout.write(f'Adopted {adopted} files, {saved / 1024:.0f} KB of duplicates removed')
+
+
+def is_referenced(name, fields):
+    return any(model._default_manager.filter(**{field_name: name}).exists() for model, field_name in fields)
@@ -0,0 +1,493 @@
+import argparse
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError, connection
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.management.commands.bench import git_commit, percentile
+from core.management.commands.seed_benchmark_data import PASSWORD, USERNAME_PREFIX
+from orders.models import Order
+from store.models import Category, Color, Product
+
+# Funnel steps, in order
+SIGNIN = 'signin'
+HOME = 'home'
+SHOP = 'shop'
+PRODUCT = 'product'
+ADD_TO_CART = 'add_to_cart'
+CART = 'cart'
+CHECKOUT = 'checkout'
+PLACE_ORDER = 'place_order'
+PAYMENT = 'payment_callback'
+STEPS = [SIGNIN, HOME, SHOP, PRODUCT, ADD_TO_CART, CART, CHECKOUT, PLACE_ORDER, PAYMENT]
+
+# Journeys a visit can take; --mix sets how often each is picked
+BROWSE = 'browse'
+CART_ONLY = 'cart'
+BUY = 'buy'
+JOURNEYS = (BROWSE, CART_ONLY, BUY)
+
+PRODUCT_LINK_RE = re.compile(r'/store/product/(\d+)/')
+# checkout() names orders LL-<8 hex digits> and shows the number on the payment page
+ORDER_NUMBER_RE = re.compile(r'LL-[0-9A-F]{8}')
+EMIRATES = ['Abu Dhabi', 'Dubai', 'Sharjah', 'Ajman', 'Fujairah', 'Ras Al Khaimah', 'Umm Al Quwain']
+SORTS = ['', 'price_asc', 'price_desc', 'newest']
+
+# Database errors that mean a statement gave up waiting for a lock
+LOCK_ERROR_MARKERS = ('database is locked', 'database table is locked', 'lock wait timeout', 'deadlock')
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for Django's backend: accept every message and count it"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.reply('220 loadtest SMTP sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').split(' ', 1)[0].strip().upper()
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 loadtest')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                self.server.received()
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                # MAIL, RCPT, RSET, NOOP
+                self.reply('250 OK')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPSinkHandler)
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def received(self):
+        with self._lock:
+            self.messages += 1
+
+
+class LockMonitor:
+    """
+    Lock contention in the database while the test runs: InnoDB row lock
+    waits on MySQL, sessions waiting on a lock (sampled) on PostgreSQL, and
+    statements of the in-process server that failed on a lock on any backend
+    (SQLite's "database is locked").
+    """
+
+    def __init__(self):
+        self.lock_errors = 0
+        self.pg_samples = []
+        self._mysql_before = None
+        self._stop = threading.Event()
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    def _count_lock_errors(self, execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as exc:
+            if any(marker in str(exc).lower() for marker in LOCK_ERROR_MARKERS):
+                with self._lock:
+                    self.lock_errors += 1
+            raise
+
+    def _watch_connection(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self._count_lock_errors)
+
+    def _mysql_status(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN ('Innodb_row_lock_waits', 'Innodb_row_lock_time')")
+            return {name: int(value) for name, value in cursor.fetchall()}
+
+    def _sample_postgresql(self):
+        while not self._stop.wait(0.5):
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'")
+                self.pg_samples.append(cursor.fetchone()[0])
+        connection.close()
+
+    def start(self):
+        connection_created.connect(self._watch_connection)
+        if connection.vendor == 'mysql':
+            self._mysql_before = self._mysql_status()
+        elif connection.vendor == 'postgresql':
+            self._sampler = threading.Thread(target=self._sample_postgresql, name='loadtest-locks', daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        connection_created.disconnect(self._watch_connection)
+        report = {'lock_errors': self.lock_errors}
+        if self._mysql_before is not None:
+            after = self._mysql_status()
+            report['innodb_row_lock_waits'] = after['Innodb_row_lock_waits'] - self._mysql_before['Innodb_row_lock_waits']
+            report['innodb_row_lock_ms'] = after['Innodb_row_lock_time'] - self._mysql_before['Innodb_row_lock_time']
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            samples = self.pg_samples or [0]
+            report['sessions_waiting_on_locks_avg'] = round(sum(samples) / len(samples), 2)
+            report['sessions_waiting_on_locks_max'] = max(samples)
+        return report
+
+
+class Results:
+    def __init__(self):
+        self.timings = {step: [] for step in STEPS}
+        self.errors = {step: {} for step in STEPS}
+        self.orders = 0
+        self._lock = threading.Lock()
+
+    def add(self, step, elapsed_ms, error=None):
+        with self._lock:
+            self.timings[step].append(elapsed_ms)
+            if error is not None:
+                self.errors[step][error] = self.errors[step].get(error, 0) + 1
+            elif step == PAYMENT:
+                self.orders += 1
+
+
+class Shopper(threading.Thread):
+    """One virtual shopper: signs in, then makes visits until the deadline"""
+
+    def __init__(self, harness, username, index):
+        super().__init__(name=f'shopper-{index}', daemon=True)
+        self.harness = harness
+        self.username = username
+        self.index = index
+        self.rng = random.Random(f'{harness.seed}-{index}')
+        self.session = requests.Session()
+        self.product_ids = []
+
+    def run(self):
+        self.pause(self.harness.ramp_up * self.index / self.harness.shoppers)
+        if not self.sign_in():
+            return
+        journeys, weights = zip(*self.harness.mix.items())
+        while not self.finished():
+            self.visit(self.rng.choices(journeys, weights)[0])
+
+    def finished(self):
+        return time.monotonic() >= self.harness.deadline
+
+    def pause(self, seconds):
+        time.sleep(max(min(seconds, self.harness.deadline - time.monotonic()), 0))
+
+    def think(self):
+        self.pause(self.rng.uniform(*self.harness.think_time))
+
+    def request(self, step, method, path, data=None, expect=200, location=None):
+        """Make one request and record it; returns the response, or None if it failed"""
+        if data is not None:
+            data = {**data, 'csrfmiddlewaretoken': self.session.cookies.get('csrftoken', '')}
+        error = None
+        started = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, self.harness.base_url + path, data=data, allow_redirects=False, timeout=self.harness.timeout,
+            )
+        except requests.RequestException as exc:
+            response, error = None, type(exc).__name__
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if response is not None:
+            if response.status_code != expect:
+                error = f'HTTP {response.status_code}'
+            elif location is not None and location not in response.headers.get('Location', ''):
+                error = f"redirected to {response.headers.get('Location')}"
+        self.harness.results.add(step, elapsed_ms, error)
+        return None if error else response
+
+    def sign_in(self):
+        path = reverse('signin')
+        # The GET sets the CSRF cookie
+        if self.request(SIGNIN, 'GET', path) is None:
+            return False
+        data = {'email': self.username, 'password': PASSWORD}
+        return self.request(SIGNIN, 'POST', path, data, expect=302, location=reverse('profile')) is not None
+
+    def visit(self, journey):
+        self.request(HOME, 'GET', reverse('home'))
+        self.think()
+
+        query = {'sort': self.rng.choice(SORTS)}
+        if self.harness.categories and self.rng.random() < 0.7:
+            query['category'] = self.rng.choice(self.harness.categories)
+        if self.harness.colors and self.rng.random() < 0.3:
+            query['color'] = self.rng.choice(self.harness.colors)
+        response = self.request(SHOP, 'GET', f"{reverse('shop')}?{urlencode(query)}")
+        if response is not None:
+            # Products the shopper actually saw; the sample keeps filters that match nothing from stalling it
+            self.product_ids = [int(pk) for pk in dict.fromkeys(PRODUCT_LINK_RE.findall(response.text))]
+        candidates = self.product_ids or self.harness.product_ids
+        self.think()
+
+        viewed = []
+        for _ in range(self.rng.randint(1, 3)):
+            if self.finished():
+                return
+            product_id = self.rng.choice(candidates)
+            self.request(PRODUCT, 'GET', reverse('product_detail', args=[product_id]))
+            viewed.append(product_id)
+            self.think()
+
+        if journey == BROWSE or self.finished():
+            return
+        product_id = self.rng.choice(viewed)
+        data = {'quantity': self.rng.randint(1, 2), 'next': reverse('cart')}
+        if self.request(ADD_TO_CART, 'POST', reverse('add_to_cart', args=[product_id]), data, expect=302) is None:
+            return
+        self.request(CART, 'GET', reverse('cart'))
+        self.think()
+
+        if journey == CART_ONLY or self.finished():
+            return
+        if self.request(CHECKOUT, 'GET', reverse('checkout')) is None:
+            return
+        self.think()
+        address = {
+            'full_name': f'Load Test {self.index}',
+            'phone': f'+9715{self.index:08d}',
+            'address': f'{self.index} Lavender Street',
+            'city': 'Dubai',
+            'state': EMIRATES[self.index % len(EMIRATES)],
+            'postal_code': '00000',
+            'country': 'United Arab Emirates',
+            'payment_method': 'Fake Payment',
+        }
+        response = self.request(PLACE_ORDER, 'POST', reverse('checkout'), address)
+        match = ORDER_NUMBER_RE.search(response.text) if response is not None else None
+        if match is None:
+            return
+        self.think()
+        self.request(
+            PAYMENT, 'POST', reverse('payment_callback'), {'order_number': match.group()},
+            expect=302, location=reverse('payment_status', args=['success']),
+        )
+
+
+def parse_mix(value):
+    """'browse=60,cart=25,buy=15' -> {'browse': 60.0, 'cart': 25.0, 'buy': 15.0}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in JOURNEYS:
+            raise argparse.ArgumentTypeError(f"Unknown journey '{name}' in --mix (use {', '.join(JOURNEYS)})")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"--mix needs a number for '{name}'")
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError('--mix needs at least one journey with a weight above 0')
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test the shopping funnel (home, shop, product, add to cart, checkout, payment callback) with '
+        'concurrent virtual shoppers against a local server and a local SMTP sink; uses the seed_benchmark_data users'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shoppers', type=int, default=20, help='Concurrent virtual shoppers')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds to run for, ramp-up included')
+        parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which the shoppers start')
+        parser.add_argument(
+            '--think-time', type=float, nargs=2, default=(0.2, 1.0), metavar=('MIN', 'MAX'),
+            help='Seconds a shopper pauses between pages, drawn uniformly',
+        )
+        parser.add_argument(
+            '--mix', type=parse_mix, default='browse=60,cart=25,buy=15',
+            help='Relative weights of the journeys: browse only, add to cart, or buy',
+        )
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as failed')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the shoppers')
+        parser.add_argument(
+            '--url', help='Test a server that is already running at this URL instead of starting one (no SMTP sink)',
+        )
+        parser.add_argument('--output', help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['shoppers'] < 1:
+            raise CommandError('--shoppers must be at least 1')
+        usernames = list(
+            User.objects.filter(username__startswith=USERNAME_PREFIX, is_staff=False, is_active=True)
+            .order_by('pk').values_list('username', flat=True)[:options['shoppers']]
+        )
+        product_ids = list(Product.objects.order_by('?').values_list('pk', flat=True)[:500])
+        if len(usernames) < options['shoppers'] or not product_ids:
+            raise CommandError(
+                f"Needs {options['shoppers']} shoppers and some products; found {len(usernames)} and "
+                f"{len(product_ids)} (run seed_benchmark_data)"
+            )
+
+        self.seed = options['seed']
+        self.shoppers = options['shoppers']
+        self.ramp_up = options['ramp_up']
+        self.think_time = options['think_time']
+        self.mix = options['mix']
+        self.timeout = options['timeout']
+        self.product_ids = product_ids
+        self.categories = list(Category.objects.values_list('name', flat=True))
+        self.colors = list(Color.objects.values_list('name', flat=True))
+        self.results = Results()
+
+        sink = server = None
+        overrides = {}
+        if options['url']:
+            self.base_url = options['url'].rstrip('/')
+        else:
+            sink = SMTPSink()
+            threading.Thread(target=sink.serve_forever, name='loadtest-smtp', daemon=True).start()
+            overrides = {
+                'DEBUG': False,
+                'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, '127.0.0.1'],
+                'EMAIL_BACKEND': 'core.email_backends.InstrumentedEmailBackend',
+                'INSTRUMENTED_EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+                'EMAIL_HOST': '127.0.0.1',
+                'EMAIL_PORT': sink.server_address[1],
+                'EMAIL_USE_TLS': False,
+                'EMAIL_USE_SSL': False,
+                'EMAIL_HOST_USER': '',
+                'EMAIL_HOST_PASSWORD': '',
+            }
+
+        orders_before = Order.objects.count()
+        monitor = LockMonitor()
+        with override_settings(**overrides):
+            if not options['url']:
+                server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+                server.set_app(get_wsgi_application())
+                threading.Thread(target=server.serve_forever, name='loadtest-server', daemon=True).start()
+                self.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+            self.stdout.write(
+                f"{self.shoppers} shoppers for {options['duration']:g}s against {self.base_url} "
+                f"(mix {', '.join(f'{name}={weight:g}' for name, weight in self.mix.items())})"
+            )
+            monitor.start()
+            started = time.monotonic()
+            self.deadline = started + options['duration']
+            shoppers = [Shopper(self, username, index) for index, username in enumerate(usernames)]
+            try:
+                for shopper in shoppers:
+                    shopper.start()
+                for shopper in shoppers:
+                    # A request in flight at the deadline may take up to --timeout
+                    shopper.join(max(self.deadline - time.monotonic(), 0) + options['timeout'])
+            finally:
+                elapsed = time.monotonic() - started
+                locks = monitor.stop()
+                if server is not None:
+                    server.shutdown()
+                    server.server_close()
+                if sink is not None:
+                    sink.shutdown()
+                    sink.server_close()
+
+        document = self.summarize(elapsed, locks, sink, Order.objects.count() - orders_before, options)
+        self.report(document)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(document, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def summarize(self, elapsed, locks, sink, orders_created, options):
+        steps = {}
+        for step in STEPS:
+            timings = sorted(self.results.timings[step])
+            if not timings:
+                continue
+            errors = sum(self.results.errors[step].values())
+            steps[step] = {
+                'requests': len(timings),
+                'errors': errors,
+                'error_rate': round(errors / len(timings), 4),
+                'error_kinds': self.results.errors[step],
+                'p50_ms': round(percentile(timings, 0.50), 1),
+                'p90_ms': round(percentile(timings, 0.90), 1),
+                'p95_ms': round(percentile(timings, 0.95), 1),
+                'p99_ms': round(percentile(timings, 0.99), 1),
+                'max_ms': round(timings[-1], 1),
+            }
+        total = sum(step['requests'] for step in steps.values())
+        errors = sum(step['errors'] for step in steps.values())
+        return {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'url': self.base_url,
+                'shoppers': self.shoppers,
+                'duration_s': round(elapsed, 1),
+                'think_time_s': list(self.think_time),
+                'mix': self.mix,
+            },
+            'throughput': {
+                'requests': total,
+                'requests_per_s': round(total / elapsed, 2) if elapsed else 0,
+                'errors': errors,
+                'error_rate': round(errors / total, 4) if total else 0,
+                'orders_paid': self.results.orders,
+                'orders_paid_per_min': round(self.results.orders / elapsed * 60, 2) if elapsed else 0,
+                'orders_created': orders_created,
+                'emails_sent': sink.messages if sink is not None else None,
+            },
+            'db_locks': locks,
+            'steps': steps,
+        }
+
+    def report(self, document):
+        throughput = document['throughput']
+        self.stdout.write(
+            f"{throughput['requests']} requests in {document['meta']['duration_s']}s: "
+            f"{throughput['requests_per_s']} req/s, {throughput['errors']} errors ({throughput['error_rate']:.2%}), "
+            f"{throughput['orders_paid']} orders paid ({throughput['orders_paid_per_min']}/min)"
+        )
+        if throughput['emails_sent'] is not None:
+            self.stdout.write(f"{throughput['emails_sent']} emails reached the SMTP sink")
+        self.stdout.write('DB locks: ' + ', '.join(f'{name} {value}' for name, value in document['db_locks'].items()))
+
+        self.stdout.write(
+            f"{'step':<17}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p90 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+        )
+        for name, step in document['steps'].items():
+            line = (
+                f"{name:<17}{step['requests']:>9}{step['errors']:>8}{step['p50_ms']:>9.1f}{step['p90_ms']:>9.1f}"
+                f"{step['p95_ms']:>9.1f}{step['p99_ms']:>9.1f}{step['max_ms']:>9.1f}"
+            )
+            self.stdout.write(self.style.ERROR(line) if step['errors'] else line)
+            for kind, count in step['error_kinds'].items():
+                self.stdout.write(f'    {count} x {kind}')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from core.counters import FAMILIES, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recompute the site counters from their source tables and correct any drift (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--only',
+            nargs='+',
+            choices=[family.prefix.rstrip(':') for family in FAMILIES],
+            help='Only reconcile these counter families',
+        )
+
+    def handle(self, *args, **options):
+        families = FAMILIES
+        if options['only']:
+            families = [family for family in FAMILIES if family.prefix.rstrip(':') in options['only']]
+
+        values, drift = reconcile(families)
+
+        for key, (stored, actual) in sorted(drift.items()):
+            self.stdout.write(self.style.WARNING(f'{key}: {stored} -> {actual}'))
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Reconciled {len(values)} counters, corrected {len(drift)}')
+        )
@@ -0,0 +1,280 @@
+import io
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from cart.models import CartItem, WishlistItem
+from core import page_cache
+from core.models import ContactMessage, NewsletterSubscriber, UserAddress
+from orders.models import Order, OrderItem
+from store.models import Category, Color, Product, Review, Size
+
+# Row counts at --scale 1; categories and colors are lookup tables and do not scale
+VOLUMES = {
+    'categories': 40,
+    'colors': 60,
+    'products': 50_000,
+    'users': 200_000,
+    'reviews': 500_000,
+    'orders': 400_000,
+    'subscribers': 1_000_000,
+    'messages': 20_000,
+    'cart_items': 20_000,
+    'wishlist_items': 100_000,
+}
+# Orders get 1-4 items, ~2.5 on average: 1M order items at --scale 1
+MAX_ITEMS_PER_ORDER = 4
+HISTORY_DAYS = 730
+
+USERNAME_PREFIX = 'bench'
+PASSWORD = 'bench-password'
+SIZE_NAMES = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+STATUS_WEIGHTS = {'delivered': 70, 'shipped': 10, 'processing': 10, 'cancelled': 6, 'returned': 4}
+WORDS = (
+    'linen silk chiffon satin floral pleated wrap maxi midi tiered ruffled embroidered '
+    'lavender ivory sage blush relaxed tailored flowing summer evening classic'
+).split()
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Let bulk_create keep the timestamps we generate instead of stamping every row with now()"""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def field(model, name):
+    return model._meta.get_field(name)
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate a reproducible, realistically sized data set for benchmarks (use an empty database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for every volume (0.01 for a quick run)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed gives the same data')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT batch')
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Do not rebuild site counters and sales rollups afterwards',
+        )
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+            raise CommandError('Benchmark data is already present; seed an empty database (e.g. after manage.py flush)')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.volumes = {
+            name: count if name in ('categories', 'colors') else max(int(count * options['scale']), 1)
+            for name, count in VOLUMES.items()
+        }
+
+        started = time.perf_counter()
+        self.step('catalog', self.seed_catalog)
+        self.step('users', self.seed_users)
+        self.step('reviews', self.seed_reviews)
+        self.step('orders', self.seed_orders)
+        self.step('subscribers', self.seed_subscribers)
+        self.step('messages', self.seed_messages)
+        self.step('carts', self.seed_carts)
+
+        if not options['skip_derived']:
+            self.step('counters', lambda: call_command('reconcile_counters', stdout=io.StringIO()))
+            self.step('rollups', lambda: call_command('rollup_sales', backfill=True, stdout=io.StringIO()))
+        for model in page_cache.VERSIONED_MODELS:
+            page_cache.bump_tag(model.lower())
+
+        self.stdout.write(self.style.SUCCESS(f'Seeded benchmark data in {time.perf_counter() - started:.0f}s'))
+
+    def step(self, label, seed):
+        started = time.perf_counter()
+        rows = seed()
+        elapsed = time.perf_counter() - started
+        if rows is None:
+            self.stdout.write(f'{label}: {elapsed:.1f}s')
+        else:
+            self.stdout.write(f'{label}: {rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-6):,.0f} rows/s)')
+
+    def random_time(self):
+        return self.now - timedelta(seconds=self.rng.randrange(HISTORY_DAYS * 86400))
+
+    def bulk(self, model, objects, key=None):
+        """
+        Insert an iterable of unsaved objects in batches; returns the primary keys.
+        Pass key, a column unique among the new rows, when the caller needs the keys.
+        """
+        pks, batch = [], []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                pks.extend(self.insert(model, batch, key))
+                batch = []
+        if batch:
+            pks.extend(self.insert(model, batch, key))
+        return pks
+
+    def insert(self, model, batch, key=None):
+        with transaction.atomic():
+            created = model.objects.bulk_create(batch, batch_size=self.batch_size)
+            if key is None or all(obj.pk is not None for obj in created):
+                return [obj.pk for obj in created]
+            # MySQL does not return primary keys from bulk inserts; read them back by the unique column
+            values = [getattr(obj, key) for obj in created]
+            pks = dict(model.objects.filter(**{f'{key}__in': values}).values_list(key, 'pk'))
+            return [pks[value] for value in values]
+
+    def seed_catalog(self):
+        rng = self.rng
+        sizes = [Size.objects.get_or_create(name=name, defaults={'order': index})[0] for index, name in enumerate(SIZE_NAMES)]
+        self.category_ids = self.bulk(Category, (
+            Category(name=f'Bench Category {i}', slug=f'bench-category-{i}', description='Benchmark category')
+            for i in range(self.volumes['categories'])
+        ), key='slug')
+        self.color_ids = self.bulk(Color, (
+            Color(name=f'Bench Color {i}', hex_code='#%06x' % rng.randrange(0x1000000))
+            for i in range(self.volumes['colors'])
+        ), key='name')
+
+        def products():
+            # Variant groups share a design across 1-4 colors
+            i = 0
+            while i < self.volumes['products']:
+                group = f'bench-design-{i}'
+                category_id = rng.choice(self.category_ids)
+                price = Decimal(rng.randrange(99, 1500))
+                name = ' '.join(rng.sample(WORDS, 3)).title()
+                for color_id in rng.sample(self.color_ids, min(rng.randint(1, 4), self.volumes['products'] - i)):
+                    yield Product(
+                        name=f'{name} {i}', slug=f'bench-product-{i}', variant_group=group,
+                        category_id=category_id, color_id=color_id, price=price,
+                        description=' '.join(rng.choices(WORDS, k=40)), sku=f'BENCH-{i:06d}',
+                        material='100% linen', care='Hand wash cold', image_main='products/bench.jpg',
+                        created_at=self.random_time(),
+                    )
+                    i += 1
+
+        with explicit_timestamps(field(Product, 'created_at')):
+            self.product_ids = self.bulk(Product, products(), key='slug')
+
+        through = Product.sizes.through
+        size_rows = self.bulk(through, (
+            through(product_id=product_id, size_id=size.pk)
+            for product_id in self.product_ids
+            for size in rng.sample(sizes, rng.randint(2, len(sizes)))
+        ))
+        return len(self.category_ids) + len(self.color_ids) + len(self.product_ids) + len(size_rows)
+
+    def seed_users(self):
+        # Hashing once instead of per user keeps this step fast; every user's password is PASSWORD
+        password = make_password(PASSWORD)
+        self.user_ids = self.bulk(User, (
+            User(
+                username=f'{USERNAME_PREFIX}{i}', email=f'{USERNAME_PREFIX}{i}@example.com', password=password,
+                first_name=self.rng.choice(['Aisha', 'Fatima', 'Layla', 'Sara', 'Noor', 'Mariam']),
+                last_name=self.rng.choice(['Khan', 'Haddad', 'Nasser', 'Saleh', 'Rahman']),
+                date_joined=self.random_time(),
+            )
+            for i in range(self.volumes['users'])
+        ), key='username')
+        User.objects.create_user(
+            f'{USERNAME_PREFIX}-staff', f'{USERNAME_PREFIX}-staff@example.com', PASSWORD, is_staff=True,
+        )
+        self.address_ids = self.bulk(UserAddress, (
+            UserAddress(
+                user_id=user_id, full_name='Bench Customer', phone='0500000000', address_line='1 Benchmark Street',
+                city=self.rng.choice(['Dubai', 'Abu Dhabi', 'Sharjah']), state='UAE', postal_code='00000',
+                country='United Arab Emirates', is_default=True,
+            )
+            for user_id in self.user_ids
+        ), key='user_id')
+        return len(self.user_ids) + len(self.address_ids)
+
+    def seed_reviews(self):
+        rng = self.rng
+        with explicit_timestamps(field(Review, 'created_at')):
+            return len(self.bulk(Review, (
+                Review(
+                    product_id=rng.choice(self.product_ids), user_id=rng.choice(self.user_ids), name='Bench Reviewer',
+                    rating=rng.choices([1, 2, 3, 4, 5], [2, 3, 10, 35, 50])[0],
+                    comment=' '.join(rng.choices(WORDS, k=20)), created_at=self.random_time(),
+                )
+                for _ in range(self.volumes['reviews'])
+            )))
+
+    def seed_orders(self):
+        rng = self.rng
+        statuses, weights = list(STATUS_WEIGHTS), list(STATUS_WEIGHTS.values())
+        prices = dict(Product.objects.filter(pk__in=self.product_ids).values_list('pk', 'price').iterator())
+        orders = items = 0
+
+        with explicit_timestamps(field(Order, 'created_at'), field(Order, 'updated_at')):
+            for start in range(0, self.volumes['orders'], self.batch_size):
+                batch, lines = [], []
+                for i in range(start, min(start + self.batch_size, self.volumes['orders'])):
+                    index = rng.randrange(len(self.user_ids))
+                    products = [(pk, rng.randint(1, 3)) for pk in rng.sample(self.product_ids, rng.randint(1, MAX_ITEMS_PER_ORDER))]
+                    created_at = self.random_time()
+                    batch.append(Order(
+                        user_id=self.user_ids[index], shipping_address_id=self.address_ids[index],
+                        order_number=f'BENCH{i:010d}', status=rng.choices(statuses, weights)[0],
+                        total_amount=sum(prices[pk] * quantity for pk, quantity in products),
+                        created_at=created_at, updated_at=created_at,
+                    ))
+                    lines.append(products)
+
+                order_ids = self.insert(Order, batch, key='order_number')
+                items += len(self.insert(OrderItem, [
+                    OrderItem(order_id=order_id, product_id=pk, quantity=quantity, price=prices[pk])
+                    for order_id, products in zip(order_ids, lines)
+                    for pk, quantity in products
+                ]))
+                orders += len(order_ids)
+        return orders + items
+
+    def seed_subscribers(self):
+        return len(self.bulk(NewsletterSubscriber, (
+            NewsletterSubscriber(email=f'subscriber{i}@bench.example.com', is_active=self.rng.random() > 0.08)
+            for i in range(self.volumes['subscribers'])
+        )))
+
+    def seed_messages(self):
+        with explicit_timestamps(field(ContactMessage, 'created_at')):
+            return len(self.bulk(ContactMessage, (
+                ContactMessage(
+                    name='Bench Visitor', email=f'visitor{i}@bench.example.com', subject='Question about sizing',
+                    message=' '.join(self.rng.choices(WORDS, k=30)), is_read=self.rng.random() > 0.3,
+                    created_at=self.random_time(),
+                )
+                for i in range(self.volumes['messages'])
+            )))
+
+    def seed_carts(self):
+        rng = self.rng
+        shoppers = rng.sample(self.user_ids, min(self.volumes['cart_items'], len(self.user_ids)))
+        cart = self.bulk(CartItem, (
+            CartItem(user_id=user_id, product_id=rng.choice(self.product_ids), quantity=rng.randint(1, 3))
+            for user_id in shoppers
+        ))
+        # dict.fromkeys drops duplicate (user, product) pairs but keeps the generated order
+        pairs = dict.fromkeys(
+            (rng.choice(self.user_ids), rng.choice(self.product_ids)) for _ in range(self.volumes['wishlist_items'])
+        )
+        wishlist = self.bulk(WishlistItem, (WishlistItem(user_id=user_id, product_id=product_id) for user_id, product_id in pairs))
+        return len(cart) + len(wishlist)
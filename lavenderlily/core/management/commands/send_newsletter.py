@@ -53,8 +53,8 @@ class Command(BaseCommand):
 
         if dry_run:
             # Count subscribers without sending
-            from core.models import NewsletterSubscriber
-            subscriber_count = NewsletterSubscriber.objects.filter(is_active=True).count()
+            from core.segments import newsletter_recipients
+            subscriber_count = newsletter_recipients(newsletter).count()
             self.stdout.write(
                 f'DRY RUN: Would send to {subscriber_count} subscribers'
             )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from core import slow_queries
+from core.models import QueryFingerprint
+
+
+class Command(BaseCommand):
+    help = 'List the SQL fingerprints with the most total time from the slow-query log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='How many fingerprints to list')
+        parser.add_argument('--view', help='Only statements run by this view name')
+        parser.add_argument('--explain', action='store_true', help='Print the stored EXPLAIN plan of each fingerprint')
+        parser.add_argument('--reset', action='store_true', help='Delete the collected statistics and exit')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            deleted, _ = QueryFingerprint.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} fingerprint rows'))
+            return
+
+        rows = slow_queries.top_fingerprints(options['limit'], options['view'])
+        if not rows:
+            self.stdout.write('No queries recorded yet.')
+            return
+
+        grand_total = sum(row['total_ms'] for row in rows) or 1
+        self.stdout.write(f"{'#':>3} {'total ms':>10} {'share':>6} {'count':>9} {'mean ms':>9} {'max ms':>9}  views")
+        for index, row in enumerate(rows, 1):
+            views = ', '.join(f'{view} ({count})' for view, count in row['views'].items())
+            self.stdout.write(
+                f"{index:>3} {row['total_ms']:>10.1f} {row['total_ms'] / grand_total:>6.0%} {row['count']:>9} "
+                f"{row['mean_ms']:>9.3f} {row['max_ms']:>9.2f}  {views}"
+            )
+            self.stdout.write(f"    {row['fingerprint']}")
+            if options['explain'] and row['plan']:
+                for line in row['plan'].splitlines():
+                    self.stdout.write(f'      {line}')
+            self.stdout.write('')
@@ -0,0 +1,55 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import tracing
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != '/v1/traces':
+            self.send_error(404)
+            return
+        if self.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+            # OTLP/HTTP also allows protobuf, which the stand-in does not decode
+            self.send_error(415, 'Only OTLP/JSON is accepted')
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            records = tracing.from_otlp(payload)
+        except (ValueError, KeyError, TypeError) as exc:
+            self.send_error(400, f'Malformed OTLP/JSON: {exc}')
+            return
+        tracing.append_jsonl(records)
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.command.stdout.write(format % args)
+
+
+class Command(BaseCommand):
+    help = 'Stand-in OTLP/HTTP collector: write the traces POSTed to /v1/traces to TRACING_FILE'
+
+    def add_arguments(self, parser):
+        endpoint = urlsplit(settings.TRACING_OTLP_ENDPOINT)
+        parser.add_argument('--host', default=endpoint.hostname or '127.0.0.1')
+        parser.add_argument('--port', type=int, default=endpoint.port or 4318)
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer((options['host'], options['port']), CollectorHandler)
+        server.command = self
+        self.stdout.write(f"Collecting traces on http://{options['host']}:{options['port']}/v1/traces into {settings.TRACING_FILE}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,152 @@
+"""
+Production serving of uploaded media.
+
+serve_media() answers conditional requests from strong ETags and
+Last-Modified (304/412), supports single byte ranges (206/416) and streams
+whole files through FileResponse, which WSGI servers hand to sendfile()
+through wsgi.file_wrapper. With MEDIA_SENDFILE_BACKEND set, files of at
+least MEDIA_SENDFILE_MIN_SIZE bytes are handed to the front proxy via
+X-Accel-Redirect (nginx) or X-Sendfile (Apache/lighttpd) instead.
+
+Content-addressed blobs (core.storage) carry their SHA-256 in the name, so
+it doubles as their ETag and they are cached as immutable.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from .assets import IMMUTABLE_CACHE_CONTROL
+from .storage import is_blob
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+REVALIDATE_CACHE_CONTROL = 'public, max-age=3600'
+RANGE_CHUNK_SIZE = 64 * 1024
+
+X_ACCEL_REDIRECT = 'x-accel-redirect'
+X_SENDFILE = 'x-sendfile'
+
+
+def file_etag(name, stat):
+    if is_blob(name):
+        return '"%s"' % posixpath.splitext(posixpath.basename(name))[0]
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+
+def parse_range(header, size):
+    """
+    Return (start, end) inclusive for a single satisfiable byte range, None to
+    ignore the header (absent, malformed or multi-range) and False when the
+    range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _if_range_matches(request, etag, mtime):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(mtime) <= date
+
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _offload(name, full_path):
+    backend = settings.MEDIA_SENDFILE_BACKEND
+    response = HttpResponse()
+    if backend == X_ACCEL_REDIRECT:
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(name)
+    elif backend == X_SENDFILE:
+        response['X-Sendfile'] = full_path
+    else:
+        raise ValueError(f'Unknown MEDIA_SENDFILE_BACKEND {backend!r}')
+    # Let the proxy fill these in from the file it serves
+    del response['Content-Type']
+    return response
+
+
+def serve_media(request, path, document_root):
+    try:
+        full_path = safe_join(document_root, path)
+    except SuspiciousFileOperation:
+        raise Http404('Media file not found')
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('Media file not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Media file not found')
+
+    name = path.replace(os.sep, '/')
+    etag = file_etag(name, stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if is_blob(name) else REVALIDATE_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+    }
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified.headers.setdefault(header, value)
+        return not_modified
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    if settings.MEDIA_SENDFILE_BACKEND and stat.st_size >= settings.MEDIA_SENDFILE_MIN_SIZE:
+        # The proxy handles Range and conditional headers itself
+        response = _offload(name, full_path)
+    else:
+        byte_range = None
+        if request.method == 'GET' and 'Range' in request.headers and _if_range_matches(request, etag, stat.st_mtime):
+            byte_range = parse_range(request.headers['Range'], stat.st_size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+        elif byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(_read_range(full_path, start, end), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            response['Content-Length'] = end - start + 1
+        else:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
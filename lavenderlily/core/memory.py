@@ -0,0 +1,242 @@
+"""
+Opt-in worker memory monitoring (MEMORY_MONITOR_ENABLED).
+
+core.middleware.MemoryMonitorMiddleware starts tracemalloc and measures
+every request: how far traced allocations peaked above where they started,
+how much of that was still held afterwards, and how much the process RSS
+grew. Totals and maxima are kept per view. A request whose allocation peak
+reaches MEMORY_VIEW_ALLOCATION_THRESHOLD_MB is logged (logger core.memory)
+and listed on the staff memory page.
+
+tracemalloc's counters are process-wide, so with a threaded worker the
+figures of a request include whatever concurrent requests allocated at the
+same time; they are exact for sync workers.
+
+A background thread takes a tracemalloc snapshot every
+MEMORY_SNAPSHOT_SECONDS and diffs it against the previous one by source
+line, which shows the allocation sites that keep growing.
+
+When MEMORY_RSS_LIMIT_MB is set and a request leaves the worker above it,
+the worker sends itself MEMORY_RECYCLE_SIGNAL after that response has been
+sent. SIGTERM is a graceful shutdown for gunicorn and uWSGI workers (the
+master starts a replacement), so the worker is recycled between requests.
+
+Everything here is per process: the staff page shows the worker that
+served it.
+"""
+import json
+import logging
+import os
+import resource
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+from django.conf import settings
+from django.utils import timezone
+
+from .profiling import _short_path
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+OFFENDERS_KEPT = 50
+
+# Allocations made by tracemalloc, this module and the import system are not the application's
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+_lock = threading.Lock()
+# {view: {'requests', 'peak_total', 'peak_max', 'retained_total', 'rss_growth_total', 'rss_growth_max', 'over_threshold'}}
+_views = {}
+_offenders = deque(maxlen=OFFENDERS_KEPT)
+_latest_diff = None
+_sampler_pid = None
+_recycling = False
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        # No procfs (macOS): the peak RSS is the closest available figure
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def start():
+    """Start tracing allocations; the snapshot thread starts with the first request of each worker"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(settings.MEMORY_TRACEMALLOC_FRAMES)
+
+
+def _ensure_sampler():
+    # Threads do not survive a fork, so every worker process starts its own
+    global _sampler_pid
+    if _sampler_pid == os.getpid():
+        return
+    with _lock:
+        if _sampler_pid == os.getpid():
+            return
+        _sampler_pid = os.getpid()
+    threading.Thread(target=_snapshot_loop, name='memory-snapshots', daemon=True).start()
+
+
+def _snapshot_loop():
+    previous = take_snapshot()
+    while True:
+        time.sleep(settings.MEMORY_SNAPSHOT_SECONDS)
+        current = take_snapshot()
+        record_diff(current, previous)
+        previous = current
+
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+
+def record_diff(current, previous):
+    """Keep (and log) the allocation sites that grew the most between two snapshots"""
+    global _latest_diff
+    rows = []
+    for stat in current.compare_to(previous, 'lineno')[:settings.MEMORY_SNAPSHOT_TOP]:
+        frame = stat.traceback[0]
+        rows.append({
+            'site': f'{_short_path(frame.filename)}:{frame.lineno}',
+            'size_kb': round(stat.size / 1024, 1),
+            'size_diff_kb': round(stat.size_diff / 1024, 1),
+            'count': stat.count,
+            'count_diff': stat.count_diff,
+        })
+    _latest_diff = {
+        'taken_at': timezone.now().isoformat(),
+        'interval_s': settings.MEMORY_SNAPSHOT_SECONDS,
+        'rss_mb': round(current_rss() / MB, 1),
+        'traced_mb': round(tracemalloc.get_traced_memory()[0] / MB, 1),
+        'sites': rows,
+    }
+    growing = [row for row in rows if row['size_diff_kb'] > 0][:5]
+    if growing:
+        logger.info(
+            'Allocation sites that grew most in the last %ss: %s', settings.MEMORY_SNAPSHOT_SECONDS,
+            ', '.join(f"{row['site']} +{row['size_diff_kb']} KB" for row in growing),
+        )
+
+
+def measure(get_response, request):
+    """Run the request and record its allocation peak, retained allocations and RSS growth"""
+    _ensure_sampler()
+    rss_before = current_rss()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+
+    response = get_response(request)
+
+    traced_after, traced_peak = tracemalloc.get_traced_memory()
+    rss_after = current_rss()
+    match = request.resolver_match
+    view = match.view_name if match else 'unresolved'
+    peak = max(traced_peak - traced_before, 0)
+    retained = traced_after - traced_before
+    rss_growth = rss_after - rss_before
+    over_threshold = peak >= settings.MEMORY_VIEW_ALLOCATION_THRESHOLD_MB * MB
+
+    with _lock:
+        stats = _views.get(view)
+        if stats is None:
+            stats = _views[view] = {
+                'requests': 0, 'peak_total': 0, 'peak_max': 0, 'retained_total': 0,
+                'rss_growth_total': 0, 'rss_growth_max': 0, 'over_threshold': 0,
+            }
+        stats['requests'] += 1
+        stats['peak_total'] += peak
+        stats['peak_max'] = max(stats['peak_max'], peak)
+        stats['retained_total'] += retained
+        stats['rss_growth_total'] += rss_growth
+        stats['rss_growth_max'] = max(stats['rss_growth_max'], rss_growth)
+        stats['over_threshold'] += over_threshold
+
+    if over_threshold:
+        record = {
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'allocation_peak_mb': round(peak / MB, 2),
+            'retained_mb': round(retained / MB, 2),
+            'rss_growth_mb': round(rss_growth / MB, 2),
+            'rss_mb': round(rss_after / MB, 1),
+            'pid': os.getpid(),
+        }
+        logger.warning(json.dumps(record), extra={'memory_stats': record})
+        _offenders.appendleft({**record, 'at': timezone.now().isoformat()})
+
+    limit = settings.MEMORY_RSS_LIMIT_MB
+    if limit and rss_after >= limit * MB:
+        schedule_recycle(response, rss_after)
+    return response
+
+
+def schedule_recycle(response, rss):
+    """Signal this worker to shut down gracefully once the response has gone out"""
+    global _recycling
+    with _lock:
+        if _recycling:
+            return
+        _recycling = True
+    logger.warning(
+        'Worker %s is at %.1f MB RSS, over MEMORY_RSS_LIMIT_MB=%s; recycling it after this response',
+        os.getpid(), rss / MB, settings.MEMORY_RSS_LIMIT_MB,
+    )
+    signal_number = getattr(signal, settings.MEMORY_RECYCLE_SIGNAL)
+    # The WSGI server closes the response after sending the last byte
+    response._resource_closers.append(lambda: os.kill(os.getpid(), signal_number))
+
+
+def view_stats():
+    """Per-view rows in MB, the views with the biggest allocation peak first"""
+    with _lock:
+        items = [(view, dict(stats)) for view, stats in _views.items()]
+    rows = []
+    for view, stats in items:
+        requests = stats['requests']
+        rows.append({
+            'view': view,
+            'requests': requests,
+            'peak_mean_mb': round(stats['peak_total'] / requests / MB, 2),
+            'peak_max_mb': round(stats['peak_max'] / MB, 2),
+            'retained_mean_mb': round(stats['retained_total'] / requests / MB, 3),
+            'rss_growth_total_mb': round(stats['rss_growth_total'] / MB, 2),
+            'rss_growth_max_mb': round(stats['rss_growth_max'] / MB, 2),
+            'over_threshold': stats['over_threshold'],
+        })
+    rows.sort(key=lambda row: row['peak_max_mb'], reverse=True)
+    return rows
+
+
+def report():
+    """Everything the staff memory page shows, for this process"""
+    traced, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    return {
+        'enabled': settings.MEMORY_MONITOR_ENABLED,
+        'tracing': tracemalloc.is_tracing(),
+        'pid': os.getpid(),
+        'rss_mb': round(current_rss() / MB, 1),
+        'rss_limit_mb': settings.MEMORY_RSS_LIMIT_MB,
+        'traced_mb': round(traced / MB, 1),
+        'threshold_mb': settings.MEMORY_VIEW_ALLOCATION_THRESHOLD_MB,
+        'views': view_stats(),
+        'offenders': list(_offenders),
+        'diff': _latest_diff,
+    }
@@ -0,0 +1,335 @@
+"""
+Application metrics in the Prometheus text format.
+
+Counters and histograms are accumulated per thread, in a dict only that
+thread writes to, so recording a value takes no lock. When a thread
+finishes, its totals are folded into one per-process dict. Every
+METRICS_FLUSH_SECONDS a process merges its threads' totals and writes them
+to METRICS_DIR/<pid>.json (write to a temporary file, then rename). The
+/metrics view adds up the files of all worker processes, so any worker can
+answer a scrape. Files are cumulative and stay after their process exits,
+like prometheus_client's multiprocess mode; a new process that reuses a
+pid carries on from the totals in its file.
+
+Gauges that describe the database rather than the process (the newsletter
+queue) are computed when scraped.
+"""
+import atexit
+import bisect
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .models import Newsletter
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+QUERY_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+REGISTRY = {}
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        return self.name, tuple(str(labels[label]) for label in self.labels)
+
+
+class Counter(Metric):
+    kind = COUNTER
+
+    def inc(self, amount=1, **labels):
+        values = _values()
+        key = self._key(labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    kind = HISTOGRAM
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        values = _values()
+        key = self._key(labels)
+        # One count per bucket (not cumulative), then +Inf, sum and count
+        entry = values.get(key)
+        if entry is None:
+            entry = values[key] = [0] * (len(self.buckets) + 3)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+
+REQUEST_DURATION = Histogram(
+    'lavenderlily_http_request_duration_seconds', 'Time to respond, by view and status code', ('view', 'status'),
+)
+REQUEST_QUERIES = Histogram(
+    'lavenderlily_db_queries_per_request', 'SQL statements run per request, by view', ('view',), QUERY_COUNT_BUCKETS,
+)
+REQUEST_QUERY_TIME = Histogram(
+    'lavenderlily_db_query_seconds_per_request', 'Time spent in SQL per request, by view', ('view',), QUERY_TIME_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    'lavenderlily_cache_requests_total', 'Page, fragment and content cache lookups by result', ('cache', 'result'),
+)
+EMAILS = Counter(
+    'lavenderlily_emails_total', 'Emails handed to the mail backend, by kind and result', ('kind', 'result'),
+)
+EMAIL_SEND_DURATION = Histogram(
+    'lavenderlily_email_send_seconds', 'Time the mail backend took per batch of messages', ('kind',),
+)
+CHECKOUT = Counter(
+    'lavenderlily_checkout_total', 'Steps of the checkout funnel reached', ('step',),
+)
+
+# Checkout funnel steps
+CART_VIEWED = 'cart_viewed'
+CHECKOUT_VIEWED = 'checkout_viewed'
+ORDER_PLACED = 'order_placed'
+PAYMENT_COMPLETED = 'payment_completed'
+PAYMENT_FAILED = 'payment_failed'
+
+
+# Per-thread accumulators
+
+_local = threading.local()
+# id(values) -> values for every live thread; a finished thread's totals move to _retired
+_thread_values = {}
+_retired = {}
+_registry_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_last_flush = time.monotonic()
+_base = None
+
+
+class _ThreadHolder:
+    """Kept in a thread's local storage only, so it is collected when the thread finishes"""
+
+
+def _values():
+    try:
+        return _local.values
+    except AttributeError:
+        _local.values = values = {}
+        _local.holder = holder = _ThreadHolder()
+        # Only the owning thread writes to its dict; registering and retiring it take the lock
+        with _registry_lock:
+            _thread_values[id(values)] = values
+        weakref.finalize(holder, _retire, values)
+        return values
+
+
+def _retire(values):
+    """Fold a finished thread's totals into _retired and drop its dict"""
+    with _registry_lock:
+        if _thread_values.pop(id(values), None) is not values:
+            return
+        for key, value in values.items():
+            _merge(_retired, key, value)
+
+
+def _forget_parent():
+    """A forked worker must not report (and later write) what its parent recorded"""
+    global _local, _last_flush, _base, _registry_lock
+    # Another thread may have held the lock at fork time
+    _registry_lock = threading.Lock()
+    _thread_values.clear()
+    _retired.clear()
+    _local = threading.local()
+    _last_flush = time.monotonic()
+    _base = None
+
+
+os.register_at_fork(after_in_child=_forget_parent)
+
+
+def _merge(totals, key, value):
+    if isinstance(value, list):
+        current = totals.get(key)
+        if current is None:
+            totals[key] = list(value)
+        else:
+            for index, amount in enumerate(value):
+                current[index] += amount
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+def _process_file():
+    return os.path.join(settings.METRICS_DIR, f'{os.getpid()}.json')
+
+
+def _read(path):
+    """{(name, labels): value} from a process file; {} if it is missing or half written"""
+    try:
+        with open(path) as f:
+            rows = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {(name, tuple(labels)): value for name, labels, value in rows}
+
+
+def snapshot():
+    """This process's totals: its file from an earlier process with the same pid plus every thread's values"""
+    global _base
+    if _base is None:
+        _base = _read(_process_file())
+    totals = {}
+    for key, value in _base.items():
+        _merge(totals, key, value)
+    with _registry_lock:
+        for key, value in _retired.items():
+            _merge(totals, key, value)
+        live = list(_thread_values.values())
+    for values in live:
+        # dict.copy() is atomic under the GIL, so the owning thread can keep writing
+        for key, value in values.copy().items():
+            _merge(totals, key, value)
+    return totals
+
+
+def flush():
+    """Write this process's totals to its file in METRICS_DIR"""
+    global _last_flush
+    with _flush_lock:
+        _last_flush = time.monotonic()
+        rows = [[name, list(labels), value] for (name, labels), value in snapshot().items()]
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=settings.METRICS_DIR, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(rows, f)
+            os.replace(tmp, _process_file())
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+def maybe_flush():
+    """Flush if METRICS_FLUSH_SECONDS have passed; called once per request"""
+    if time.monotonic() - _last_flush >= settings.METRICS_FLUSH_SECONDS and not _flush_lock.locked():
+        try:
+            flush()
+        except OSError as exc:
+            # The totals stay in memory and go out with the next flush
+            logger.warning('Could not write metrics to %s: %s', settings.METRICS_DIR, exc)
+
+
+@atexit.register
+def _flush_at_exit():
+    # Only processes that serve requests (and so have flushed before) keep a file
+    if _base is not None:
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def collect():
+    """Totals of every process that has written to METRICS_DIR"""
+    flush()
+    totals = {}
+    for name in os.listdir(settings.METRICS_DIR):
+        if name.endswith('.json'):
+            for key, value in _read(os.path.join(settings.METRICS_DIR, name)).items():
+                _merge(totals, key, value)
+    return totals
+
+
+def scrape_allowed(request):
+    """A scrape needs the METRICS_TOKEN bearer token or an address in METRICS_ALLOWED_IPS"""
+    token = settings.METRICS_TOKEN
+    if token and hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_IPS)
+
+
+# Exposition
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value) if not value.is_integer() else str(int(value))
+    return str(value)
+
+
+def newsletter_queue():
+    """Scheduled newsletters that are due but not sent yet: (count, age of the oldest in seconds)"""
+    due = Newsletter.objects.filter(status='scheduled', scheduled_at__lte=timezone.now()).aggregate(
+        count=Count('pk'), oldest=Min('scheduled_at'),
+    )
+    age = (timezone.now() - due['oldest']).total_seconds() if due['oldest'] else 0
+    return due['count'], age
+
+
+def render():
+    """The Prometheus text exposition (format 0.0.4) of all processes' metrics"""
+    totals = collect()
+    by_metric = {}
+    for (name, labels), value in totals.items():
+        by_metric.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for labels, value in sorted(by_metric.get(name, ())):
+            if metric.kind == COUNTER:
+                lines.append(f'{name}{_labels(metric.labels, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip((*map(_number, metric.buckets), '+Inf'), value[:-2]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(metric.labels, labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(metric.labels, labels)} {_number(value[-2])}')
+            lines.append(f'{name}_count{_labels(metric.labels, labels)} {value[-1]}')
+
+    depth, age = newsletter_queue()
+    lines += [
+        '# HELP lavenderlily_newsletter_queue_depth Scheduled newsletters that are due but not sent',
+        '# TYPE lavenderlily_newsletter_queue_depth gauge',
+        f'lavenderlily_newsletter_queue_depth {depth}',
+        '# HELP lavenderlily_newsletter_queue_age_seconds How long the oldest due newsletter has been waiting',
+        '# TYPE lavenderlily_newsletter_queue_age_seconds gauge',
+        f'lavenderlily_newsletter_queue_age_seconds {_number(round(age, 3))}',
+    ]
+    return '\n'.join(lines) + '\n'
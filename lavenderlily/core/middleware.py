@@ -0,0 +1,250 @@
+import json
+import time
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import add_never_cache_headers
+from django.utils.functional import empty
+
+from . import assets, memory, metrics, page_cache, profiling, queries, slow_queries, tracing
+
+
+class PageCacheMiddleware:
+    """
+    Serve whitelisted public pages from the page cache (see core.page_cache).
+    Must come after the session, auth and messages middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        key = getattr(request, 'page_cache_key', None)
+        if key and page_cache.is_cacheable(response):
+            page_cache.store(key, response)
+            response['X-Page-Cache'] = 'miss'
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.PAGE_CACHE_ENABLED or request.method not in ('GET', 'HEAD'):
+            return None
+        view_name = request.resolver_match.url_name
+        tags = settings.PAGE_CACHE_VIEWS.get(view_name)
+        if tags is None:
+            return None
+
+        key = page_cache.page_key(request, view_name, tags)
+        entry = cache.get(key)
+        metrics.CACHE_REQUESTS.inc(cache='page', result='miss' if entry is None else 'hit')
+        if entry is None:
+            # Render normally, marking the holes so the stored copy can leave them out
+            request.page_cache_key = key
+            request.page_cache_capture = True
+            return None
+
+        response = HttpResponse(page_cache.fill_holes(entry['content'], request), content_type=entry['content_type'])
+        response['X-Page-Cache'] = 'hit'
+        return response
+
+
+class TracingMiddleware:
+    """
+    Trace every request (see core.tracing) and export the sampled and the
+    slow ones. Put it right after StaticAssetsMiddleware so the root span
+    covers the rest of the middleware.
+    """
+
+    def __init__(self, get_response):
+        if not settings.TRACING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sampled = tracing.should_sample()
+        with tracing.trace_request(request) as trace:
+            response = self.get_response(request)
+            root = trace.spans[0]['attributes']
+            root['http.status_code'] = response.status_code
+            if request.resolver_match:
+                root['view'] = request.resolver_match.view_name
+
+        reason = tracing.keep_reason(trace, sampled)
+        if reason:
+            tracing.export(trace.as_dict(reason))
+            response['X-Trace-Id'] = trace.trace_id
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Record request latency by view and status, and the SQL counts of
+    QueryInstrumentationMiddleware, for /metrics (see core.metrics). Put it
+    right before QueryInstrumentationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        # Unresolved paths (404s) share one label instead of one per URL
+        view = match.view_name if match else 'unresolved'
+        metrics.REQUEST_DURATION.observe(elapsed, view=view, status=response.status_code)
+        recorder = getattr(request, 'query_recorder', None)
+        if recorder is not None:
+            metrics.REQUEST_QUERIES.observe(recorder.count, view=view)
+            metrics.REQUEST_QUERY_TIME.observe(recorder.duration, view=view)
+        metrics.maybe_flush()
+        return response
+
+
+class MemoryMonitorMiddleware:
+    """
+    Measure each request's allocations and RSS growth by view, and recycle
+    the worker when it goes over MEMORY_RSS_LIMIT_MB (see core.memory).
+    Opt-in: tracemalloc slows allocation-heavy code down noticeably.
+    """
+
+    def __init__(self, get_response):
+        if not settings.MEMORY_MONITOR_ENABLED:
+            raise MiddlewareNotUsed
+        memory.start()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return memory.measure(self.get_response, request)
+
+
+class StaticAssetsMiddleware:
+    """
+    Serve collectstatic output from STATIC_ROOT, WhiteNoise style: pre-compressed
+    .br/.gz variants are negotiated and hashed names are cached as immutable.
+    Put it right after SecurityMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL if settings.STATIC_URL.startswith('/') else '/' + settings.STATIC_URL
+        self.immutable_names = set(staticfiles_storage.hashed_files.values())
+
+    def __call__(self, request):
+        if (
+            settings.SERVE_STATIC_ASSETS
+            and request.method in ('GET', 'HEAD')
+            and request.path.startswith(self.prefix)
+        ):
+            response = assets.serve_asset(
+                request, request.path[len(self.prefix):], settings.STATIC_ROOT, self.immutable_names
+            )
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Record the SQL each request runs (see core.queries) and feed it to the
+    slow-query log (core.slow_queries). Put it near the top of MIDDLEWARE so
+    queries made by other middleware are counted too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_INSTRUMENTATION_ENABLED:
+            return self.get_response(request)
+
+        slow_query_log = settings.SLOW_QUERY_LOG_ENABLED
+        recorder = queries.QueryRecorder(keep_params=slow_query_log and settings.SLOW_QUERY_LOG_EXPLAIN)
+        # For MetricsMiddleware
+        request.query_recorder = recorder
+        started = time.perf_counter()
+        with recorder.install():
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view_name = match.view_name if match else None
+        duplicates = recorder.duplicates()
+        budget = queries.get_budget(view_name) if view_name else None
+        over_budget = budget is not None and recorder.count > budget
+
+        record = {
+            'view': view_name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(recorder.duration * 1000, 2),
+            'total_ms': round(elapsed * 1000, 2),
+            'duplicates': len(duplicates),
+            'budget': budget,
+        }
+        if duplicates:
+            record['top_duplicates'] = [
+                {'sql': sql[:300], 'count': executions} for sql, executions in list(duplicates.items())[:3]
+            ]
+        queries.logger.info(json.dumps(record), extra={'sql_stats': record})
+
+        if slow_query_log:
+            slow_queries.record(recorder, view_name)
+            slow_queries.maybe_flush()
+
+        if over_budget:
+            message = f'{view_name} ran {recorder.count} queries, over its budget of {budget}'
+            if settings.QUERY_BUDGET_ACTION == 'raise':
+                raise queries.QueryBudgetExceeded(message)
+            log = queries.logger.error if settings.QUERY_BUDGET_ACTION == 'error' else queries.logger.warning
+            log(message, extra={'sql_stats': record})
+
+        # Only a user the request already loaded: resolving it here would run session and user queries unrecorded
+        user = getattr(request, 'user', None)
+        user = getattr(user, '_wrapped', user)
+        if user is not None and user is not empty and user.is_staff:
+            response['Server-Timing'] = queries.server_timing(recorder, duplicates)
+        return response
+
+
+class RequestProfilerMiddleware:
+    """
+    Replace the response with a profile report when a staff user adds
+    ?_profile or ?_profile=sample to the URL (see core.profiling). Put it
+    right after the auth and messages middleware. Other requests only pay
+    for a substring test on the query string.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILER_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.param = settings.REQUEST_PROFILER_PARAM
+
+    def __call__(self, request):
+        if self.param not in request.META.get('QUERY_STRING', ''):
+            return self.get_response(request)
+        if not request.user.is_staff or self.param not in request.GET:
+            return self.get_response(request)
+
+        # Views see the URL without the flag
+        request.GET = request.GET.copy()
+        mode = profiling.SAMPLE if request.GET.pop(self.param) == [profiling.SAMPLE] else profiling.CPROFILE
+
+        response, profile, artifacts = profiling.profile_request(self.get_response, request, mode)
+        profiling.save(profile, artifacts)
+
+        report = HttpResponse(render_to_string('admin/request_profile.html', {'profile': profile}, request=request))
+        add_never_cache_headers(report)
+        return report
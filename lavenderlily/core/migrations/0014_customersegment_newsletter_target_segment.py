@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_socialmedia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletter',
+            name='target_segment',
+            field=models.CharField(blank=True, choices=[('champions', 'Champions'), ('loyal', 'Loyal Customers'), ('new', 'New Customers'), ('potential', 'Potential Loyalists'), ('at_risk', 'At Risk'), ('hibernating', 'Hibernating')], help_text='Leave blank to send to all active subscribers', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='CustomerSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, unique=True)),
+                ('recency_days', models.PositiveIntegerField()),
+                ('frequency', models.PositiveIntegerField()),
+                ('monetary', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('recency_score', models.PositiveSmallIntegerField()),
+                ('frequency_score', models.PositiveSmallIntegerField()),
+                ('monetary_score', models.PositiveSmallIntegerField()),
+                ('segment', models.CharField(choices=[('champions', 'Champions'), ('loyal', 'Loyal Customers'), ('new', 'New Customers'), ('potential', 'Potential Loyalists'), ('at_risk', 'At Risk'), ('hibernating', 'Hibernating')], max_length=20)),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Customer Segment',
+                'verbose_name_plural': 'Customer Segments',
+                'indexes': [models.Index(fields=['segment', 'email'], name='core_segment_email_idx')],
+            },
+        ),
+    ]
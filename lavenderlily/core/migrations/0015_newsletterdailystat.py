@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_customersegment_newsletter_target_segment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewsletterDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('opens', models.PositiveIntegerField(default=0)),
+                ('unique_opens', models.PositiveIntegerField(default=0)),
+                ('clicks', models.PositiveIntegerField(default=0)),
+                ('unique_clicks', models.PositiveIntegerField(default=0)),
+                ('newsletter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='core.newsletter')),
+            ],
+            options={
+                'verbose_name': 'Newsletter Daily Stat',
+                'verbose_name_plural': 'Newsletter Daily Stats',
+                'unique_together': {('newsletter', 'date')},
+            },
+        ),
+    ]
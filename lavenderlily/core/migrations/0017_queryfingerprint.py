@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_sitecounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(help_text='SHA-1 of the fingerprint', max_length=40)),
+                ('view', models.CharField(blank=True, max_length=200)),
+                ('fingerprint', models.TextField()),
+                ('plan', models.TextField(blank=True, help_text='EXPLAIN output for one execution')),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('total_time', models.FloatField(default=0, help_text='Seconds')),
+                ('max_time', models.FloatField(default=0, help_text='Seconds')),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Query Fingerprint',
+                'verbose_name_plural': 'Query Fingerprints',
+                'unique_together': {('digest', 'view')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:28
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_queryfingerprint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='newslettersubscriber',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='core_subscriber_email_lower'),
+        ),
+    ]
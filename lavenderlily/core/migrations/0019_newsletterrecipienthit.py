@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_newslettersubscriber_email_lower'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewsletterRecipientHit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('open', 'Open'), ('click', 'Click')], max_length=10)),
+                ('date', models.DateField()),
+                ('batch', models.UUIDField(db_index=True)),
+                ('newsletter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipient_hits', to='core.newsletter')),
+                ('subscriber', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='newsletter_hits', to='core.newslettersubscriber')),
+            ],
+            options={
+                'verbose_name': 'Newsletter Recipient Hit',
+                'verbose_name_plural': 'Newsletter Recipient Hits',
+                'unique_together': {('newsletter', 'subscriber', 'kind')},
+            },
+        ),
+    ]
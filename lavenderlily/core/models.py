@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
 
 class AboutPage(models.Model):
@@ -135,6 +136,42 @@ class NewsletterSubscriber(models.Model):
     class Meta:
         verbose_name = "Newsletter Subscriber"
         verbose_name_plural = "Newsletter Subscribers"
+        indexes = [
+            # The CSV import matches addresses case-insensitively
+            models.Index(Lower('email'), name='core_subscriber_email_lower'),
+        ]
+
+
+class CustomerSegment(models.Model):
+    """Nightly RFM (recency/frequency/monetary) scores per customer email"""
+    SEGMENT_CHOICES = (
+        ('champions', 'Champions'),
+        ('loyal', 'Loyal Customers'),
+        ('new', 'New Customers'),
+        ('potential', 'Potential Loyalists'),
+        ('at_risk', 'At Risk'),
+        ('hibernating', 'Hibernating'),
+    )
+
+    email = models.EmailField(unique=True)
+    recency_days = models.PositiveIntegerField()
+    frequency = models.PositiveIntegerField()
+    monetary = models.DecimalField(max_digits=12, decimal_places=2)
+    recency_score = models.PositiveSmallIntegerField()
+    frequency_score = models.PositiveSmallIntegerField()
+    monetary_score = models.PositiveSmallIntegerField()
+    segment = models.CharField(max_length=20, choices=SEGMENT_CHOICES)
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.email} - {self.get_segment_display()}"
+
+    class Meta:
+        verbose_name = "Customer Segment"
+        verbose_name_plural = "Customer Segments"
+        indexes = [
+            models.Index(fields=['segment', 'email'], name='core_segment_email_idx'),
+        ]
 
 
 class Newsletter(models.Model):
@@ -153,6 +190,12 @@ class Newsletter(models.Model):
     scheduled_at = models.DateTimeField(null=True, blank=True)
     sent_at = models.DateTimeField(null=True, blank=True)
     sent_count = models.IntegerField(default=0)
+    target_segment = models.CharField(
+        max_length=20,
+        choices=CustomerSegment.SEGMENT_CHOICES,
+        blank=True,
+        help_text="Leave blank to send to all active subscribers",
+    )
 
     def __str__(self):
         return self.subject
@@ -163,6 +206,47 @@ class Newsletter(models.Model):
         ordering = ['-created_at']
 
 
+class NewsletterDailyStat(models.Model):
+    """Aggregated open/click counters per newsletter per day"""
+    newsletter = models.ForeignKey(Newsletter, related_name="daily_stats", on_delete=models.CASCADE)
+    date = models.DateField()
+    opens = models.PositiveIntegerField(default=0)
+    unique_opens = models.PositiveIntegerField(default=0)
+    clicks = models.PositiveIntegerField(default=0)
+    unique_clicks = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.newsletter} - {self.date}"
+
+    class Meta:
+        verbose_name = "Newsletter Daily Stat"
+        verbose_name_plural = "Newsletter Daily Stats"
+        unique_together = ('newsletter', 'date')
+
+
+class NewsletterRecipientHit(models.Model):
+    """A subscriber's first open or click of a newsletter, kept for the unique counts"""
+    KIND_CHOICES = (
+        ('open', 'Open'),
+        ('click', 'Click'),
+    )
+
+    newsletter = models.ForeignKey(Newsletter, related_name="recipient_hits", on_delete=models.CASCADE)
+    subscriber = models.ForeignKey(NewsletterSubscriber, related_name="newsletter_hits", on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    date = models.DateField()
+    # Identifies the tracking flush that inserted the row
+    batch = models.UUIDField(db_index=True)
+
+    def __str__(self):
+        return f"{self.newsletter} - {self.subscriber} - {self.kind}"
+
+    class Meta:
+        verbose_name = "Newsletter Recipient Hit"
+        verbose_name_plural = "Newsletter Recipient Hits"
+        unique_together = ('newsletter', 'subscriber', 'kind')
+
+
 class SocialMedia(models.Model):
     PLATFORM_CHOICES = [
         ('instagram', 'Instagram'),
@@ -202,4 +286,38 @@ class SocialMedia(models.Model):
     class Meta:
         verbose_name = "Social Media Link"
         verbose_name_plural = "Social Media Links"
-        ordering = ['display_order', 'platform']
\ No newline at end of file
+        ordering = ['display_order', 'platform']
+
+class SiteCounter(models.Model):
+    """Running total kept up to date by signal handlers (see core.counters)"""
+    key = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+    class Meta:
+        verbose_name = "Site Counter"
+        verbose_name_plural = "Site Counters"
+
+
+class QueryFingerprint(models.Model):
+    """SQL statements aggregated by fingerprint and calling view (see core.slow_queries)"""
+    digest = models.CharField(max_length=40, help_text="SHA-1 of the fingerprint")
+    view = models.CharField(max_length=200, blank=True)
+    fingerprint = models.TextField()
+    plan = models.TextField(blank=True, help_text="EXPLAIN output for one execution")
+    count = models.PositiveBigIntegerField(default=0)
+    total_time = models.FloatField(default=0, help_text="Seconds")
+    max_time = models.FloatField(default=0, help_text="Seconds")
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.view or '-'}: {self.fingerprint[:80]}"
+
+    class Meta:
+        verbose_name = "Query Fingerprint"
+        verbose_name_plural = "Query Fingerprints"
+        unique_together = ('digest', 'view')
@@ -0,0 +1,146 @@
+"""
+Buffered newsletter open/click tracking.
+
+Hits are counted in a per-process buffer and written to NewsletterDailyStat
+in one batch every few seconds (or once the buffer fills up), so a newsletter
+blast does not turn into one database write per pixel request. Unique opens
+and clicks are kept as one NewsletterRecipientHit row per (newsletter,
+subscriber, kind), inserted in the same batch, so every process agrees on
+which hit came first.
+"""
+import atexit
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Newsletter, NewsletterDailyStat, NewsletterRecipientHit, NewsletterSubscriber
+
+logger = logging.getLogger(__name__)
+
+OPEN = 'open'
+CLICK = 'click'
+
+COUNTER_FIELDS = {
+    (OPEN, False): 'opens',
+    (OPEN, True): 'unique_opens',
+    (CLICK, False): 'clicks',
+    (CLICK, True): 'unique_clicks',
+}
+
+_lock = threading.Lock()
+_buffer = Counter()
+# (newsletter_id, subscriber_id, kind) -> day of the first buffered hit
+_recipients = {}
+_last_flush = time.monotonic()
+
+
+def record_hit(newsletter_id, subscriber_id, kind):
+    """Count an open or click; flushes the buffer when it is due"""
+    global _last_flush
+
+    today = timezone.now().date()
+
+    with _lock:
+        _buffer[(newsletter_id, today, COUNTER_FIELDS[(kind, False)])] += 1
+        _recipients.setdefault((newsletter_id, subscriber_id, kind), today)
+
+        due = (
+            sum(_buffer.values()) >= settings.NEWSLETTER_TRACKING_FLUSH_SIZE
+            or time.monotonic() - _last_flush >= settings.NEWSLETTER_TRACKING_FLUSH_SECONDS
+        )
+
+    if due:
+        flush()
+
+
+def discard():
+    """Drop the buffered hits without writing them"""
+    _take_buffer()
+
+
+def _take_buffer():
+    global _last_flush
+
+    with _lock:
+        pending = dict(_buffer), dict(_recipients)
+        _buffer.clear()
+        _recipients.clear()
+        _last_flush = time.monotonic()
+    return pending
+
+
+def flush():
+    """
+    Write buffered hits as one upsert per (newsletter, day).
+    Returns the number of hits written.
+    """
+    pending, recipients = _take_buffer()
+    if not pending:
+        return 0
+
+    try:
+        counts = Counter(pending)
+        newsletter_ids = {newsletter_id for newsletter_id, _, _ in counts}
+        existing_newsletters = set(
+            Newsletter.objects.filter(pk__in=newsletter_ids).values_list('pk', flat=True)
+        )
+        existing_subscribers = set(
+            NewsletterSubscriber.objects.filter(
+                pk__in={subscriber_id for _, subscriber_id, _ in recipients}
+            ).values_list('pk', flat=True)
+        )
+
+        with transaction.atomic():
+            # Only the rows this flush managed to insert are first hits
+            batch = uuid.uuid4()
+            NewsletterRecipientHit.objects.bulk_create(
+                [
+                    NewsletterRecipientHit(
+                        newsletter_id=newsletter_id, subscriber_id=subscriber_id, kind=kind, date=day, batch=batch,
+                    )
+                    for (newsletter_id, subscriber_id, kind), day in recipients.items()
+                    if newsletter_id in existing_newsletters and subscriber_id in existing_subscribers
+                ],
+                ignore_conflicts=True,
+            )
+            first_hits = NewsletterRecipientHit.objects.filter(batch=batch).values_list('newsletter_id', 'date', 'kind')
+            for newsletter_id, day, kind in first_hits:
+                counts[(newsletter_id, day, COUNTER_FIELDS[(kind, True)])] += 1
+
+            rows = {}
+            for (newsletter_id, day, field), count in counts.items():
+                if newsletter_id in existing_newsletters:
+                    rows.setdefault((newsletter_id, day), {})[field] = count
+
+            NewsletterDailyStat.objects.bulk_create(
+                [NewsletterDailyStat(newsletter_id=newsletter_id, date=day) for newsletter_id, day in rows],
+                ignore_conflicts=True,
+            )
+            for (newsletter_id, day), fields in rows.items():
+                NewsletterDailyStat.objects.filter(newsletter_id=newsletter_id, date=day).update(
+                    **{field: F(field) + count for field, count in fields.items()}
+                )
+    except Exception as e:
+        logger.error(f"Failed to flush newsletter tracking counters: {e}")
+        # Keep the hits for the next flush attempt
+        with _lock:
+            _buffer.update(pending)
+            _recipients.update(recipients)
+        return 0
+
+    return sum(sum(fields.values()) for fields in rows.values())
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        flush()
+    except Exception:
+        pass
@@ -0,0 +1,131 @@
+"""
+Full-page cache for public pages.
+
+Whitelisted views (settings.PAGE_CACHE_VIEWS) are cached per path, query
+string and auth state (anonymous / customer / staff). Each view lists the
+models its page is built from; every model has a version number in the
+cache that is bumped whenever one of its rows is saved or deleted, and the
+current versions are part of the page key, so a change makes every
+dependent page miss without having to find and delete the old entries.
+
+Personalized fragments are "holes": {% page_hole %} renders a partial
+template and, while a page is being captured for the cache, wraps it in
+markers. The stored copy keeps only the marker and each hole is rendered
+again for the visitor when the page is served. CSRF tokens are handled the
+same way so nobody receives somebody else's token.
+"""
+import hashlib
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.middleware.csrf import get_token
+from django.template import Context, engines
+from django.utils.html import format_html
+
+TAG_VERSION_PREFIX = 'core:pagecache:tag:'
+PAGE_KEY_PREFIX = 'core:pagecache:page:'
+
+HOLE_START = '<!--page-hole:{name}-->'
+HOLE_END = '<!--/page-hole-->'
+HOLE_RE = re.compile(r'<!--page-hole:([\w/.-]+)-->.*?<!--/page-hole-->', re.S)
+HOLE_MARKER_RE = re.compile(r'<!--page-hole:([\w/.-]+)-->')
+
+CSRF_INPUT_RE = re.compile(r'<input type="hidden" name="csrfmiddlewaretoken" value="[^"]*">')
+CSRF_MARKER = '<!--page-csrf-->'
+
+# Models whose changes invalidate cached pages and fragments
+VERSIONED_MODELS = (
+    'store.Product', 'store.Category', 'store.Color',
+    'core.Homepage', 'core.AboutPage', 'core.ContactPage', 'core.ContactService', 'core.SocialMedia',
+)
+
+
+def get_tag_versions(tags):
+    """Return {tag: version} for model tags such as 'store.product'"""
+    keys = {tag: TAG_VERSION_PREFIX + tag for tag in tags}
+    found = cache.get_many(keys.values())
+    versions = {}
+    for tag, key in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = time.time_ns()
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+        versions[tag] = version
+    return versions
+
+
+def bump_tag(tag):
+    """Invalidate everything cached under a tag once the current transaction commits"""
+    transaction.on_commit(lambda: cache.set(TAG_VERSION_PREFIX + tag, time.time_ns(), None))
+
+
+def auth_state(request):
+    user = request.user
+    if not user.is_authenticated:
+        return 'anon'
+    return 'staff' if user.is_staff else 'user'
+
+
+def page_key(request, view_name, tags):
+    versions = get_tag_versions(tags)
+    fingerprint = ':'.join(f'{tag}={versions[tag]}' for tag in sorted(versions))
+    digest = hashlib.md5(f'{request.get_full_path()}|{fingerprint}'.encode()).hexdigest()
+    return f'{PAGE_KEY_PREFIX}{view_name}:{auth_state(request)}:{digest}'
+
+
+def strip_holes(html):
+    """Turn a rendered page into the cacheable copy: holes emptied, CSRF tokens removed"""
+    html = HOLE_RE.sub(lambda match: HOLE_START.format(name=match.group(1)), html)
+    return CSRF_INPUT_RE.sub(CSRF_MARKER, html)
+
+
+def _hole_context(request):
+    # Context processors run once per served page, however many holes it has
+    engine = engines['django'].engine
+    values = {}
+    for processor in engine.template_context_processors:
+        values.update(processor(request))
+    return engine, Context(values, autoescape=engine.autoescape)
+
+
+def fill_holes(html, request):
+    """Render the personalized holes and a fresh CSRF token into a cached page"""
+    if HOLE_MARKER_RE.search(html):
+        engine, context = _hole_context(request)
+        html = HOLE_MARKER_RE.sub(lambda match: engine.get_template(match.group(1)).render(context), html)
+    if CSRF_MARKER in html:
+        html = html.replace(CSRF_MARKER, format_html(
+            '<input type="hidden" name="csrfmiddlewaretoken" value="{}">', get_token(request)
+        ))
+    return html
+
+
+def render_hole(context, template_name):
+    """Render a hole partial; wrapped in markers while the page or an enclosing fragment is being captured"""
+    html = context.template.engine.get_template(template_name).render(context)
+    request = context.get('request')
+    if context.get('page_hole_capture') or getattr(request, 'page_cache_capture', False):
+        return HOLE_START.format(name=template_name) + html + HOLE_END
+    return html
+
+
+def is_cacheable(response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and response.get('Content-Type', '').startswith('text/html')
+        and not response.has_header('Cache-Control')
+    )
+
+
+def store(key, response):
+    html = strip_holes(response.content.decode(response.charset))
+    cache.set(key, {
+        'content': html,
+        'content_type': response['Content-Type'],
+    }, settings.PAGE_CACHE_TIMEOUT)
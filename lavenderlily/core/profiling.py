@@ -0,0 +1,345 @@
+"""
+On-demand request profiling for staff.
+
+A staff user appends ?_profile (settings.REQUEST_PROFILER_PARAM) to any URL
+and core.middleware.RequestProfilerMiddleware runs that one request under
+cProfile, or with ?_profile=sample under a stack sampler only, which
+distorts timings less. The page is replaced by a report: the slowest
+functions, render time per template, SQL time and a collapsed-stack file
+that flamegraph.pl, speedscope or inferno read directly.
+
+Every profile is kept in REQUEST_PROFILER_DIR (the newest
+REQUEST_PROFILER_KEEP of them) as <id>.json with the report,
+<id>.collapsed with the sampled stacks and, for cProfile runs, <id>.prof
+for pstats/snakeviz, so profiles can be listed and compared later.
+
+Template times are per Template._render call, so blocks a child template
+fills in count towards the parent it extends. Nothing here is installed for
+other requests: the timer patches Template._render only while a profiled
+request is running.
+"""
+import cProfile
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.template.base import Template
+from django.utils import timezone
+
+from .queries import QueryRecorder
+
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+
+TOP_FUNCTIONS = 40
+PROFILE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+ADDRESS_RE = re.compile(r' at 0x[0-9a-f]+')
+DOWNLOADS = {'collapsed': '.collapsed', 'pstats': '.prof'}
+
+# Only one cProfile run at a time: profilers from different threads would interfere
+_cprofile_lock = threading.Lock()
+
+
+def _short_path(filename):
+    for prefix in sorted((str(settings.BASE_DIR), *sys.path), key=len, reverse=True):
+        if prefix and filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+def _function_label(filename, line, name):
+    if filename == '~':
+        # Built-ins, which cProfile reports as ('~', 0, '<built-in method ...>'); addresses would
+        # keep the same function from matching across profiles
+        return ADDRESS_RE.sub('', name)
+    return f'{name} ({_short_path(filename)}:{line})'
+
+
+class StackSampler:
+    """Record the Python stack of one thread every interval seconds, from a background thread"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        labels = {}
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _function_label(code.co_filename, code.co_firstlineno, code.co_name)
+                stack.append(label)
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+
+    def collapsed(self):
+        """Brendan Gregg's collapsed format: one 'frame;frame;frame count' line per distinct stack"""
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]))
+
+    def top_functions(self, limit=TOP_FUNCTIONS):
+        """Self and inclusive time per function, estimated from the samples"""
+        own, inclusive = {}, {}
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for label in set(frames):
+                inclusive[label] = inclusive.get(label, 0) + count
+        ms = self.interval * 1000
+        rows = [
+            {'function': label, 'calls': None, 'self_ms': round(count * ms, 2), 'cumulative_ms': round(inclusive[label] * ms, 2)}
+            for label, count in own.items()
+        ]
+        rows.sort(key=lambda row: row['self_ms'], reverse=True)
+        return rows[:limit]
+
+
+def cprofile_functions(profiler, limit=TOP_FUNCTIONS):
+    stats = pstats.Stats(profiler).stats
+    rows = [
+        {
+            'function': _function_label(*key),
+            'calls': calls,
+            'self_ms': round(own * 1000, 2),
+            'cumulative_ms': round(cumulative * 1000, 2),
+        }
+        for key, (primitive_calls, calls, own, cumulative, callers) in stats.items()
+    ]
+    rows.sort(key=lambda row: row['self_ms'], reverse=True)
+    return rows[:limit]
+
+
+# Template timing. _timed_render replaces Template._render while at least one
+# profiled request is in flight and only times the threads that asked for it.
+
+_active = threading.local()
+_template_lock = threading.Lock()
+_template_users = 0
+_original_render = None
+
+
+def _timed_render(self, context):
+    timings = getattr(_active, 'templates', None)
+    if timings is None:
+        return _original_render(self, context)
+
+    stack = _active.template_stack
+    stack.append(0.0)
+    started = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        name = self.origin.template_name or self.origin.name or '<string>'
+        entry = timings.setdefault(name, {'calls': 0, 'total': 0.0, 'self': 0.0})
+        entry['calls'] += 1
+        entry['total'] += elapsed
+        entry['self'] += elapsed - children
+
+
+@contextmanager
+def time_templates():
+    """Collect {template name: {'calls', 'total', 'self'}} for renders on the current thread"""
+    global _template_users, _original_render
+    with _template_lock:
+        if _template_users == 0:
+            _original_render = Template._render
+            Template._render = _timed_render
+        _template_users += 1
+    _active.templates, _active.template_stack = {}, []
+    try:
+        yield _active.templates
+    finally:
+        del _active.templates, _active.template_stack
+        with _template_lock:
+            _template_users -= 1
+            if _template_users == 0:
+                Template._render = _original_render
+
+
+def profile_request(get_response, request, mode):
+    """Run the rest of the middleware chain and the view under the profiler; returns (response, profile, artifacts)"""
+    profiler = None
+    if mode == CPROFILE:
+        if _cprofile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+        else:
+            mode = SAMPLE
+
+    recorder = QueryRecorder()
+    sampler = StackSampler(threading.get_ident(), settings.REQUEST_PROFILER_SAMPLE_INTERVAL)
+    try:
+        with recorder.install(), time_templates() as templates, sampler:
+            started = time.perf_counter()
+            if profiler:
+                profiler.enable()
+            try:
+                response = get_response(request)
+                if response.streaming:
+                    # Generate the body now so it is part of the profile; the report replaces it anyway
+                    for _ in response.streaming_content:
+                        pass
+            finally:
+                if profiler:
+                    profiler.disable()
+            elapsed = time.perf_counter() - started
+    finally:
+        if profiler:
+            _cprofile_lock.release()
+
+    match = request.resolver_match
+    profile = {
+        'id': uuid.uuid4().hex,
+        'created_at': timezone.now().isoformat(),
+        'user': request.user.get_username(),
+        'method': request.method,
+        'path': request.path,
+        'query_string': request.GET.urlencode(),
+        'view': match.view_name if match else None,
+        'status': response.status_code,
+        'mode': mode,
+        'total_ms': round(elapsed * 1000, 2),
+        'sql': {
+            'count': recorder.count,
+            'ms': round(recorder.duration * 1000, 2),
+            'duplicates': recorder.duplicates(),
+            'slowest': [{'ms': round(seconds * 1000, 2), 'sql': sql} for seconds, sql in recorder.slowest_statements()],
+        },
+        'templates': sorted(
+            (
+                {'name': name, 'calls': entry['calls'], 'total_ms': round(entry['total'] * 1000, 2),
+                 'self_ms': round(entry['self'] * 1000, 2)}
+                for name, entry in templates.items()
+            ),
+            key=lambda row: row['self_ms'], reverse=True,
+        ),
+        'samples': sampler.samples,
+        'functions': cprofile_functions(profiler) if profiler else sampler.top_functions(),
+    }
+    profile['template_ms'] = round(sum(row['self_ms'] for row in profile['templates']), 2)
+    return response, profile, {'collapsed': sampler.collapsed(), 'profiler': profiler}
+
+
+def _path(profile_id, extension):
+    return os.path.join(settings.REQUEST_PROFILER_DIR, profile_id + extension)
+
+
+def save(profile, artifacts):
+    os.makedirs(settings.REQUEST_PROFILER_DIR, exist_ok=True)
+    with open(_path(profile['id'], '.collapsed'), 'w') as f:
+        f.write(artifacts['collapsed'])
+    if artifacts['profiler'] is not None:
+        artifacts['profiler'].dump_stats(_path(profile['id'], '.prof'))
+    # The .json goes last: list_profiles() only sees complete profiles
+    with open(_path(profile['id'], '.json'), 'w') as f:
+        json.dump(profile, f)
+    prune()
+
+
+def prune():
+    """Delete all but the newest REQUEST_PROFILER_KEEP profiles"""
+    for profile_id in _profile_ids()[settings.REQUEST_PROFILER_KEEP:]:
+        for extension in ('.json', *DOWNLOADS.values()):
+            try:
+                os.remove(_path(profile_id, extension))
+            except FileNotFoundError:
+                pass
+
+
+def _profile_ids():
+    """Stored profile ids, newest first"""
+    try:
+        names = os.listdir(settings.REQUEST_PROFILER_DIR)
+    except FileNotFoundError:
+        return []
+    entries = []
+    for name in names:
+        profile_id, extension = os.path.splitext(name)
+        if extension == '.json' and PROFILE_ID_RE.match(profile_id):
+            try:
+                entries.append((os.stat(_path(profile_id, '.json')).st_mtime, profile_id))
+            except FileNotFoundError:
+                continue
+    return [profile_id for _, profile_id in sorted(entries, reverse=True)]
+
+
+def load(profile_id):
+    """The stored profile, or None for an unknown or malformed id"""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    try:
+        with open(_path(profile_id, '.json')) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def list_profiles():
+    return [profile for profile in map(load, _profile_ids()) if profile is not None]
+
+
+def download_path(profile_id, kind):
+    """Path of a stored collapsed-stack or pstats file, or None"""
+    if kind not in DOWNLOADS or not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = _path(profile_id, DOWNLOADS[kind])
+    return path if os.path.exists(path) else None
+
+
+def _delta_rows(before, after, key, value):
+    """Join two lists of dicts on key and return rows with before/after/delta of value, biggest change first"""
+    old = {row[key]: row[value] for row in before}
+    new = {row[key]: row[value] for row in after}
+    rows = [
+        {'name': name, 'before': old.get(name), 'after': new.get(name),
+         'delta': round((new.get(name) or 0) - (old.get(name) or 0), 2)}
+        for name in old.keys() | new.keys()
+    ]
+    rows.sort(key=lambda row: abs(row['delta']), reverse=True)
+    return rows
+
+
+def compare(before, after):
+    """Side-by-side totals, template and function timings of two profiles"""
+    totals = [
+        (label, get(before), get(after), round(get(after) - get(before), 2))
+        for label, get in (
+            ('Total ms', lambda p: p['total_ms']),
+            ('SQL ms', lambda p: p['sql']['ms']),
+            ('SQL queries', lambda p: p['sql']['count']),
+            ('Template ms', lambda p: p['template_ms']),
+        )
+    ]
+    return {
+        'totals': totals,
+        'templates': _delta_rows(before['templates'], after['templates'], 'name', 'self_ms'),
+        'functions': _delta_rows(before['functions'], after['functions'], 'function', 'self_ms')[:TOP_FUNCTIONS],
+    }
@@ -0,0 +1,119 @@
+"""
+Per-request SQL instrumentation.
+
+QueryRecorder is installed with connection.execute_wrapper() for the
+duration of a request and keeps only aggregates: the query count, total
+time, how often and how long each statement ran and a few of the slowest
+statements. It only fingerprints each distinct statement once, after the
+response, which keeps it cheap enough to leave on. Parameters are not kept
+unless asked for (keep_params, one sample per statement for the slow-query
+log's EXPLAIN, see core.slow_queries).
+
+core.middleware.QueryInstrumentationMiddleware reports the result as a
+structured log line (logger core.queries), as Server-Timing headers for
+staff, and checks the view against its budget in settings.QUERY_BUDGETS.
+"""
+import heapq
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('core.queries')
+
+SLOWEST_KEPT = 5
+
+STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LIST_RE = re.compile(r'\bIN\s*\((?:\s*(?:%s|\?)\s*,?)+\)', re.I)
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Normalize a statement so that queries differing only in values compare equal"""
+    sql = STRING_LITERAL_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return WHITESPACE_RE.sub(' ', sql).strip()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryRecorder:
+    def __init__(self, keep_params=False):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        # {sql: [total seconds, slowest execution]}
+        self.statement_times = {}
+        self.slowest = []
+        self.keep_params = keep_params
+        # {sql: (database alias, params)} of the first execution of each statement
+        self.samples = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            self.statements[sql] += 1
+            times = self.statement_times.get(sql)
+            if times is None:
+                self.statement_times[sql] = [elapsed, elapsed]
+                if self.keep_params and not many:
+                    self.samples[sql] = (context['connection'].alias, params)
+            else:
+                times[0] += elapsed
+                if elapsed > times[1]:
+                    times[1] = elapsed
+            if len(self.slowest) < SLOWEST_KEPT:
+                heapq.heappush(self.slowest, (elapsed, sql))
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (elapsed, sql))
+
+    @contextmanager
+    def install(self):
+        """Record queries on every configured database in the current thread"""
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(self))
+            yield self
+
+    def duplicates(self):
+        """{fingerprint: executions} for statements that ran more than once, most frequent first"""
+        repeated = Counter()
+        for sql, executions in self.statements.items():
+            repeated[fingerprint(sql)] += executions
+        return {sql: executions for sql, executions in repeated.most_common() if executions > 1}
+
+    def slowest_statements(self):
+        return [(elapsed, fingerprint(sql)) for elapsed, sql in sorted(self.slowest, reverse=True)]
+
+
+def get_budget(view_name):
+    return settings.QUERY_BUDGETS.get(view_name, settings.QUERY_BUDGET_DEFAULT)
+
+
+def _server_timing_desc(text):
+    text = text.encode('ascii', 'replace').decode('ascii')
+    text = text.replace('\\', '\\\\').replace('"', '\\"')
+    return text if len(text) <= 100 else text[:97] + '...'
+
+
+def server_timing(recorder, duplicates):
+    entries = [f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"']
+    if duplicates:
+        entries.append(f'db-dup;desc="{sum(duplicates.values()) - len(duplicates)} repeated"')
+    for index, (elapsed, sql) in enumerate(recorder.slowest_statements(), 1):
+        entries.append(f'db-slow-{index};dur={elapsed * 1000:.1f};desc="{_server_timing_desc(sql)}"')
+    return ', '.join(entries)
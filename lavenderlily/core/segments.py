@@ -0,0 +1,142 @@
+"""
+RFM (recency / frequency / monetary) customer segmentation.
+
+Per-customer totals come from a single grouped query over Order. Scores are
+quintiles computed column-wise over compact arrays, so the job never issues
+per-customer queries and scales to millions of orders. A customer's score
+comes from the share of customers with a worse value, so tied values (most
+customers have one order) always share a score.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from .models import CustomerSegment, NewsletterSubscriber
+
+SEGMENT_BATCH_SIZE = 5000
+SCORE_BUCKETS = 5
+
+# Orders that did not result in a sale are left out of the scores
+EXCLUDED_ORDER_STATUSES = ('cancelled', 'returned')
+
+
+def quintile_scores(values, reverse=False):
+    """
+    Score every value 1-5 by the quintile of customers it beats: the share of
+    values strictly below it (strictly above it with reverse=True, used for
+    recency). Equal values get the same score and the worst value always scores 1.
+    """
+    if not values:
+        return array('B')
+    ordered = sorted(values)
+    size = len(ordered)
+    by_value = {}
+    for value in set(values):
+        beaten = size - bisect_right(ordered, value) if reverse else bisect_left(ordered, value)
+        by_value[value] = min(beaten * SCORE_BUCKETS // size, SCORE_BUCKETS - 1) + 1
+    return array('B', (by_value[value] for value in values))
+
+
+def segment_for(recency, frequency, monetary):
+    """Map a customer's R/F/M scores onto a named segment"""
+    if recency >= 4 and frequency >= 4:
+        return 'champions'
+    if frequency >= 4 and recency >= 2:
+        return 'loyal'
+    if recency >= 4 and frequency <= 1:
+        return 'new'
+    if recency >= 3:
+        return 'potential'
+    if frequency >= 3 or monetary >= 4:
+        return 'at_risk'
+    return 'hibernating'
+
+
+def customer_order_totals():
+    """Yield (email, last_order_at, order_count, total_spent) for every customer"""
+    from orders.models import Order
+
+    return (
+        Order.objects.exclude(status__in=EXCLUDED_ORDER_STATUSES)
+        .exclude(user__email='')
+        .values('user__email')
+        .annotate(last_order=Max('created_at'), frequency=Count('id'), monetary=Sum('total_amount'))
+        .values_list('user__email', 'last_order', 'frequency', 'monetary')
+        .order_by()
+        .iterator(chunk_size=SEGMENT_BATCH_SIZE)
+    )
+
+
+def compute_customer_segments(now=None):
+    """
+    Rebuild the CustomerSegment table from order history.
+    Returns a dict with the number of customers per segment.
+    """
+    now = now or timezone.now()
+
+    emails = []
+    recency = array('L')
+    frequency = array('L')
+    monetary = array('d')
+    monetary_exact = []
+
+    for email, last_order, order_count, total_spent in customer_order_totals():
+        email = email.lower()
+        emails.append(email)
+        recency.append(max((now - last_order).days, 0))
+        frequency.append(order_count)
+        monetary.append(float(total_spent or 0))
+        monetary_exact.append(total_spent or 0)
+
+    recency_scores = quintile_scores(recency, reverse=True)
+    frequency_scores = quintile_scores(frequency)
+    monetary_scores = quintile_scores(monetary)
+
+    summary = {code: 0 for code, _ in CustomerSegment.SEGMENT_CHOICES}
+    seen = set()
+
+    def build_rows():
+        for index, email in enumerate(emails):
+            # Addresses that only differ by case collapse onto the first customer
+            if email in seen:
+                continue
+            seen.add(email)
+            segment = segment_for(recency_scores[index], frequency_scores[index], monetary_scores[index])
+            summary[segment] += 1
+            yield CustomerSegment(
+                email=email,
+                recency_days=recency[index],
+                frequency=frequency[index],
+                monetary=monetary_exact[index],
+                recency_score=recency_scores[index],
+                frequency_score=frequency_scores[index],
+                monetary_score=monetary_scores[index],
+                segment=segment,
+                computed_at=now,
+            )
+
+    with transaction.atomic():
+        CustomerSegment.objects.all().delete()
+        batch = []
+        for row in build_rows():
+            batch.append(row)
+            if len(batch) >= SEGMENT_BATCH_SIZE:
+                CustomerSegment.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            CustomerSegment.objects.bulk_create(batch)
+
+    return summary
+
+
+def newsletter_recipients(newsletter):
+    """Active subscribers a newsletter should go to, honouring its target segment"""
+    subscribers = NewsletterSubscriber.objects.filter(is_active=True)
+    if newsletter.target_segment:
+        subscribers = subscribers.filter(
+            email__in=CustomerSegment.objects.filter(segment=newsletter.target_segment).values('email')
+        )
+    return subscribers
@@ -0,0 +1,77 @@
+"""
+Signal handlers keeping derived data current.
+
+Site counters: post_init remembers which counters an instance loaded from
+the database contributes to; post_save/post_delete compare that snapshot
+with the new state and apply the difference as F() increments.
+
+Content cache: saving or deleting any site-content record invalidates the
+cached copies in core.content_cache.
+
+Page cache: saving or deleting a row bumps its model's version, which
+retires every cached page built from that model (core.page_cache).
+"""
+from django.db.models.signals import post_delete, post_init, post_save
+
+from . import content_cache, page_cache
+from .counters import FAMILIES, FAMILIES_BY_MODEL, counter_keys, diff_keys, update_counters
+
+# Models whose records are served from core.content_cache
+CONTENT_MODELS = ('core.Homepage', 'core.AboutPage', 'core.ContactPage', 'core.ContactService', 'core.SocialMedia')
+
+
+def _family(sender):
+    return FAMILIES_BY_MODEL[sender._meta.label]
+
+
+def snapshot_counter_keys(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._counter_keys = counter_keys(_family(sender), instance)
+
+
+def update_counters_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new_keys = counter_keys(_family(sender), instance)
+    old_keys = () if created else instance.__dict__.get('_counter_keys')
+    # Instances loaded with deferred counter fields cannot be diffed; reconcile_counters fixes those
+    if old_keys is not None and new_keys is not None:
+        update_counters(diff_keys(old_keys, new_keys))
+    instance._counter_keys = new_keys
+
+
+def update_counters_on_delete(sender, instance, **kwargs):
+    old_keys = instance.__dict__.get('_counter_keys') or counter_keys(_family(sender), instance)
+    if old_keys is not None:
+        update_counters(diff_keys(old_keys, ()))
+    instance._counter_keys = None
+
+
+def connect_counter_signals():
+    for family in FAMILIES:
+        uid = f'site_counters:{family.model}'
+        post_init.connect(snapshot_counter_keys, sender=family.model, dispatch_uid=uid)
+        post_save.connect(update_counters_on_save, sender=family.model, dispatch_uid=uid)
+        post_delete.connect(update_counters_on_delete, sender=family.model, dispatch_uid=uid)
+
+
+def invalidate_content_cache(sender, **kwargs):
+    content_cache.invalidate()
+
+
+def connect_content_cache_signals():
+    for model in CONTENT_MODELS:
+        uid = f'content_cache:{model}'
+        post_save.connect(invalidate_content_cache, sender=model, dispatch_uid=uid)
+        post_delete.connect(invalidate_content_cache, sender=model, dispatch_uid=uid)
+
+
+def bump_page_cache_tag(sender, **kwargs):
+    page_cache.bump_tag(sender._meta.label_lower)
+
+
+def connect_page_cache_signals():
+    for model in page_cache.VERSIONED_MODELS:
+        uid = f'page_cache:{model}'
+        post_save.connect(bump_page_cache_tag, sender=model, dispatch_uid=uid)
+        post_delete.connect(bump_page_cache_tag, sender=model, dispatch_uid=uid)
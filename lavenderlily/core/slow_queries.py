@@ -0,0 +1,234 @@
+"""
+Slow-query log: SQL aggregated by fingerprint.
+
+core.middleware.QueryInstrumentationMiddleware hands each request's
+QueryRecorder to record(), which folds its statements into a per-process
+table keyed by (fingerprint, view): executions, total and slowest time.
+The table holds at most SLOW_QUERY_LOG_MAX_FINGERPRINTS entries between
+flushes; statements that do not fit are only counted as dropped. Every
+SLOW_QUERY_LOG_FLUSH_SECONDS a background thread adds the table to
+QueryFingerprint with one upsert per entry, like the newsletter tracking
+counters, so the report covers every worker process and no request waits
+for the flush.
+
+When SLOW_QUERY_LOG_EXPLAIN is on, the flush also runs EXPLAIN once for
+each SELECT fingerprint that has no stored plan yet, with the parameters of
+one execution. The parameters themselves are never stored, but plans of
+some databases (PostgreSQL filters) can show their values.
+"""
+import atexit
+import hashlib
+import logging
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import F, Max, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import QueryFingerprint
+from .queries import fingerprint
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# {(digest, view): [fingerprint, count, total seconds, slowest, sample]}
+_table = {}
+_dropped = 0
+_last_flush = time.monotonic()
+# Digests this process has already looked for or stored a plan for
+_explained = set()
+# Held while a background flush runs
+_flushing = threading.Lock()
+
+
+@lru_cache(maxsize=4096)
+def _fingerprint(sql):
+    normalized = fingerprint(sql)
+    return normalized, hashlib.sha1(normalized.encode()).hexdigest()
+
+
+def record(recorder, view_name):
+    """Add a finished request's statements to the table"""
+    global _dropped
+
+    rows = {}
+    for sql, (total, slowest) in recorder.statement_times.items():
+        normalized, digest = _fingerprint(sql)
+        if normalized.startswith('EXPLAIN'):
+            # The report's own plans, when it flushes in a request
+            continue
+        row = rows.get(digest)
+        if row is None:
+            rows[digest] = [normalized, recorder.statements[sql], total, slowest, (sql, recorder.samples.get(sql))]
+        else:
+            row[1] += recorder.statements[sql]
+            row[2] += total
+            row[3] = max(row[3], slowest)
+
+    view = view_name or ''
+    with _lock:
+        for digest, (normalized, count, total, slowest, sample) in rows.items():
+            entry = _table.get((digest, view))
+            if entry is None:
+                if len(_table) >= settings.SLOW_QUERY_LOG_MAX_FINGERPRINTS:
+                    _dropped += count
+                    continue
+                _table[(digest, view)] = [normalized, count, total, slowest, sample]
+            else:
+                entry[1] += count
+                entry[2] += total
+                entry[3] = max(entry[3], slowest)
+                if entry[4][1] is None:
+                    entry[4] = sample
+
+
+def maybe_flush():
+    """Start a background flush if SLOW_QUERY_LOG_FLUSH_SECONDS have passed; called once per request"""
+    if time.monotonic() - _last_flush >= settings.SLOW_QUERY_LOG_FLUSH_SECONDS and _flushing.acquire(blocking=False):
+        threading.Thread(target=_background_flush, name='slow-query-flush', daemon=True).start()
+
+
+def _background_flush():
+    try:
+        flush()
+    except Exception as e:
+        logger.error(f"Failed to flush the slow-query log: {e}")
+    finally:
+        # Database connections are per thread; close the one this thread opened
+        connections.close_all()
+        _flushing.release()
+
+
+def discard():
+    """Drop the statements recorded since the last flush without writing them"""
+    _take_table()
+
+
+def _take_table():
+    global _table, _dropped, _last_flush
+
+    with _lock:
+        pending, dropped = _table, _dropped
+        _table, _dropped = {}, 0
+        _last_flush = time.monotonic()
+    return pending, dropped
+
+
+def flush():
+    """
+    Add the table to QueryFingerprint, one upsert per (fingerprint, view).
+    Returns the number of executions written.
+    """
+    pending, dropped = _take_table()
+    if dropped:
+        logger.warning(f"Slow-query log table was full; {dropped} executions were not recorded")
+    if not pending:
+        return 0
+
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            QueryFingerprint.objects.bulk_create(
+                [QueryFingerprint(digest=digest, view=view, fingerprint=entry[0]) for (digest, view), entry in pending.items()],
+                ignore_conflicts=True,
+            )
+            for (digest, view), (normalized, count, total, slowest, sample) in pending.items():
+                QueryFingerprint.objects.filter(digest=digest, view=view).update(
+                    count=F('count') + count,
+                    total_time=F('total_time') + total,
+                    max_time=Greatest('max_time', slowest),
+                    last_seen=now,
+                )
+    except Exception as e:
+        logger.error(f"Failed to flush the slow-query log: {e}")
+        # Keep the statements for the next flush attempt
+        with _lock:
+            for key, entry in pending.items():
+                current = _table.setdefault(key, [entry[0], 0, 0.0, 0.0, entry[4]])
+                current[1] += entry[1]
+                current[2] += entry[2]
+                current[3] = max(current[3], entry[3])
+        return 0
+
+    if settings.SLOW_QUERY_LOG_EXPLAIN:
+        try:
+            explain_new(pending)
+        except DatabaseError as e:
+            logger.error(f"Failed to store slow-query plans: {e}")
+    return sum(entry[1] for entry in pending.values())
+
+
+def explain_new(pending):
+    """Store a plan for the SELECT fingerprints in pending that have none yet"""
+    samples = {}
+    for (digest, view), (normalized, count, total, slowest, (sql, sample)) in pending.items():
+        if digest not in _explained and sample is not None and normalized.upper().startswith('SELECT'):
+            samples.setdefault(digest, (sql, sample))
+    if not samples:
+        return
+
+    planned = set(
+        QueryFingerprint.objects.filter(digest__in=samples).exclude(plan='').values_list('digest', flat=True)
+    )
+    _explained.update(planned)
+    for digest, (sql, (alias, params)) in samples.items():
+        if digest in planned:
+            continue
+        _explained.add(digest)
+        try:
+            plan = explain(sql, params, alias)
+        except DatabaseError as e:
+            plan = f"EXPLAIN failed: {e}"
+        QueryFingerprint.objects.filter(digest=digest, plan='').update(plan=plan)
+
+
+def explain(sql, params, using='default'):
+    """The database's plan for one statement, as text"""
+    connection = connections[using]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+        rows = cursor.fetchall()
+    return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+
+@atexit.register
+def _flush_on_exit():
+    # The test runner turns the log off, since the test database is gone by now
+    if not settings.SLOW_QUERY_LOG_ENABLED:
+        return
+    try:
+        flush()
+    except Exception:
+        pass
+
+
+def top_fingerprints(limit=20, view=None):
+    """
+    The fingerprints with the most total time, each with count, total, mean
+    and slowest time in ms, its plan and a {view: count} breakdown.
+    """
+    rows = QueryFingerprint.objects.all()
+    if view:
+        rows = rows.filter(view=view)
+    top = list(
+        rows.values('digest')
+        .annotate(count=Sum('count'), total=Sum('total_time'), slowest=Max('max_time'),
+                  fingerprint=Max('fingerprint'), plan=Max('plan'))
+        .order_by('-total')[:limit]
+    )
+    views = {}
+    for digest, view_name, count in rows.filter(digest__in=[row['digest'] for row in top]).order_by('-count').values_list(
+        'digest', 'view', 'count',
+    ):
+        views.setdefault(digest, {})[view_name or '-'] = count
+
+    for row in top:
+        row['total_ms'] = round(row['total'] * 1000, 2)
+        row['mean_ms'] = round(row['total'] / row['count'] * 1000, 3) if row['count'] else 0
+        row['max_ms'] = round(row['slowest'] * 1000, 2)
+        row['views'] = views.get(row['digest'], {})
+    return top
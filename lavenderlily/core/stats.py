@@ -0,0 +1,100 @@
+"""
+Cached aggregate statistics for the staff dashboard.
+
+Row counts come from the materialized SiteCounter totals (core.counters);
+the remaining figures take one conditional-aggregate query per table. The
+result is kept in the cache; once the fresh period ends the stale copy keeps
+being served while a single request (the one that wins the refresh lock)
+recomputes it.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+from dateutil.relativedelta import relativedelta
+
+from store.models import Product, Category, Color
+from . import counters
+from .models import Newsletter
+
+DASHBOARD_STATS_CACHE_KEY = 'core:dashboard_stats'
+DASHBOARD_STATS_LOCK_KEY = 'core:dashboard_stats:refresh'
+REFRESH_LOCK_TIMEOUT = 30
+
+# Dashboard figures read straight from SiteCounter
+DASHBOARD_COUNTERS = {
+    'total_products': counters.PRODUCTS_TOTAL,
+    'total_orders': counters.ORDERS_TOTAL,
+    'pending_orders': counters.order_status_key('processing'),
+    'shipped_orders': counters.order_status_key('shipped'),
+    'delivered_orders': counters.order_status_key('delivered'),
+    'cancelled_orders': counters.order_status_key('cancelled'),
+    'total_users': counters.USERS_TOTAL,
+    'active_users': counters.USERS_ACTIVE,
+    'staff_users': counters.USERS_STAFF,
+    'total_subscribers': counters.SUBSCRIBERS_ACTIVE,
+    'unread_messages': counters.MESSAGES_UNREPLIED,
+}
+
+
+def compute_dashboard_stats():
+    """Collect every dashboard figure from the site counters plus one query per remaining table"""
+    now = timezone.now()
+    this_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    last_month = this_month - relativedelta(months=1)
+
+    totals = counters.get_counters(DASHBOARD_COUNTERS.values())
+    products = Product.objects.aggregate(
+        products_this_month=Count('id', filter=Q(created_at__gte=this_month)),
+        products_last_month=Count('id', filter=Q(created_at__gte=last_month, created_at__lt=this_month)),
+    )
+    newsletters = Newsletter.objects.aggregate(
+        total_newsletters=Count('id'),
+        sent_newsletters=Count('id', filter=Q(status='sent')),
+    )
+
+    stats = {
+        **{name: totals[key] for name, key in DASHBOARD_COUNTERS.items()},
+        **products,
+        **newsletters,
+        'total_categories': Category.objects.count(),
+        'total_colors': Color.objects.count(),
+    }
+
+    # Calculate product growth percentage
+    products_this_month = stats['products_this_month']
+    products_last_month = stats['products_last_month']
+    if products_last_month > 0:
+        stats['product_growth_percentage'] = ((products_this_month - products_last_month) / products_last_month) * 100
+    else:
+        stats['product_growth_percentage'] = 0 if products_this_month == 0 else 100
+
+    return stats
+
+
+def get_dashboard_stats():
+    """Return dashboard counters from the cache, refreshing them stale-while-revalidate"""
+    entry = cache.get(DASHBOARD_STATS_CACHE_KEY)
+    locked = False
+    if entry is not None:
+        if entry['fresh_until'] > time.time():
+            return entry['stats']
+        # Stale: only the request that takes the lock recomputes, the rest serve the old copy
+        if not cache.add(DASHBOARD_STATS_LOCK_KEY, 1, REFRESH_LOCK_TIMEOUT):
+            return entry['stats']
+        locked = True
+
+    try:
+        stats = compute_dashboard_stats()
+        cache.set(
+            DASHBOARD_STATS_CACHE_KEY,
+            {'stats': stats, 'fresh_until': time.time() + settings.DASHBOARD_STATS_TTL},
+            settings.DASHBOARD_STATS_TTL + settings.DASHBOARD_STATS_STALE_TTL,
+        )
+    finally:
+        # A cold-cache recompute never took the lock, so it must not release someone else's
+        if locked:
+            cache.delete(DASHBOARD_STATS_LOCK_KEY)
+    return stats
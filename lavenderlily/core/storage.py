@@ -0,0 +1,109 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.storage import FileSystemStorage
+from django.core.files.move import file_move_safe
+
+# Content-addressed uploads live under MEDIA_ROOT/<BLOB_DIR>/<first two hex digits>/
+BLOB_DIR = 'blobs'
+BLOB_TMP_DIR = posixpath.join(BLOB_DIR, 'tmp')
+
+
+class AssetManifestStorage(ManifestStaticFilesStorage):
+    """
+    Hashed static file names from the collectstatic manifest.
+    Files that have not been collected yet (e.g. in tests or before the first
+    build_assets run) fall back to their plain name instead of raising.
+    """
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+def blob_name(digest, extension):
+    return posixpath.join(BLOB_DIR, digest[:2], digest + extension.lower())
+
+
+def is_blob(name):
+    return name.startswith(BLOB_DIR + '/') and not name.startswith(BLOB_TMP_DIR + '/')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Media storage that keeps each unique upload once, named by its SHA-256.
+
+    Uploads are hashed while they are streamed to a temporary file, which is
+    then moved to blobs/<xx>/<digest><ext>; if that blob already exists the
+    copy is discarded, the existing blob's mtime is refreshed (gc_media's grace
+    period counts from it) and the existing name is returned. Names never change
+    content, so their URLs can be cached forever. Several rows may share a
+    blob, so delete() leaves blobs alone; gc_media removes unreferenced ones.
+    Files saved before this storage was introduced keep working unchanged.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content has been hashed in _save()
+        return name
+
+    def _save(self, name, content):
+        tmp_dir = self.path(BLOB_TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            name = blob_name(digest.hexdigest(), os.path.splitext(name)[1])
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                try:
+                    # Restart gc_media's grace period: the row that will reference the blob is not committed yet
+                    os.utime(full_path)
+                except FileNotFoundError:
+                    # gc_media removed it in the meantime; store this copy instead
+                    pass
+                else:
+                    os.remove(tmp_path)
+                    return name
+
+            directory = os.path.dirname(full_path)
+            if self.directory_permissions_mode is not None:
+                old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+                try:
+                    os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+                finally:
+                    os.umask(old_umask)
+            else:
+                os.makedirs(directory, exist_ok=True)
+
+            # A concurrent upload of the same content may win the race; both hold identical bytes
+            file_move_safe(tmp_path, full_path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
+
+    def delete(self, name):
+        if is_blob(name):
+            return
+        super().delete(name)
+
+    def delete_blob(self, name):
+        """Remove a blob for real; only gc_media should call this"""
+        super().delete(name)
@@ -0,0 +1,28 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from core import critical_css
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def critical_stylesheet(context, path):
+    """
+    Inline the page's critical CSS (see build_critical_css) and load the full
+    stylesheet asynchronously; a plain <link> when none has been built.
+    """
+    url = static(path)
+    critical = critical_css.load(context.template.name) if context.template else None
+    if not critical:
+        return format_html('<link rel="stylesheet" href="{}" />', url)
+    return format_html(
+        '<style>{}</style>'
+        '<link rel="preload" href="{}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'" />'
+        '<noscript><link rel="stylesheet" href="{}" /></noscript>',
+        # CSS is raw text inside <style>: quotes and child selectors must not be HTML-escaped.
+        # Minified CSS never contains a closing tag; guard against it anyway
+        mark_safe(critical.replace('</', '<\\/')), url, url,
+    )
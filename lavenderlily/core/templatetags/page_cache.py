@@ -0,0 +1,81 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from core import fragment_cache
+from core.page_cache import VERSIONED_MODELS, render_hole
+
+register = template.Library()
+
+VERSIONED_TAGS = {label.lower() for label in VERSIONED_MODELS}
+
+
+@register.simple_tag(takes_context=True)
+def page_hole(context, template_name):
+    """Render a per-visitor fragment that cached pages re-render on every request"""
+    return mark_safe(render_hole(context, template_name))
+
+
+class CachedFragmentNode(template.Node):
+    def __init__(self, nodelist, name, tags, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.tags = tags
+        self.vary_on = vary_on
+
+    def render(self, context):
+        vary_on = [expression.resolve(context) for expression in self.vary_on]
+        key = fragment_cache.fragment_key(self.name, self.tags, vary_on)
+
+        html = fragment_cache.get_fragment(key)
+        if html is None:
+            fragment_cache.record(self.name, fragment_cache.MISS)
+            # Holes inside the fragment are marked so the cached copy leaves them out
+            with context.push(page_hole_capture=True):
+                html = self.nodelist.render(context)
+            html = fragment_cache.set_fragment(key, html)
+        else:
+            fragment_cache.record(self.name, fragment_cache.HIT)
+
+        return mark_safe(fragment_cache.fill_fragment(html, context))
+
+
+@register.tag
+def cachedfragment(parser, token):
+    """
+    Cache a block until one of the models it depends on changes:
+
+        {% cachedfragment "footer" "core.socialmedia" vary user.is_authenticated %}
+            ...
+        {% endcachedfragment %}
+
+    The first argument names the fragment (used for hit/miss stats), the quoted
+    app_label.model arguments are its dependencies and anything after "vary"
+    is resolved per render and added to the key.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a fragment name")
+
+    args = bits[1:]
+    vary_on = []
+    if 'vary' in args:
+        index = args.index('vary')
+        vary_on = [parser.compile_filter(bit) for bit in args[index + 1:]]
+        args = args[:index]
+
+    def literal(bit):
+        if len(bit) < 2 or bit[0] != bit[-1] or bit[0] not in '"\'':
+            raise template.TemplateSyntaxError(f"'{bits[0]}' arguments before 'vary' must be quoted strings")
+        return bit[1:-1]
+
+    name = literal(args[0])
+    tags = [literal(bit).lower() for bit in args[1:]]
+    unknown = [tag for tag in tags if tag not in VERSIONED_TAGS]
+    if unknown:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' dependencies {', '.join(unknown)} are not versioned; add them to core.page_cache.VERSIONED_MODELS"
+        )
+
+    nodelist = parser.parse(('endcachedfragment',))
+    parser.delete_first_token()
+    return CachedFragmentNode(nodelist, name, tags, vary_on)
@@ -0,0 +1,27 @@
+import logging
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+from . import newsletter_tracking, queries, slow_queries
+
+
+class TestRunner(DiscoverRunner):
+    """
+    DiscoverRunner that keeps the buffered slow-query log and newsletter
+    counters of a test run out of the developer's database: both flush at
+    exit, after the test database has been destroyed. The per-request query
+    stats line is silenced too; over-budget warnings still show.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.SLOW_QUERY_LOG_ENABLED = False
+        self.query_log_level = queries.logger.level
+        queries.logger.setLevel(logging.WARNING)
+
+    def teardown_test_environment(self, **kwargs):
+        queries.logger.setLevel(self.query_log_level)
+        slow_queries.discard()
+        newsletter_tracking.discard()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1449 @@
-from django.test import TestCase
+import gc
+import io
+import json
+import os
+import re
+import signal
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from decimal import Decimal
+from html import unescape
+from smtplib import SMTPServerDisconnected
+from unittest import mock
+from urllib.parse import parse_qsl, urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.db import DatabaseError, connection, transaction
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, get_resolver, resolve, reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from cart.models import CartItem, WishlistItem
+from orders.models import DailyCategorySales, DailyProductSales, DailySales, DailyStatusCount, Order, OrderItem
+from store.models import Category, Color, Product, Review, Size
+from . import (
+    checks, content_cache, counters, memory, metrics, newsletter_tracking, page_cache, profiling, slow_queries, tracing,
+)
+from .models import (
+    AboutPage, ContactMessage, ContactPage, ContactService, Homepage, Newsletter, NewsletterDailyStat,
+    NewsletterRecipientHit, NewsletterSubscriber, QueryFingerprint, SiteCounter, SocialMedia, UserAddress,
+)
+from .newsletter_render import add_tracking, make_subscriber_token, read_subscriber_token
+from .queries import QueryRecorder, fingerprint
+from .segments import quintile_scores, segment_for
+from .utils import import_subscribers, send_newsletter_to_all
+from .stats import DASHBOARD_STATS_CACHE_KEY, DASHBOARD_STATS_LOCK_KEY, get_dashboard_stats
+
+
+@override_settings(DASHBOARD_STATS_TTL=60, DASHBOARD_STATS_STALE_TTL=600)
+class AdminDashboardQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pass', is_staff=True)
+        customer = User.objects.create_user('customer', 'customer@example.com', 'pass')
+        for index, status in enumerate(['processing', 'shipped', 'delivered', 'cancelled']):
+            Order.objects.create(
+                user=customer, order_number=f'LL-{index}', total_amount=Decimal('100'), status=status
+            )
+        NewsletterSubscriber.objects.create(email='reader@example.com')
+        ContactMessage.objects.create(name='Guest', email='guest@example.com', message='Hello')
+        counters.reconcile()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.staff)
+
+    def test_dashboard_counts(self):
+        response = self.client.get(reverse('admin_dashboard'))
+        self.assertEqual(response.context['total_orders'], 4)
+        self.assertEqual(response.context['pending_orders'], 1)
+        self.assertEqual(response.context['cancelled_orders'], 1)
+        self.assertEqual(response.context['total_users'], 2)
+        self.assertEqual(response.context['staff_users'], 1)
+        self.assertEqual(response.context['total_subscribers'], 1)
+        self.assertEqual(response.context['unread_messages'], 1)
+
+    def test_dashboard_query_budget(self):
+        # Cold cache: session, user, one SiteCounter lookup, 4 aggregate queries,
+        # recent orders/messages and the cart/wishlist/social-media context processor
+        with self.assertNumQueries(12):
+            self.client.get(reverse('admin_dashboard'))
+
+        # Warm cache: the aggregate queries and social media links are skipped entirely
+        with self.assertNumQueries(6):
+            self.client.get(reverse('admin_dashboard'))
+
+    def test_stale_stats_are_served_while_another_request_refreshes(self):
+        get_dashboard_stats()
+        entry = cache.get(DASHBOARD_STATS_CACHE_KEY)
+        entry['fresh_until'] = 0
+        cache.set(DASHBOARD_STATS_CACHE_KEY, entry)
+        cache.add(DASHBOARD_STATS_LOCK_KEY, 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dashboard_stats()['total_orders'], 4)
+
+        cache.delete(DASHBOARD_STATS_LOCK_KEY)
+        with self.assertNumQueries(4):
+            get_dashboard_stats()
+        self.assertGreater(cache.get(DASHBOARD_STATS_CACHE_KEY)['fresh_until'], 0)
+
+
+    def test_cold_recompute_leaves_another_requests_lock_alone(self):
+        cache.add(DASHBOARD_STATS_LOCK_KEY, 1)
+        get_dashboard_stats()
+        self.assertIsNotNone(cache.get(DASHBOARD_STATS_LOCK_KEY))
+        cache.delete(DASHBOARD_STATS_LOCK_KEY)
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pass', is_staff=True)
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pass')
+        cls.category = Category.objects.create(name='Test Dresses')
+        color = Color.objects.create(name='Test Lavender')
+        cls.product = Product.objects.create(name='Linen Dress', category=cls.category, color=color, price=Decimal('250'))
+        cls.order = cls.create_order('LL-1', 'processing', quantity=2)
+        cls.create_order('LL-2', 'cancelled', quantity=5)
+
+    @classmethod
+    def create_order(cls, number, status, quantity):
+        order = Order.objects.create(
+            user=cls.customer, order_number=number, total_amount=Decimal('250') * quantity, status=status,
+        )
+        OrderItem.objects.create(order=order, product=cls.product, quantity=quantity, price=Decimal('250'))
+        return order
+
+    def rollup(self):
+        call_command('rollup_sales', stdout=io.StringIO())
+
+    def test_rollup_counts_orders_but_not_cancelled_revenue(self):
+        self.rollup()
+        sales = DailySales.objects.get()
+        self.assertEqual((sales.order_count, sales.revenue, sales.units), (2, Decimal('500'), 2))
+        self.assertEqual(
+            dict(DailyStatusCount.objects.values_list('status', 'count')), {'processing': 1, 'cancelled': 1}
+        )
+        self.assertEqual(DailyProductSales.objects.get().units, 2)
+        self.assertEqual(DailyCategorySales.objects.get().revenue, Decimal('500'))
+
+    def test_incremental_run_picks_up_order_item_changes(self):
+        self.rollup()
+        item = self.order.items.get()
+        item.quantity = 3
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        self.rollup()
+        self.assertEqual(DailySales.objects.get().units, 3)
+
+        # A product delete cascades to its order items; their orders are touched in one UPDATE
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        touches = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "orders_order"')]
+        self.assertEqual(len(touches), 1)
+        self.rollup()
+        self.assertEqual(DailySales.objects.get().units, 0)
+        self.assertFalse(DailyProductSales.objects.exists())
+
+    def test_incremental_run_skips_unchanged_days(self):
+        self.rollup()
+        DailySales.objects.update(units=99)
+        self.rollup()
+        self.assertEqual(DailySales.objects.get().units, 99)
+
+    def test_dashboard_charts_read_the_rollups(self):
+        self.rollup()
+        self.client.force_login(self.staff)
+        data = self.client.get(reverse('dashboard_charts')).json()
+
+        self.assertEqual(
+            data['monthly_revenue'],
+            [{'month': timezone.localdate().strftime('%Y-%m'), 'revenue': 500.0, 'orders': 2, 'units': 2}],
+        )
+        self.assertEqual(
+            data['top_products'], [{'id': self.product.pk, 'name': 'Linen Dress', 'units': 2, 'revenue': 500.0}]
+        )
+        self.assertEqual(data['top_categories'][0]['name'], 'Test Dresses')
+        self.assertEqual(data['orders_by_status'], {'cancelled': 1, 'processing': 1})
+
+
+class ManageCategoriesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pass', is_staff=True)
+        cls.category = Category.objects.create(name='Test Dresses')
+        cls.empty = Category.objects.create(name='Test Empty')
+        Product.objects.create(
+            name='Linen Dress', category=cls.category, color=Color.objects.create(name='Test Lavender'),
+            price=Decimal('250'),
+        )
+        counters.reconcile()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.staff)
+
+    def test_product_counts_are_live(self):
+        # A queryset update bypasses the counter signals; the Delete button must follow the real rows
+        Product.objects.update(category=self.empty)
+        response = self.client.get(reverse('manage_categories'))
+        counts = {
+            category.name: category.product_count
+            for category in response.context['categories'] if category.name.startswith('Test ')
+        }
+        self.assertEqual(counts, {'Test Dresses': 0, 'Test Empty': 1})
+
+    def test_category_with_products_is_not_deleted(self):
+        for category in [self.category, self.empty]:
+            self.client.post(reverse('manage_categories'), {'action': 'delete', 'category_id': category.pk})
+        self.assertEqual(
+            list(Category.objects.filter(name__startswith='Test ').values_list('name', flat=True)), ['Test Dresses']
+        )
+        self.assertTrue(Product.objects.exists())
+
+
+class BackfillPlaceholdersTests(TestCase):
+    def test_rows_are_loaded_one_batch_at_a_time(self):
+        category = Category.objects.create(name='Test Dresses')
+        color = Color.objects.create(name='Test Lavender')
+        products = [
+            Product.objects.create(
+                name=f'Dress {index}', category=category, color=color, price=Decimal('250'),
+                image_main=f'products/dress-{index}.jpg',
+            )
+            for index in range(3)
+        ]
+
+        with mock.patch('store.placeholders.generate', return_value='data:image/webp;base64,AA') as generate:
+            with CaptureQueriesContext(connection) as queries:
+                call_command('backfill_placeholders', batch_size=2, workers=1, stdout=io.StringIO())
+
+        generated = sorted(pk for label, pk, _ in (call.args for call in generate.call_args_list) if label == 'store.Product')
+        self.assertEqual(generated, [product.pk for product in products])
+        pages = [query['sql'] for query in queries if query['sql'].startswith('SELECT "store_product"."id"')]
+        self.assertEqual(len(pages), 3)
+        self.assertTrue(all('LIMIT 2' in sql for sql in pages))
+
+
+@override_settings(QUERY_INSTRUMENTATION_ENABLED=True)
+class QueryInstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pass', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def test_views_that_never_load_the_user_run_no_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('newsletter_open', args=[make_subscriber_token(1, 1)]))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_staff_get_server_timing(self):
+        response = self.client.get(reverse('size_chart'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+
+
+class SiteCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pass')
+        counters.reconcile()
+
+    def setUp(self):
+        cache.clear()
+
+    def create_order(self, number, status='processing'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Order.objects.create(
+                user=self.customer, order_number=number, total_amount=Decimal('50'), status=status
+            )
+
+    def test_signals_track_creates_status_changes_and_deletes(self):
+        order = self.create_order('LL-1')
+        self.create_order('LL-2')
+        self.assertEqual(counters.get_counter(counters.ORDERS_TOTAL), 2)
+        self.assertEqual(counters.get_counter(counters.order_status_key('processing')), 2)
+
+        order = Order.objects.get(pk=order.pk)
+        order.status = 'shipped'
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        self.assertEqual(counters.get_counter(counters.order_status_key('processing')), 1)
+        self.assertEqual(counters.get_counter(counters.order_status_key('shipped')), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.delete()
+        self.assertEqual(counters.get_counter(counters.ORDERS_TOTAL), 1)
+        self.assertEqual(counters.get_counter(counters.order_status_key('shipped')), 0)
+
+    def test_reads_are_served_from_the_cache(self):
+        counters.get_counter(counters.USERS_TOTAL)
+        with self.assertNumQueries(0):
+            self.assertEqual(counters.get_counter(counters.USERS_TOTAL), 1)
+
+    def test_reconcile_corrects_drift(self):
+        # Queryset updates bypass the signal handlers
+        NewsletterSubscriber.objects.bulk_create([NewsletterSubscriber(email='bulk@example.com')])
+        self.assertEqual(counters.get_counter(counters.SUBSCRIBERS_ACTIVE), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            _, drift = counters.reconcile()
+        self.assertEqual(drift[counters.SUBSCRIBERS_ACTIVE], (0, 1))
+        self.assertEqual(SiteCounter.objects.get(key=counters.SUBSCRIBERS_ACTIVE).value, 1)
+        self.assertEqual(counters.get_counter(counters.SUBSCRIBERS_ACTIVE), 1)
+
+
+class SubscriberCsvTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pass', is_staff=True)
+        NewsletterSubscriber.objects.create(email='Reader@Example.com', is_active=False)
+        NewsletterSubscriber.objects.create(email='active@example.com')
+        counters.reconcile()
+
+    def test_import_matches_existing_emails_case_insensitively(self):
+        rows = [['email'], ['READER@example.com'], ['new@example.com'], ['not-an-email']]
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = import_subscribers(rows, reactivate=True)
+
+        self.assertEqual((stats['created'], stats['reactivated'], stats['invalid']), (1, 1, 1))
+        self.assertEqual(NewsletterSubscriber.objects.filter(email__iexact='reader@example.com').count(), 1)
+        self.assertTrue(NewsletterSubscriber.objects.get(email='Reader@Example.com').is_active)
+        self.assertEqual(counters.get_counter(counters.SUBSCRIBERS_TOTAL), 3)
+        self.assertEqual(counters.get_counter(counters.SUBSCRIBERS_ACTIVE), 3)
+
+    def test_import_failing_midway_keeps_the_committed_chunks(self):
+        def rows():
+            yield ['first@example.com']
+            yield ['second@example.com']
+            yield ['third@example.com']
+            raise UnicodeDecodeError('utf-8', b'\xff', 0, 1, 'invalid start byte')
+
+        stats = {}
+        with self.assertRaises(UnicodeDecodeError):
+            import_subscribers(rows(), chunk_size=2, stats=stats)
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(
+            set(NewsletterSubscriber.objects.filter(email__endswith='d@example.com').values_list('email', flat=True)),
+            {'second@example.com'},
+        )
+        self.assertTrue(NewsletterSubscriber.objects.filter(email='first@example.com').exists())
+        self.assertFalse(NewsletterSubscriber.objects.filter(email='third@example.com').exists())
+
+    def test_concurrent_subscription_is_not_counted_as_created(self):
+        NewsletterSubscriber.objects.create(email='race@example.com')
+        annotate = NewsletterSubscriber.objects.annotate
+        lookups = []
+
+        def stale_first_lookup(*args, **kwargs):
+            # The first lookup runs before the subscribe form saved race@example.com
+            lookups.append(1)
+            queryset = annotate(*args, **kwargs)
+            return queryset.none() if len(lookups) == 1 else queryset
+
+        with mock.patch.object(NewsletterSubscriber.objects, 'annotate', stale_first_lookup):
+            stats = import_subscribers([['race@example.com'], ['calm@example.com']])
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual((stats['created'], stats['existing']), (1, 1))
+        self.assertEqual(NewsletterSubscriber.objects.filter(email__in=['race@example.com', 'calm@example.com']).count(), 2)
+
+    def test_export_streams_every_subscriber(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('export_subscribers_csv'))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'email,is_active,subscribed_at,unsubscribed_at')
+        self.assertEqual([line.split(',')[:2] for line in lines[1:]], [['Reader@Example.com', '0'], ['active@example.com', '1']])
+
+        response = self.client.get(reverse('export_subscribers_csv'), {'is_active': '1'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['active@example.com'])
+
+
+class NewsletterUnsubscribeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscriber = NewsletterSubscriber.objects.create(email='reader@example.com')
+        counters.reconcile()
+
+    def setUp(self):
+        self.url = reverse('newsletter_unsubscribe', args=[make_subscriber_token(self.subscriber.pk, 7)])
+
+    def assertSubscribed(self, subscribed):
+        self.subscriber.refresh_from_db()
+        self.assertEqual(self.subscriber.is_active, subscribed)
+
+    def test_token_round_trip(self):
+        self.assertEqual(read_subscriber_token(make_subscriber_token(self.subscriber.pk, 7)), (self.subscriber.pk, 7))
+
+    def test_get_only_asks_for_confirmation(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, 'reader@example.com')
+        self.assertSubscribed(True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url)
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertSubscribed(False)
+        self.assertIsNotNone(NewsletterSubscriber.objects.get(pk=self.subscriber.pk).unsubscribed_at)
+        self.assertEqual(counters.get_counter(counters.SUBSCRIBERS_ACTIVE), 0)
+
+    def test_one_click_post_needs_no_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        response = client.post(self.url, {'List-Unsubscribe': 'One-Click'})
+        self.assertEqual(response.status_code, 200)
+        self.assertSubscribed(False)
+
+    def test_tampered_tokens_are_rejected(self):
+        token = make_subscriber_token(self.subscriber.pk, 7)
+        other = NewsletterSubscriber.objects.create(email='other@example.com')
+        forged = f'{other.pk:x}' + token[token.index('.'):]
+        for bad in [forged, token[:-1] + ('0' if token[-1] != '0' else '1'), 'not-a-token']:
+            with self.subTest(token=bad):
+                self.assertIsNone(read_subscriber_token(bad))
+                response = self.client.post(reverse('newsletter_unsubscribe', args=[bad]))
+                self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertSubscribed(True)
+        other.refresh_from_db()
+        self.assertTrue(other.is_active)
+
+
+class DroppingEmailBackend(LocmemEmailBackend):
+    """Locmem backend that counts opens and drops the connection when told to"""
+    opens = 0
+    drops = []
+
+    def open(self):
+        DroppingEmailBackend.opens += 1
+        return True
+
+    def send_messages(self, messages):
+        if DroppingEmailBackend.drops and DroppingEmailBackend.drops.pop(0):
+            raise SMTPServerDisconnected('Connection unexpectedly closed')
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND='core.tests.DroppingEmailBackend',
+    NEWSLETTER_MESSAGES_PER_CONNECTION=2,
+    NEWSLETTER_TRACKING_FLUSH_SECONDS=10 ** 9,
+    NEWSLETTER_TRACKING_FLUSH_SIZE=10 ** 9,
+)
+class NewsletterSendTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        NewsletterSubscriber.objects.bulk_create(
+            NewsletterSubscriber(email=f'reader{i}@example.com') for i in range(5)
+        )
+        cls.newsletter = Newsletter.objects.create(subject='Spring', content='New arrivals')
+
+    def setUp(self):
+        DroppingEmailBackend.opens = 0
+        DroppingEmailBackend.drops = []
+
+    def test_connection_is_reopened_in_batches(self):
+        self.assertEqual(send_newsletter_to_all(self.newsletter), 5)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(DroppingEmailBackend.opens, 3)
+
+    def test_dropped_connection_is_reopened_and_the_message_retried(self):
+        DroppingEmailBackend.drops = [False, True]
+        self.assertEqual(send_newsletter_to_all(self.newsletter), 5)
+        self.assertEqual(
+            [message.to[0] for message in mail.outbox], [f'reader{i}@example.com' for i in range(5)]
+        )
+
+    def test_failed_open_is_logged_per_recipient(self):
+        with mock.patch.object(DroppingEmailBackend, 'open', side_effect=[True, OSError('refused'), True, True]):
+            with self.assertLogs('core.utils', 'ERROR') as logs:
+                sent = send_newsletter_to_all(self.newsletter)
+        self.assertEqual(sent, 4)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('reader2@example.com', logs.output[0])
+
+
+@override_settings(NEWSLETTER_TRACKING_FLUSH_SECONDS=10 ** 9, NEWSLETTER_TRACKING_FLUSH_SIZE=10 ** 9)
+class NewsletterClickTests(TestCase):
+    def test_tracked_link_keeps_every_query_parameter(self):
+        html = add_tracking('<a href="https://shop.example.com/sale?a=1&amp;b=2">Sale</a>')
+        href = unescape(re.search(r'href="([^"]+)"', html).group(1))
+        href = href.replace('{{ token }}', make_subscriber_token(1, 1))
+
+        response = self.client.get(urlsplit(href).path, dict(parse_qsl(urlsplit(href).query)))
+        self.assertRedirects(response, 'https://shop.example.com/sale?a=1&b=2', fetch_redirect_response=False)
+
+    def test_tampered_target_is_not_followed(self):
+        html = add_tracking('<a href="https://shop.example.com/">Shop</a>')
+        href = unescape(re.search(r'href="([^"]+)"', html).group(1)).replace('{{ token }}', make_subscriber_token(1, 1))
+        query = dict(parse_qsl(urlsplit(href).query), u='https://evil.example.com/')
+
+        response = self.client.get(urlsplit(href).path, query)
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+
+@override_settings(NEWSLETTER_TRACKING_FLUSH_SECONDS=10 ** 9, NEWSLETTER_TRACKING_FLUSH_SIZE=10 ** 9)
+class NewsletterTrackingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.newsletter = Newsletter.objects.create(subject='Spring', content='New arrivals')
+        cls.reader = NewsletterSubscriber.objects.create(email='reader@example.com')
+        cls.other = NewsletterSubscriber.objects.create(email='other@example.com')
+
+    def setUp(self):
+        newsletter_tracking.discard()
+
+    def tearDown(self):
+        newsletter_tracking.discard()
+
+    def stats(self):
+        return NewsletterDailyStat.objects.values('opens', 'unique_opens', 'clicks', 'unique_clicks').get()
+
+    def test_unique_hits_are_kept_in_the_database(self):
+        for subscriber in [self.reader, self.reader, self.other]:
+            newsletter_tracking.record_hit(self.newsletter.pk, subscriber.pk, newsletter_tracking.OPEN)
+        self.assertEqual(newsletter_tracking.flush(), 5)
+
+        # A later flush, or another process, sees the first hits already recorded
+        newsletter_tracking.record_hit(self.newsletter.pk, self.reader.pk, newsletter_tracking.OPEN)
+        newsletter_tracking.record_hit(self.newsletter.pk, self.reader.pk, newsletter_tracking.CLICK)
+        newsletter_tracking.flush()
+
+        self.assertEqual(self.stats(), {'opens': 4, 'unique_opens': 2, 'clicks': 1, 'unique_clicks': 1})
+        self.assertEqual(NewsletterRecipientHit.objects.count(), 3)
+
+    def test_hits_of_deleted_subscribers_and_newsletters_are_dropped(self):
+        gone = Newsletter.objects.create(subject='Gone', content='')
+        newsletter_tracking.record_hit(gone.pk, self.reader.pk, newsletter_tracking.OPEN)
+        newsletter_tracking.record_hit(self.newsletter.pk, self.other.pk + 100, newsletter_tracking.OPEN)
+        gone.delete()
+        newsletter_tracking.flush()
+
+        self.assertEqual(self.stats(), {'opens': 1, 'unique_opens': 0, 'clicks': 0, 'unique_clicks': 0})
+
+    def test_failed_flush_keeps_the_hits(self):
+        newsletter_tracking.record_hit(self.newsletter.pk, self.reader.pk, newsletter_tracking.OPEN)
+        with mock.patch.object(Newsletter.objects, 'filter', side_effect=RuntimeError('database is down')):
+            with self.assertLogs('core.newsletter_tracking', 'ERROR'):
+                self.assertEqual(newsletter_tracking.flush(), 0)
+
+        self.assertEqual(newsletter_tracking.flush(), 2)
+        self.assertEqual(self.stats()['unique_opens'], 1)
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    def test_process_local_cache_is_reported(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=locmem):
+            self.assertEqual([warning.id for warning in checks.check_shared_cache(None)], ['core.W001'])
+
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+
+def temporary_setting_dir(test, setting):
+    """Point a directory setting at a fresh temporary directory for one test; returns its path"""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    settings_override = override_settings(**{setting: directory.name})
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+    return directory.name
+
+
+@override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=['127.0.0.1', '10.1.0.0/16'])
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.metrics_dir = temporary_setting_dir(self, 'METRICS_DIR')
+        # Start from an empty process: nothing recorded by earlier tests
+        metrics._forget_parent()
+        self.addCleanup(metrics._forget_parent)
+
+    def total(self, metric, **labels):
+        return metrics.snapshot().get(metric._key(labels), 0)
+
+    def test_finished_threads_are_folded_into_the_process_totals(self):
+        def record():
+            metrics.CHECKOUT.inc(step=metrics.ORDER_PLACED)
+
+        for _ in range(5):
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join()
+        gc.collect()
+
+        self.assertEqual(len(metrics._thread_values), 0)
+        self.assertEqual(self.total(metrics.CHECKOUT, step=metrics.ORDER_PLACED), 5)
+        metrics.CHECKOUT.inc(step=metrics.ORDER_PLACED)
+        self.assertEqual(self.total(metrics.CHECKOUT, step=metrics.ORDER_PLACED), 6)
+
+    def test_exposition_adds_up_every_process_file(self):
+        metrics.CHECKOUT.inc(step=metrics.ORDER_PLACED)
+        metrics.EMAILS.inc(kind='news"letter\n', result='sent')
+        metrics.REQUEST_QUERIES.observe(3, view='home')
+        metrics.REQUEST_QUERIES.observe(7, view='home')
+        # Another worker's totals
+        with open(os.path.join(self.metrics_dir, '999999.json'), 'w') as f:
+            f.write('[["lavenderlily_checkout_total", ["order_placed"], 4]]')
+        Newsletter.objects.create(
+            subject='Due', content='', status='scheduled', scheduled_at=timezone.now() - timezone.timedelta(seconds=60),
+        )
+
+        lines = metrics.render().splitlines()
+
+        self.assertIn('# TYPE lavenderlily_checkout_total counter', lines)
+        self.assertIn('lavenderlily_checkout_total{step="order_placed"} 5', lines)
+        self.assertIn('lavenderlily_emails_total{kind="news\\"letter\\n",result="sent"} 1', lines)
+        self.assertIn('# TYPE lavenderlily_db_queries_per_request histogram', lines)
+        buckets = [line for line in lines if line.startswith('lavenderlily_db_queries_per_request_bucket{view="home"')]
+        self.assertEqual(buckets[3:6], [
+            'lavenderlily_db_queries_per_request_bucket{view="home",le="5"} 1',
+            'lavenderlily_db_queries_per_request_bucket{view="home",le="10"} 2',
+            'lavenderlily_db_queries_per_request_bucket{view="home",le="20"} 2',
+        ])
+        self.assertEqual(buckets[-1], 'lavenderlily_db_queries_per_request_bucket{view="home",le="+Inf"} 2')
+        self.assertIn('lavenderlily_db_queries_per_request_sum{view="home"} 10', lines)
+        self.assertIn('lavenderlily_db_queries_per_request_count{view="home"} 2', lines)
+        self.assertIn('lavenderlily_newsletter_queue_depth 1', lines)
+
+    def test_scrapes_need_an_allowed_address_or_the_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 200)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.1.2.3').status_code, 200)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.2.0.1').status_code, 403)
+
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(
+                self.client.get(url, REMOTE_ADDR='10.2.0.1', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200
+            )
+            self.assertEqual(
+                self.client.get(url, REMOTE_ADDR='10.2.0.1', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403
+            )
+
+
+@override_settings(SLOW_QUERY_LOG_EXPLAIN=False, SLOW_QUERY_LOG_MAX_FINGERPRINTS=1000)
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        slow_queries.discard()
+        self.addCleanup(slow_queries.discard)
+        slow_queries._explained.clear()
+
+    def record(self, view, *statements):
+        recorder = QueryRecorder(keep_params=True)
+        with recorder.install():
+            for statement in statements:
+                statement()
+        slow_queries.record(recorder, view)
+
+    def lookup(self, pk):
+        return lambda: User.objects.filter(pk=pk).exists()
+
+    def test_statements_are_aggregated_by_fingerprint_and_view(self):
+        self.record('home', self.lookup(1), self.lookup(2))
+        self.record('home', self.lookup(3))
+        self.record('shop', self.lookup(4))
+        self.assertEqual(slow_queries.flush(), 4)
+
+        self.record('home', self.lookup(5))
+        slow_queries.flush()
+
+        rows = dict(QueryFingerprint.objects.values_list('view', 'count'))
+        self.assertEqual(rows, {'home': 4, 'shop': 1})
+        self.assertEqual(QueryFingerprint.objects.values('digest').distinct().count(), 1)
+        self.assertEqual(slow_queries.top_fingerprints()[0]['views'], {'home': 4, 'shop': 1})
+
+    @override_settings(SLOW_QUERY_LOG_MAX_FINGERPRINTS=1)
+    def test_full_table_counts_what_it_drops(self):
+        self.record('home', self.lookup(1), lambda: Category.objects.count(), lambda: Category.objects.count())
+
+        with self.assertLogs('core.slow_queries', 'WARNING') as logs:
+            self.assertEqual(slow_queries.flush(), 1)
+        self.assertIn('2 executions were not recorded', logs.output[0])
+        self.assertEqual(QueryFingerprint.objects.count(), 1)
+
+    def test_failed_flush_keeps_the_statements(self):
+        self.record('home', self.lookup(1))
+        with mock.patch.object(QueryFingerprint.objects, 'bulk_create', side_effect=DatabaseError('database is down')):
+            with self.assertLogs('core.slow_queries', 'ERROR'):
+                self.assertEqual(slow_queries.flush(), 0)
+        self.assertFalse(QueryFingerprint.objects.exists())
+
+        self.record('home', self.lookup(2))
+        self.assertEqual(slow_queries.flush(), 2)
+        self.assertEqual(QueryFingerprint.objects.get().count, 2)
+
+    @override_settings(SLOW_QUERY_LOG_EXPLAIN=True)
+    def test_each_select_is_explained_once(self):
+        self.record('home', self.lookup(1), lambda: Category.objects.filter(pk=1).update(name='x'))
+        slow_queries.flush()
+
+        plans = dict(QueryFingerprint.objects.values_list('fingerprint', 'plan'))
+        select, = [plan for statement, plan in plans.items() if statement.startswith('SELECT')]
+        update, = [plan for statement, plan in plans.items() if statement.startswith('UPDATE')]
+        self.assertTrue(select)
+        self.assertEqual(update, '')
+
+        self.record('home', self.lookup(2))
+        with mock.patch.object(slow_queries, 'explain') as explain:
+            slow_queries.flush()
+        explain.assert_not_called()
+
+
+@override_settings(REQUEST_PROFILER_KEEP=2, QUERY_INSTRUMENTATION_ENABLED=False)
+class RequestProfilerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pass', is_staff=True)
+        cls.shopper = User.objects.create_user('shopper', 'shopper@example.com', 'pass')
+
+    def setUp(self):
+        self.profile_dir = temporary_setting_dir(self, 'REQUEST_PROFILER_DIR')
+        cache.clear()
+
+    def test_staff_get_a_report_and_a_stored_profile(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('size_chart'), {'_profile': ''})
+
+        self.assertTemplateUsed(response, 'admin/request_profile.html')
+        profile, = profiling.list_profiles()
+        self.assertEqual((profile['view'], profile['mode'], profile['status']), ('size_chart', profiling.CPROFILE, 200))
+        self.assertEqual(profile['query_string'], '')
+        self.assertIn('store/size_chart.html', [row['name'] for row in profile['templates']])
+        self.assertGreater(profile['sql']['count'], 0)
+        self.assertTrue(profile['functions'])
+        self.assertIsNotNone(profiling.download_path(profile['id'], 'pstats'))
+        self.assertIsNotNone(profiling.download_path(profile['id'], 'collapsed'))
+
+    def test_sampling_mode_stores_no_pstats(self):
+        self.client.force_login(self.staff)
+        self.client.get(reverse('size_chart'), {'_profile': 'sample'})
+
+        profile, = profiling.list_profiles()
+        self.assertEqual(profile['mode'], profiling.SAMPLE)
+        self.assertIsNone(profiling.download_path(profile['id'], 'pstats'))
+
+    def test_other_users_get_the_normal_page(self):
+        self.client.force_login(self.shopper)
+        response = self.client.get(reverse('size_chart'), {'_profile': ''})
+        self.assertTemplateNotUsed(response, 'admin/request_profile.html')
+        self.assertEqual(profiling.list_profiles(), [])
+
+    def test_only_the_newest_profiles_are_kept(self):
+        self.client.force_login(self.staff)
+        for _ in range(3):
+            self.client.get(reverse('size_chart'), {'_profile': 'sample'})
+            time.sleep(0.01)
+        self.assertEqual(len(profiling.list_profiles()), 2)
+        self.assertEqual(len(os.listdir(self.profile_dir)), 4)
+
+    def test_ids_are_validated(self):
+        for bad in ['../../settings', 'A' * 32, '']:
+            self.assertIsNone(profiling.load(bad))
+            self.assertIsNone(profiling.download_path(bad, 'collapsed'))
+
+    def test_compare_reports_the_biggest_changes_first(self):
+        def profile(total, templates, functions):
+            return {
+                'total_ms': total, 'template_ms': sum(templates.values()), 'sql': {'ms': 1.0, 'count': 2},
+                'templates': [{'name': name, 'self_ms': ms} for name, ms in templates.items()],
+                'functions': [{'function': name, 'self_ms': ms} for name, ms in functions.items()],
+            }
+
+        comparison = profiling.compare(
+            profile(10.0, {'base.html': 2.0, 'shop.html': 5.0}, {'render': 4.0}),
+            profile(6.0, {'base.html': 2.5, 'card.html': 1.0}, {'render': 1.0}),
+        )
+        self.assertEqual(comparison['totals'][0], ('Total ms', 10.0, 6.0, -4.0))
+        self.assertEqual(
+            [(row['name'], row['delta']) for row in comparison['templates']],
+            [('shop.html', -5.0), ('card.html', 1.0), ('base.html', 0.5)],
+        )
+
+
+@override_settings(TRACING_SAMPLE_RATE=1, TRACING_SLOW_MS=10 ** 6, TRACING_MAX_SPANS=2000, PAGE_CACHE_ENABLED=False)
+class TracingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # The test runner swaps in its own Template._render, replacing the one install() traced
+        patcher = mock.patch.object(Template, '_render', tracing._traced_template_render(Template._render))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def traced_request(self, url):
+        with mock.patch.object(tracing, 'export') as export:
+            response = self.client.get(url)
+        record, = export.call_args.args
+        return response, record
+
+    def test_request_spans_nest_under_the_root(self):
+        response, record = self.traced_request(reverse('size_chart'))
+
+        self.assertEqual(response['X-Trace-Id'], record['trace_id'])
+        self.assertEqual((record['status'], record['view'], record['kept_because']), (200, 'size_chart', 'sampled'))
+        root, *children = record['spans']
+        self.assertEqual((root['kind'], root['parent_id']), (tracing.REQUEST, None))
+        span_ids = {span['span_id'] for span in record['spans']}
+        self.assertTrue(all(span['parent_id'] in span_ids for span in children))
+        kinds = {span['kind'] for span in children}
+        self.assertTrue({tracing.DB, tracing.TEMPLATE, tracing.CACHE} <= kinds, kinds)
+        self.assertIn('store/size_chart.html', [span['name'] for span in children if span['kind'] == tracing.TEMPLATE])
+
+    @override_settings(TRACING_MAX_SPANS=3)
+    def test_spans_beyond_the_limit_are_counted(self):
+        _, record = self.traced_request(reverse('size_chart'))
+        self.assertEqual(len(record['spans']), 3)
+        self.assertGreater(record['dropped_spans'], 0)
+
+    def test_fast_unsampled_requests_are_not_kept(self):
+        trace = tracing.Trace('GET /')
+        with trace.span(tracing.REQUEST, 'GET /'):
+            pass
+        self.assertIsNone(tracing.keep_reason(trace, sampled=False))
+        self.assertEqual(tracing.keep_reason(trace, sampled=True), 'sampled')
+        with override_settings(TRACING_SLOW_MS=0):
+            self.assertEqual(tracing.keep_reason(trace, sampled=False), 'slow')
+
+    def test_otlp_round_trip(self):
+        record = {
+            'trace_id': '0af7651916cd43dd8448eb211c80319c',
+            'name': 'GET /shop/',
+            'started_at': '2026-10-19T08:30:00+00:00',
+            'duration_ms': 12.5,
+            'status': 200,
+            'view': 'shop',
+            'kept_because': 'slow',
+            'spans': [
+                {
+                    'span_id': 'b7ad6b7169203331', 'parent_id': None, 'kind': tracing.REQUEST, 'name': 'GET /shop/',
+                    'start_ms': 0.0, 'duration_ms': 12.5,
+                    'attributes': {'http.method': 'GET', 'http.status_code': 200, 'view': 'shop'},
+                },
+                {
+                    'span_id': '00f067aa0ba902b7', 'parent_id': 'b7ad6b7169203331', 'kind': tracing.DB, 'name': 'SELECT',
+                    'start_ms': 1.25, 'duration_ms': 0.5,
+                    'attributes': {'db.statement': 'SELECT 1', 'db.executemany': True, 'error': 'OperationalError: x'},
+                },
+                {
+                    'span_id': '53995c3f42cd8ad8', 'parent_id': 'b7ad6b7169203331', 'kind': tracing.TEMPLATE,
+                    'name': 'store/shop.html', 'start_ms': 2.0, 'duration_ms': 8.75, 'attributes': {'ratio': 0.25},
+                },
+            ],
+            'dropped_spans': 7,
+        }
+
+        payload = tracing.to_otlp([record])
+        spans = payload['resourceSpans'][0]['scopeSpans'][0]['spans']
+        self.assertEqual([span['kind'] for span in spans], [2, 3, 1])
+        self.assertEqual(spans[1]['status'], {'code': 2})
+        self.assertEqual(tracing.from_otlp(json.loads(json.dumps(payload))), [record])
+
+    def test_jsonl_file_rotates_and_skips_half_written_lines(self):
+        trace_dir = temporary_setting_dir(self, 'MEDIA_ROOT')
+        path = os.path.join(trace_dir, 'traces', 'traces.jsonl')
+        with override_settings(TRACING_FILE=path, TRACING_FILE_MAX_BYTES=200):
+            tracing.append_jsonl([{'trace_id': f'{index}', 'duration_ms': index, 'pad': 'x' * 150} for index in range(2)])
+            tracing.append_jsonl([{'trace_id': 'new', 'duration_ms': 5}])
+            with open(path, 'a') as f:
+                f.write('{"trace_id": "partial"')
+
+            self.assertTrue(os.path.exists(path + '.1'))
+            self.assertEqual([trace['trace_id'] for trace in tracing.recent_traces(10)], ['new'])
+            self.assertEqual(tracing.find_trace('new', 10)['duration_ms'], 5)
+
+
+@override_settings(MEMORY_VIEW_ALLOCATION_THRESHOLD_MB=1, MEMORY_RSS_LIMIT_MB=None, MEMORY_SNAPSHOT_TOP=5)
+class MemoryMonitorTests(SimpleTestCase):
+    def setUp(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.addCleanup(tracemalloc.stop)
+        # No snapshot thread during tests
+        patcher = mock.patch.object(memory, '_ensure_sampler')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        memory._views.clear()
+        memory._offenders.clear()
+        memory._recycling = False
+        self.addCleanup(memory._views.clear)
+        self.addCleanup(memory._offenders.clear)
+        self.request = RequestFactory().get(reverse('size_chart'))
+        self.request.resolver_match = resolve(reverse('size_chart'))
+
+    def test_allocation_heavy_requests_are_recorded_and_logged(self):
+        kept = []
+
+        def view(request):
+            kept.append(bytearray(3 * memory.MB))
+            bytearray(2 * memory.MB)
+            return HttpResponse()
+
+        with self.assertLogs('core.memory', 'WARNING') as logs:
+            memory.measure(view, self.request)
+        memory.measure(lambda request: HttpResponse(), self.request)
+
+        row, = memory.view_stats()
+        self.assertEqual((row['view'], row['requests'], row['over_threshold']), ('size_chart', 2, 1))
+        self.assertGreaterEqual(row['peak_max_mb'], 3)
+        self.assertGreaterEqual(row['retained_mean_mb'], 1.4)
+        self.assertEqual(json.loads(logs.output[0].split(':', 2)[2])['view'], 'size_chart')
+        self.assertEqual(memory.report()['offenders'][0]['path'], reverse('size_chart'))
+
+    @override_settings(MEMORY_RSS_LIMIT_MB=1)
+    def test_worker_over_the_rss_limit_is_recycled_after_the_response(self):
+        with self.assertLogs('core.memory', 'WARNING'):
+            response = memory.measure(lambda request: HttpResponse(), self.request)
+        second = memory.measure(lambda request: HttpResponse(), self.request)
+
+        with mock.patch.object(os, 'kill') as kill:
+            second.close()
+            kill.assert_not_called()
+            response.close()
+        kill.assert_called_once_with(os.getpid(), signal.SIGTERM)
+
+    def test_snapshot_diff_lists_growing_allocation_sites(self):
+        before = memory.take_snapshot()
+        grown = [bytearray(256 * 1024) for _ in range(4)]
+        with self.assertLogs('core.memory', 'INFO'):
+            memory.record_diff(memory.take_snapshot(), before)
+
+        top = memory.report()['diff']['sites'][0]
+        self.assertTrue(top['site'].startswith('core/tests.py:'), top)
+        self.assertGreaterEqual(top['size_diff_kb'], 1000)
+        del grown
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.media_root = temporary_setting_dir(self, 'MEDIA_ROOT')
+        os.makedirs(os.path.join(self.media_root, 'products'))
+        with open(os.path.join(self.media_root, 'products', 'dress.jpg'), 'wb') as f:
+            f.write(b'0123456789')
+        self.url = reverse('media', kwargs={'path': 'products/dress.jpg'})
+
+    def test_whole_file_and_conditional_requests(self):
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual((response['Content-Type'], response['Accept-Ranges']), ('image/jpeg', 'bytes'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+        not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(not_modified['Cache-Control'], 'public, max-age=3600')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_byte_ranges(self):
+        for header, status, body, content_range in [
+            ('bytes=2-5', 206, b'2345', 'bytes 2-5/10'),
+            ('bytes=7-', 206, b'789', 'bytes 7-9/10'),
+            ('bytes=-3', 206, b'789', 'bytes 7-9/10'),
+            ('bytes=4-100', 206, b'456789', 'bytes 4-9/10'),
+            ('bytes=10-', 416, b'', 'bytes */10'),
+            ('bytes=0-1,4-5', 200, b'0123456789', None),
+            ('lines=1-2', 200, b'0123456789', None),
+        ]:
+            with self.subTest(range=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, status)
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                self.assertEqual(content, body)
+                self.assertEqual(response.get('Content-Range'), content_range)
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag).status_code, 206)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"').status_code, 200)
+
+    def test_blobs_are_immutable_and_named_by_their_digest(self):
+        name = default_storage.save('photo.jpg', ContentFile(b'blob bytes'))
+        response = self.client.get(reverse('media', kwargs={'path': name}))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['ETag'], '"%s"' % os.path.splitext(os.path.basename(name))[0])
+
+    def test_paths_outside_media_root_are_not_served(self):
+        for path in ['../settings.py', 'products/missing.jpg', 'products']:
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(reverse('media', kwargs={'path': path})).status_code, 404)
+
+    @override_settings(MEDIA_SENDFILE_BACKEND='x-accel-redirect', MEDIA_SENDFILE_MIN_SIZE=5)
+    def test_large_files_are_offloaded_to_the_proxy(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], settings.MEDIA_ACCEL_REDIRECT_PREFIX + 'products/dress.jpg')
+        self.assertEqual(response.content, b'')
+        self.assertNotIn('Content-Type', response)
+
+
+class PageCacheHoleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'pass')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'pass')
+        category = Category.objects.create(name='Test Dresses')
+        color = Color.objects.create(name='Test Lavender')
+        for index in range(2):
+            product = Product.objects.create(
+                name=f'Dress {index}', category=category, color=color, price=Decimal('250'),
+            )
+            CartItem.objects.create(user=cls.bob, product=product)
+
+    def setUp(self):
+        cache.clear()
+
+    def visit(self, user):
+        client = Client()
+        client.force_login(user)
+        return client.get(reverse('contact'))
+
+    def test_holes_are_rendered_for_each_visitor(self):
+        first = self.visit(self.alice)
+        second = self.visit(self.bob)
+
+        self.assertEqual((first['X-Page-Cache'], second['X-Page-Cache']), ('miss', 'hit'))
+        self.assertContains(first, 'value="alice@example.com"')
+        self.assertNotContains(first, 'llshop-cart-badge')
+        self.assertContains(second, 'value="bob@example.com"')
+        self.assertNotContains(second, 'alice@example.com')
+        self.assertContains(second, '<span class="llshop-cart-badge">2</span>', html=True)
+        self.assertNotContains(second, '<!--page-hole')
+
+        token = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+        self.assertNotEqual(token.search(first.content.decode()).group(1), token.search(second.content.decode()).group(1))
+
+    def test_stored_copy_keeps_only_markers(self):
+        html = (
+            '<p>Hi</p><!--page-hole:partials/cart_badge.html--><span>3</span><!--/page-hole-->'
+            '<input type="hidden" name="csrfmiddlewaretoken" value="secret">'
+        )
+        self.assertEqual(
+            page_cache.strip_holes(html), '<p>Hi</p><!--page-hole:partials/cart_badge.html--><!--page-csrf-->'
+        )
+
+    def test_saving_a_dependency_retires_the_page(self):
+        self.visit(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            SocialMedia.objects.create(platform='instagram', url='https://instagram.com/lavenderlily')
+        self.assertEqual(self.visit(self.alice)['X-Page-Cache'], 'miss')
+
+
+class CriticalStylesheetTagTests(SimpleTestCase):
+    def render(self, css_dir):
+        template = Template('{% load critical_css %}{% critical_stylesheet "css/style.css" %}', name='test/page.html')
+        with override_settings(CRITICAL_CSS_DIR=css_dir):
+            return template.render(Context())
+
+    def test_inlined_css_is_not_html_escaped(self):
+        with tempfile.TemporaryDirectory() as css_dir:
+            os.makedirs(os.path.join(css_dir, 'test'))
+            with open(os.path.join(css_dir, 'test', 'page.css'), 'w') as f:
+                f.write(".a>.b{content:\"x\";font-family:'Inter'}.c{content:\"</style>\"}")
+            html = self.render(css_dir)
+
+        self.assertIn('<style>.a>.b{content:"x";font-family:\'Inter\'}.c{content:"<\\/style>"}</style>', html)
+        self.assertIn('rel="preload"', html)
+
+    def test_plain_link_without_critical_css(self):
+        with tempfile.TemporaryDirectory() as css_dir:
+            self.assertNotIn('<style>', self.render(css_dir))
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        temporary_setting_dir(self, 'MEDIA_ROOT')
+
+    def save(self, name, content):
+        return default_storage.save(name, ContentFile(content))
+
+    def age(self, name, seconds):
+        past = time.time() - seconds
+        os.utime(default_storage.path(name), (past, past))
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.save('photo.JPG', b'same bytes')
+        self.age(first, 7200)
+        second = self.save('other-name.jpg', b'same bytes')
+
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith('blobs/') and first.endswith('.jpg'))
+        self.assertNotEqual(self.save('photo.jpg', b'other bytes'), first)
+        # The dedupe hit restarted the blob's grace period
+        self.assertGreater(os.path.getmtime(default_storage.path(first)), time.time() - 60)
+        self.assertEqual(os.listdir(default_storage.path('blobs/tmp')), [])
+
+    def test_gc_deletes_only_old_unreferenced_blobs(self):
+        orphan = self.save('orphan.jpg', b'orphan')
+        recent = self.save('recent.jpg', b'recent')
+        referenced = self.save('hero.jpg', b'hero')
+        reused = self.save('reused.jpg', b'reused')
+        for name in (orphan, referenced, reused):
+            self.age(name, 7200)
+        Homepage.objects.create(
+            hero_background=referenced, featured_image_1=referenced, featured_image_2=referenced,
+            featured_image_3=referenced,
+        )
+        # Uploaded again by a row that is not committed yet
+        self.save('reused-again.jpg', b'reused')
+
+        call_command('gc_media', grace=3600, stdout=io.StringIO())
+
+        self.assertFalse(default_storage.exists(orphan))
+        for name in (recent, referenced, reused):
+            self.assertTrue(default_storage.exists(name), name)
+
+
+    def test_adopt_retires_cached_pages_and_content(self):
+        os.makedirs(default_storage.path('legacy'))
+        with open(default_storage.path('legacy/hero.jpg'), 'wb') as f:
+            f.write(b'hero')
+        Homepage.objects.create(
+            hero_background='legacy/hero.jpg', featured_image_1='legacy/hero.jpg', featured_image_2='legacy/hero.jpg',
+            featured_image_3='legacy/hero.jpg',
+        )
+        tag_version = page_cache.get_tag_versions(['core.homepage'])
+        content_version = cache.get(content_cache.VERSION_KEY)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('gc_media', adopt=True, stdout=io.StringIO())
+
+        self.assertTrue(Homepage.objects.get().hero_background.name.startswith('blobs/'))
+        self.assertFalse(default_storage.exists('legacy/hero.jpg'))
+        self.assertNotEqual(page_cache.get_tag_versions(['core.homepage']), tag_version)
+        self.assertNotEqual(cache.get(content_cache.VERSION_KEY), content_version)
+
+class QuintileScoreTests(SimpleTestCase):
+    def test_distinct_values_spread_over_all_scores(self):
+        self.assertEqual(list(quintile_scores(list(range(10)))), [1, 1, 2, 2, 3, 3, 4, 4, 5, 5])
+        self.assertEqual(list(quintile_scores(list(range(10)), reverse=True)), [5, 5, 4, 4, 3, 3, 2, 2, 1, 1])
+
+    def test_tied_values_share_a_score(self):
+        # Order counts: 70% of customers bought once, 20% twice, 7% three times, 3% five times
+        frequency = [1] * 70 + [2] * 20 + [3] * 7 + [5] * 3
+        scores = dict(zip(frequency, quintile_scores(frequency)))
+        self.assertEqual(scores, {1: 1, 2: 4, 3: 5, 5: 5})
+        self.assertEqual(set(quintile_scores([4, 4, 4])), {1})
+
+        # A recent one-time buyer is new, not a champion
+        recency_days = [1] * 30 + [90] * 70
+        recency_score = quintile_scores(recency_days, reverse=True)[0]
+        self.assertEqual(segment_for(recency_score, scores[1], 1), 'new')
+        self.assertEqual(segment_for(recency_score, scores[2], 3), 'champions')
+
+
+# The request each URL name is exercised with: (method, URL args, POST data), built from the test fixtures
+VIEW_REQUESTS = {
+    'home': lambda t: ('get', [], None),
+    'about': lambda t: ('get', [], None),
+    'contact': lambda t: ('get', [], None),
+    'signin': lambda t: ('get', [], None),
+    'signup': lambda t: ('get', [], None),
+    'logout': lambda t: ('get', [], None),
+    'profile': lambda t: ('get', [], None),
+    'remove_address': lambda t: ('get', [t.address.pk], None),
+    'password_reset': lambda t: ('get', [], None),
+    'password_reset_done': lambda t: ('get', [], None),
+    'password_reset_confirm': lambda t: (
+        'get', [urlsafe_base64_encode(force_bytes(t.shopper.pk)), default_token_generator.make_token(t.shopper)], None,
+    ),
+    'password_reset_complete': lambda t: ('get', [], None),
+    'newsletter_subscribe': lambda t: ('post', [], {'email': 'new-reader@example.com'}),
+    'newsletter_unsubscribe': lambda t: ('get', [make_subscriber_token(t.subscriber.pk, t.newsletter.pk)], None),
+    'newsletter_open': lambda t: ('get', [make_subscriber_token(t.subscriber.pk, t.newsletter.pk)], None),
+    'newsletter_click': lambda t: ('get', [make_subscriber_token(t.subscriber.pk, t.newsletter.pk)], None),
+    'admin_dashboard': lambda t: ('get', [], None),
+    'dashboard_charts': lambda t: ('get', [], None),
+    'fragment_cache_stats': lambda t: ('get', [], None),
+    'metrics': lambda t: ('get', [], None),
+    'memory_report': lambda t: ('get', [], None),
+    'slow_query_report': lambda t: ('get', [], None),
+    'traces': lambda t: ('get', [], None),
+    'trace_detail': lambda t: ('get', ['0' * 32], None),
+    'request_profiles': lambda t: ('get', [], None),
+    'request_profile_detail': lambda t: ('get', ['0' * 32], None),
+    'request_profile_download': lambda t: ('get', ['0' * 32, 'collapsed'], None),
+    'manage_orders': lambda t: ('get', [], None),
+    'update_order_status': lambda t: ('post', [t.order.pk], {'status': 'shipped'}),
+    'manage_users': lambda t: ('get', [], None),
+    'update_user_status': lambda t: ('post', [t.other.pk], {'action': 'deactivate'}),
+    'manage_messages': lambda t: ('get', [], None),
+    'message_detail': lambda t: ('get', [t.message.pk], None),
+    'reply_to_message': lambda t: ('post', [t.message.pk], {'subject': 'Re: Hello', 'message': 'Thanks!'}),
+    'delete_message': lambda t: ('post', [t.message.pk], None),
+    'manage_homepage': lambda t: ('get', [], None),
+    'manage_contact_page': lambda t: ('get', [], None),
+    'manage_about_page': lambda t: ('get', [], None),
+    'manage_newsletters': lambda t: ('get', [], None),
+    'newsletter_content': lambda t: ('get', [t.newsletter.pk], None),
+    'manage_subscribers': lambda t: ('get', [], None),
+    'toggle_subscriber_status': lambda t: ('post', [t.subscriber.pk], None),
+    'import_subscribers_csv': lambda t: ('post', [], {
+        'csv_file': SimpleUploadedFile('subscribers.csv', b'email\nimported@example.com\n', content_type='text/csv'),
+    }),
+    'export_subscribers_csv': lambda t: ('get', [], None),
+    'social_media_list_create': lambda t: ('get', [], None),
+    'social_media_detail': lambda t: ('get', [t.social.pk], None),
+    'manage_products': lambda t: ('get', [], None),
+    'add_product': lambda t: ('get', [], None),
+    'edit_product': lambda t: ('get', [t.product.pk], None),
+    'delete_product': lambda t: ('post', [t.product.pk], None),
+    'manage_categories': lambda t: ('get', [], None),
+    'manage_colors': lambda t: ('get', [], None),
+    'shop': lambda t: ('get', [], None),
+    'product_detail': lambda t: ('get', [t.product.pk], None),
+    'toggle_wishlist': lambda t: ('post', [t.product.pk], None),
+    'size_chart': lambda t: ('get', [], None),
+    'cart': lambda t: ('get', [], None),
+    'add_to_cart': lambda t: ('post', [t.product.pk], {'quantity': 1}),
+    'update_cart': lambda t: ('post', [], {f'qty_{t.cart_item.pk}': 2}),
+    'remove_from_cart': lambda t: ('get', [t.cart_item.pk], None),
+    'checkout': lambda t: ('get', [], None),
+    'checkout_place_order': lambda t: ('post', [], {
+        'full_name': 'Shopper', 'phone': '0500000000', 'address': '1 Test Street', 'city': 'Dubai', 'state': 'Dubai',
+        'postal_code': '00000', 'country': 'United Arab Emirates', 'payment_method': 'COD',
+    }),
+    'payment_status': lambda t: ('get', ['success'], None),
+    'payment_callback': lambda t: ('post', [], {'order_number': t.order.order_number}),
+    'order_detail': lambda t: ('get', [t.order.pk], None),
+    'cancel_order': lambda t: ('post', [t.order.pk], {'reason': 'Changed my mind'}),
+    'return_order': lambda t: ('post', [t.delivered_order.pk], {'reason': 'Too small'}),
+}
+
+# Requests that exercise another code path of a URL already listed: {case: URL name}
+CASE_URL_NAMES = {
+    'checkout_place_order': 'checkout',
+}
+
+# Maximum queries per URL name as (shopper, staff). They must not depend on how many rows
+# the page lists: every request is also replayed after ViewQueryBudgetTests.grow().
+# Views with a runtime budget in settings.QUERY_BUDGETS are held to that instead, below.
+QUERY_BUDGETS = {
+    'signin': (6, 6),
+    'signup': (6, 6),
+    'logout': (4, 4),
+    'remove_address': (5, 3),
+    'password_reset': (5, 5),
+    'password_reset_done': (5, 5),
+    'password_reset_confirm': (5, 5),
+    'password_reset_complete': (5, 5),
+    'newsletter_subscribe': (6, 6),
+    'newsletter_unsubscribe': (6, 6),
+    'newsletter_open': (0, 0),
+    'newsletter_click': (0, 0),
+    'dashboard_charts': (2, 6),
+    'fragment_cache_stats': (2, 2),
+    'metrics': (1, 1),
+    'memory_report': (2, 5),
+    'slow_query_report': (2, 7),
+    'traces': (2, 5),
+    'trace_detail': (2, 2),
+    'request_profiles': (2, 5),
+    'request_profile_detail': (2, 2),
+    'request_profile_download': (2, 2),
+    'manage_orders': (2, 7),
+    'update_order_status': (2, 7),
+    'manage_users': (2, 7),
+    'update_user_status': (2, 3),
+    'manage_messages': (2, 7),
+    'message_detail': (2, 4),
+    'reply_to_message': (2, 5),
+    'delete_message': (2, 6),
+    'manage_homepage': (2, 8),
+    'manage_contact_page': (2, 7),
+    'manage_about_page': (2, 6),
+    'manage_newsletters': (2, 9),
+    'newsletter_content': (2, 3),
+    'manage_subscribers': (2, 7),
+    'toggle_subscriber_status': (2, 5),
+    'import_subscribers_csv': (2, 8),
+    'export_subscribers_csv': (2, 3),
+    'social_media_list_create': (2, 3),
+    'social_media_detail': (2, 3),
+    'manage_products': (2, 9),
+    'add_product': (2, 9),
+    'edit_product': (2, 13),
+    'delete_product': (2, 13),
+    'manage_categories': (2, 7),
+    'manage_colors': (2, 6),
+    'toggle_wishlist': (5, 7),
+    'add_to_cart': (5, 8),
+    'update_cart': (3, 3),
+    'remove_from_cart': (3, 3),
+    'payment_status': (5, 5),
+    'payment_callback': (7, 7),
+    'cancel_order': (8, 3),
+    'return_order': (7, 3),
+}
+QUERY_BUDGETS.update({
+    case: (settings.QUERY_BUDGETS[CASE_URL_NAMES.get(case, case)],) * 2
+    for case in VIEW_REQUESTS
+    if CASE_URL_NAMES.get(case, case) in settings.QUERY_BUDGETS
+})
+
+BUDGETED_URLCONFS = ('core.urls', 'store.urls', 'cart.urls', 'orders.urls')
+
+
+def url_names(urlconf):
+    return {pattern.name for pattern in get_resolver(urlconf).url_patterns if isinstance(pattern, URLPattern)}
+
+
+def describe_queries(queries):
+    """The repeated statements of a captured request, most frequent first"""
+    repeated = Counter(fingerprint(query['sql']) for query in queries)
+    lines = [f'  {count}x {sql}' for sql, count in repeated.most_common() if count > 1]
+    return '\n'.join(lines) or '  (no repeated statements)'
+
+
+@override_settings(
+    QUERY_INSTRUMENTATION_ENABLED=False,
+    TRACING_ENABLED=False,
+    SLOW_QUERY_LOG_ENABLED=False,
+    NEWSLETTER_TRACKING_FLUSH_SECONDS=10 ** 9,
+    NEWSLETTER_TRACKING_FLUSH_SIZE=10 ** 9,
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+)
+class ViewQueryBudgetTests(TestCase):
+    """
+    Every URL of the four apps runs within its query budget, as a shopper and
+    as staff, and issues the same number of queries after the data set has grown.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pass', is_staff=True)
+        cls.shopper = User.objects.create_user('shopper', 'shopper@example.com', 'pass')
+        cls.other = User.objects.create_user('other', 'other@example.com', 'pass')
+        cls.address = UserAddress.objects.create(
+            user=cls.shopper, full_name='Shopper', phone='0500000000', address_line='1 Test Street',
+            city='Dubai', state='Dubai', postal_code='00000', country='United Arab Emirates', is_default=True,
+        )
+
+        Homepage.objects.create(
+            hero_background='homepage/hero.jpg', featured_image_1='homepage/featured/1.jpg',
+            featured_image_2='homepage/featured/2.jpg', featured_image_3='homepage/featured/3.jpg',
+        )
+        AboutPage.objects.create(
+            hero_title='About', section_title='Story', section_text='Text', feature_title='Feature',
+            feature_text_1='One', feature_text_2='Two', feature_image='about/feature.jpg',
+            promise_title='Promise', promise_text='Text',
+        )
+        contact_page = ContactPage.objects.create(title='Contact', subtitle='Write to us')
+        ContactService.objects.create(page=contact_page, title='Orders', email='orders@example.com')
+        cls.social = SocialMedia.objects.create(platform='instagram', url='https://instagram.com/lavenderlily')
+
+        cls.sizes = [Size.objects.create(name=name, order=index) for index, name in enumerate(['S', 'M', 'L'])]
+        cls.category = Category.objects.create(name='Test Dresses')
+        cls.color = Color.objects.create(name='Test Lavender')
+        cls.product = cls.create_product('Linen Dress')
+        cls.create_product('Silk Dress')
+        Review.objects.create(product=cls.product, user=cls.shopper, name='Shopper', comment='Lovely')
+
+        cls.cart_item = CartItem.objects.create(user=cls.shopper, product=cls.product)
+        WishlistItem.objects.create(user=cls.shopper, product=cls.product)
+        cls.order = cls.create_order(cls.shopper, 'LL-1', 'processing')
+        cls.delivered_order = cls.create_order(cls.shopper, 'LL-2', 'delivered')
+
+        cls.message = ContactMessage.objects.create(name='Guest', email='guest@example.com', message='Hello')
+        cls.subscriber = NewsletterSubscriber.objects.create(email='reader@example.com')
+        cls.newsletter = Newsletter.objects.create(subject='Spring', content='New arrivals', html_content='<p>New</p>')
+        counters.reconcile()
+
+    @classmethod
+    def create_product(cls, name, category=None, color=None):
+        product = Product.objects.create(
+            name=name, category=category or cls.category, color=color or cls.color, price=Decimal('250'),
+            image_main='products/dress.jpg', image1='products/dress-1.jpg', variant_group='dress',
+        )
+        product.sizes.set(cls.sizes)
+        return product
+
+    @classmethod
+    def create_order(cls, user, number, status):
+        order = Order.objects.create(
+            user=user, order_number=number, total_amount=Decimal('250'), status=status, shipping_address=cls.address,
+        )
+        OrderItem.objects.create(order=order, product=cls.product, quantity=1, price=Decimal('250'))
+        return order
+
+    def grow(self):
+        """Add rows to everything a page may list, for the shopper and for staff"""
+        for index in range(12):
+            category = Category.objects.create(name=f'Test Category {index}')
+            color = Color.objects.create(name=f'Test Color {index}')
+            for variant in range(2):
+                product = self.create_product(f'Dress {index}-{variant}', category, color)
+                Review.objects.create(product=self.product, name=f'Reviewer {index}', comment='Nice')
+                CartItem.objects.create(user=self.shopper, product=product)
+                WishlistItem.objects.create(user=self.shopper, product=product)
+            order = self.create_order(self.shopper, f'LL-G{index}', 'processing')
+            OrderItem.objects.create(order=order, product=product, quantity=2, price=Decimal('100'))
+            OrderItem.objects.create(order=self.order, product=product, quantity=1, price=Decimal('100'))
+            customer = User.objects.create_user(f'customer{index}', f'customer{index}@example.com', 'pass')
+            self.create_order(customer, f'LL-C{index}', 'delivered')
+            UserAddress.objects.create(
+                user=self.shopper, full_name=f'Address {index}', phone='0500000000', address_line='Street',
+                city='Dubai', state='Dubai', postal_code='00000', country='United Arab Emirates',
+            )
+            ContactMessage.objects.create(name=f'Guest {index}', email=f'guest{index}@example.com', message='Hi')
+            NewsletterSubscriber.objects.create(email=f'reader{index}@example.com')
+            Newsletter.objects.create(subject=f'Issue {index}', content='News')
+        for platform, _ in SocialMedia.PLATFORM_CHOICES[1:]:
+            SocialMedia.objects.create(platform=platform, url=f'https://example.com/{platform}')
+        counters.reconcile()
+
+    def capture(self, user, name):
+        """Run the request for a URL name in a savepoint that is rolled back; returns (queries, response)"""
+        client = Client()
+        client.force_login(user)
+        # Built after logging in: a password reset token is tied to the user's last_login
+        method, args, data = VIEW_REQUESTS[name](self)
+        cache.clear()
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as context:
+                response = getattr(client, method)(reverse(CASE_URL_NAMES.get(name, name), args=args), data)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            transaction.set_rollback(True)
+        return context.captured_queries, response
+
+    def test_every_url_has_a_budget(self):
+        names = set().union(*(url_names(urlconf) for urlconf in BUDGETED_URLCONFS)) | {'checkout'}
+        self.assertEqual(names - set(QUERY_BUDGETS), set())
+
+    def check_budgets(self, user, role):
+        small = {name: self.capture(user, name) for name in VIEW_REQUESTS}
+        self.grow()
+        for name, (queries, response) in small.items():
+            budget = QUERY_BUDGETS[name][role]
+            grown, _ = self.capture(user, name)
+            with self.subTest(view=name):
+                self.assertLess(response.status_code, 500)
+                self.assertEqual(
+                    len(grown), len(queries),
+                    f'{name} ran {len(queries)} queries, then {len(grown)} with more rows:\n{describe_queries(grown)}',
+                )
+                self.assertLessEqual(
+                    len(queries), budget,
+                    f'{name} ran {len(queries)} queries, over its budget of {budget}:\n{describe_queries(queries)}',
+                )
+
+    def test_shopper_query_budgets(self):
+        self.check_budgets(self.shopper, 0)
+
+    def test_staff_query_budgets(self):
+        self.check_budgets(self.staff, 1)
@@ -0,0 +1,381 @@
+"""
+In-process request tracing.
+
+core.middleware.TracingMiddleware opens a root span per request; child
+spans are added for every SQL statement, every Template._render (so each
+render(), render_to_string() and {% include %}/{% extends %}), every cache
+operation and every batch handed to the mail backend (see
+core.email_backends). The current trace lives in a context variable, so work
+done in other threads (placeholder generation) is not part of it.
+
+Every request is recorded, since whether it is slow is only known at the
+end, but only kept when it was sampled (TRACING_SAMPLE_RATE) or took at
+least TRACING_SLOW_MS. Kept traces are exported from a background thread,
+either appended to TRACING_FILE as JSON lines or POSTed as OTLP/JSON to
+TRACING_OTLP_ENDPOINT (manage.py trace_collector is a stand-in collector
+that writes what it receives to TRACING_FILE). The staff traces page reads
+TRACING_FILE.
+"""
+import json
+import logging
+import os
+import random
+import secrets
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Template
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+JSONL = 'jsonl'
+OTLP = 'otlp'
+
+# Span kinds
+REQUEST = 'request'
+DB = 'db'
+TEMPLATE = 'template'
+CACHE = 'cache'
+SMTP = 'smtp'
+
+CACHE_OPERATIONS = ('get', 'set', 'add', 'delete', 'get_many', 'set_many', 'delete_many', 'incr', 'touch', 'clear')
+SQL_ATTRIBUTE_LENGTH = 1000
+
+_current = ContextVar('trace', default=None)
+_export_lock = threading.Lock()
+# One thread keeps JSONL appends in order and never delays a response
+_exporter = ThreadPoolExecutor(max_workers=1, thread_name_prefix='trace-export')
+
+
+class Trace:
+    def __init__(self, name):
+        self.trace_id = secrets.token_hex(16)
+        self.name = name
+        self.started_at = timezone.now()
+        self.started = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+        self._stack = []
+
+    @contextmanager
+    def span(self, kind, name, attributes=None):
+        if len(self.spans) >= settings.TRACING_MAX_SPANS:
+            self.dropped += 1
+            yield None
+            return
+        span = {
+            'span_id': secrets.token_hex(8),
+            'parent_id': self._stack[-1]['span_id'] if self._stack else None,
+            'kind': kind,
+            'name': name,
+            'start_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'duration_ms': None,
+            'attributes': attributes or {},
+        }
+        self.spans.append(span)
+        self._stack.append(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except Exception as exc:
+            span['attributes']['error'] = f'{type(exc).__name__}: {exc}'[:300]
+            raise
+        finally:
+            span['duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            self._stack.pop()
+
+    def duration_ms(self):
+        return self.spans[0]['duration_ms'] if self.spans else 0
+
+    def as_dict(self, reason):
+        root = self.spans[0]['attributes'] if self.spans else {}
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': self.duration_ms(),
+            'status': root.get('http.status_code'),
+            'view': root.get('view'),
+            'kept_because': reason,
+            'spans': self.spans,
+            'dropped_spans': self.dropped,
+        }
+
+
+def current_trace():
+    return _current.get()
+
+
+def span(kind, name, attributes=None):
+    """A child span of the current trace, or a no-op outside traced requests"""
+    trace = _current.get()
+    if trace is None:
+        return nullcontext()
+    return trace.span(kind, name, attributes)
+
+
+@contextmanager
+def trace_request(request):
+    """Trace the enclosed request handling; yields the Trace"""
+    trace = Trace(f'{request.method} {request.path}')
+    token = _current.set(trace)
+    try:
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(_trace_sql))
+            with trace.span(REQUEST, trace.name, {'http.method': request.method, 'http.path': request.path}):
+                yield trace
+    finally:
+        _current.reset(token)
+
+
+def keep_reason(trace, sampled):
+    """Why a finished trace is kept ('slow' or 'sampled'), or None to drop it"""
+    if trace.duration_ms() >= settings.TRACING_SLOW_MS:
+        return 'slow'
+    if sampled:
+        return 'sampled'
+    return None
+
+
+def should_sample():
+    return random.random() < settings.TRACING_SAMPLE_RATE
+
+
+# Instrumentation
+
+def _trace_sql(execute, sql, params, many, context):
+    trace = _current.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    attributes = {'db.system': context['connection'].vendor, 'db.statement': sql[:SQL_ATTRIBUTE_LENGTH]}
+    if many:
+        attributes['db.executemany'] = True
+    with trace.span(DB, sql.split(None, 1)[0].upper() if sql else 'SQL', attributes):
+        return execute(sql, params, many, context)
+
+
+def _traced_template_render(original):
+    def _render(self, context):
+        trace = _current.get()
+        if trace is None:
+            return original(self, context)
+        name = self.origin.template_name or self.origin.name or '<string>'
+        with trace.span(TEMPLATE, name):
+            return original(self, context)
+    _render.traced = True
+    return _render
+
+
+def _traced_cache_operation(original, operation):
+    def method(self, *args, **kwargs):
+        trace = _current.get()
+        if trace is None:
+            return original(self, *args, **kwargs)
+        attributes = {}
+        if args and isinstance(args[0], str):
+            attributes['cache.key'] = args[0][:200]
+        elif args and operation.endswith('_many'):
+            attributes['cache.keys'] = len(args[0])
+        with trace.span(CACHE, f'cache.{operation}', attributes) as cache_span:
+            result = original(self, *args, **kwargs)
+            if cache_span is not None and operation == 'get':
+                # Approximate: a cached None looks like a miss
+                cache_span['attributes']['cache.hit'] = result is not None
+            return result
+    method.traced = True
+    return method
+
+
+def install():
+    """Patch Template._render and the configured cache backends; called once from CoreConfig.ready"""
+    if not getattr(Template._render, 'traced', False):
+        Template._render = _traced_template_render(Template._render)
+    for config in settings.CACHES.values():
+        backend = import_string(config['BACKEND'])
+        for operation in CACHE_OPERATIONS:
+            original = getattr(backend, operation)
+            if not getattr(original, 'traced', False):
+                setattr(backend, operation, _traced_cache_operation(original, operation))
+
+
+# Export
+
+def export(record):
+    """Hand a kept trace to the exporter thread"""
+    _exporter.submit(_export, record)
+
+
+def _export(record):
+    try:
+        if settings.TRACING_EXPORTER == OTLP:
+            send_otlp([record])
+        else:
+            append_jsonl([record])
+    except Exception:
+        logger.exception('Could not export trace %s', record['trace_id'])
+
+
+def append_jsonl(records):
+    """Append trace records to TRACING_FILE, keeping one rotated copy once it reaches TRACING_FILE_MAX_BYTES"""
+    path = str(settings.TRACING_FILE)
+    with _export_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            if os.path.getsize(path) >= settings.TRACING_FILE_MAX_BYTES:
+                os.replace(path, path + '.1')
+        except FileNotFoundError:
+            pass
+        with open(path, 'a') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in records))
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _from_otlp_value(value):
+    if 'intValue' in value:
+        return int(value['intValue'])
+    return next(iter(value.values()))
+
+
+def to_otlp(records):
+    """OTLP/JSON ExportTraceServiceRequest for trace records"""
+    spans = []
+    for record in records:
+        started_ns = int(datetime.fromisoformat(record['started_at']).timestamp() * 1e9)
+        for item in record['spans']:
+            start = started_ns + int(item['start_ms'] * 1e6)
+            attributes = {**item['attributes'], 'lavenderlily.kind': item['kind']}
+            if item['parent_id'] is None:
+                attributes.update({'lavenderlily.kept_because': record['kept_because'],
+                                   'lavenderlily.dropped_spans': record['dropped_spans']})
+            spans.append({
+                'traceId': record['trace_id'],
+                'spanId': item['span_id'],
+                'parentSpanId': item['parent_id'] or '',
+                'name': item['name'],
+                # SERVER for the request, CLIENT for calls out of the process, INTERNAL for templates
+                'kind': 2 if item['kind'] == REQUEST else 1 if item['kind'] == TEMPLATE else 3,
+                'startTimeUnixNano': str(start),
+                'endTimeUnixNano': str(start + int((item['duration_ms'] or 0) * 1e6)),
+                'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items()],
+                'status': {'code': 2} if 'error' in item['attributes'] else {},
+            })
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': settings.TRACING_SERVICE_NAME}}]},
+        'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}],
+    }]}
+
+
+def from_otlp(payload):
+    """Trace records back from an OTLP/JSON request (the inverse of to_otlp, for trace_collector)"""
+    by_trace = {}
+    for resource_spans in payload.get('resourceSpans', ()):
+        for scope_spans in resource_spans.get('scopeSpans', ()):
+            for item in scope_spans.get('spans', ()):
+                by_trace.setdefault(item['traceId'], []).append(item)
+
+    records = []
+    for trace_id, items in by_trace.items():
+        items.sort(key=lambda item: int(item['startTimeUnixNano']))
+        started_ns = int(items[0]['startTimeUnixNano'])
+        spans, root = [], {}
+        for item in items:
+            attributes = {attr['key']: _from_otlp_value(attr['value']) for attr in item.get('attributes', ())}
+            kind = attributes.pop('lavenderlily.kind', REQUEST if not item.get('parentSpanId') else DB)
+            if not item.get('parentSpanId'):
+                root = attributes
+            spans.append({
+                'span_id': item['spanId'],
+                'parent_id': item.get('parentSpanId') or None,
+                'kind': kind,
+                'name': item['name'],
+                'start_ms': round((int(item['startTimeUnixNano']) - started_ns) / 1e6, 3),
+                'duration_ms': round((int(item['endTimeUnixNano']) - int(item['startTimeUnixNano'])) / 1e6, 3),
+                'attributes': attributes,
+            })
+        records.append({
+            'trace_id': trace_id,
+            'name': spans[0]['name'],
+            'started_at': datetime.fromtimestamp(started_ns / 1e9, tz=dt_timezone.utc).isoformat(),
+            'duration_ms': spans[0]['duration_ms'],
+            'status': root.get('http.status_code'),
+            'view': root.get('view'),
+            'kept_because': root.pop('lavenderlily.kept_because', None),
+            'spans': spans,
+            'dropped_spans': int(root.pop('lavenderlily.dropped_spans', 0)),
+        })
+    return records
+
+
+def send_otlp(records):
+    body = json.dumps(to_otlp(records)).encode()
+    request = urllib.request.Request(
+        settings.TRACING_OTLP_ENDPOINT, data=body, headers={'Content-Type': 'application/json'}, method='POST',
+    )
+    with urllib.request.urlopen(request, timeout=5) as response:
+        response.read()
+
+
+# Browsing
+
+def recent_traces(limit):
+    """The last `limit` traces in TRACING_FILE"""
+    try:
+        with open(settings.TRACING_FILE) as f:
+            lines = deque(f, maxlen=limit)
+    except FileNotFoundError:
+        return []
+    traces = []
+    for line in lines:
+        try:
+            traces.append(json.loads(line))
+        except ValueError:
+            # A line still being written by another process
+            continue
+    return traces
+
+
+def slowest_traces(limit, window):
+    return sorted(recent_traces(window), key=lambda trace: trace['duration_ms'] or 0, reverse=True)[:limit]
+
+
+def find_trace(trace_id, window):
+    for trace in recent_traces(window):
+        if trace['trace_id'] == trace_id:
+            return trace
+    return None
+
+
+def waterfall(trace):
+    """The trace's spans in start order with their depth and offsets as percentages of the request, for display"""
+    depth = {}
+    total = trace['duration_ms'] or 1
+    rows = []
+    for item in sorted(trace['spans'], key=lambda item: item['start_ms']):
+        depth[item['span_id']] = depth.get(item['parent_id'], -1) + 1
+        rows.append({
+            **item,
+            'depth': depth[item['span_id']],
+            'offset_pct': round(min(item['start_ms'] / total * 100, 100), 2),
+            'width_pct': round(max(min((item['duration_ms'] or 0) / total * 100, 100), 0.2), 2),
+        })
+    return rows
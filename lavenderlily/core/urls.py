@@ -2,6 +2,7 @@ from django.urls import path
 from . import views
 from django.contrib.auth import views as auth_views
 from store import views as store_views
+from orders import views as order_views
 
 
 urlpatterns = [
@@ -37,7 +38,20 @@ urlpatterns = [
     ), name='password_reset_complete'),
 
     path('newsletter/subscribe/', views.newsletter_subscribe, name='newsletter_subscribe'),
+    path('newsletter/unsubscribe/<str:token>/', views.newsletter_unsubscribe, name='newsletter_unsubscribe'),
+    path('newsletter/open/<str:token>/', views.newsletter_open, name='newsletter_open'),
+    path('newsletter/click/<str:token>/', views.newsletter_click, name='newsletter_click'),
     path('dashboard/', views.admin_dashboard, name='admin_dashboard'),
+    path('dashboard/charts/', order_views.dashboard_charts, name='dashboard_charts'),
+    path('dashboard/fragment-cache/', views.fragment_cache_stats, name='fragment_cache_stats'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
+    path('dashboard/memory/', views.memory_report, name='memory_report'),
+    path('dashboard/queries/', views.slow_query_report, name='slow_query_report'),
+    path('dashboard/traces/', views.traces, name='traces'),
+    path('dashboard/traces/<str:trace_id>/', views.trace_detail, name='trace_detail'),
+    path('dashboard/profiles/', views.request_profiles, name='request_profiles'),
+    path('dashboard/profiles/<str:profile_id>/', views.request_profile_detail, name='request_profile_detail'),
+    path('dashboard/profiles/<str:profile_id>/<str:kind>/', views.request_profile_download, name='request_profile_download'),
 
     # Management URLs under dashboard
     path('dashboard/manage/orders/', views.manage_orders, name='manage_orders'),
@@ -55,6 +69,8 @@ urlpatterns = [
     path('dashboard/manage/newsletters/<int:pk>/content/', views.newsletter_content, name='newsletter_content'),
     path('dashboard/manage/subscribers/', views.manage_subscribers, name='manage_subscribers'),
     path('dashboard/manage/subscribers/<int:pk>/toggle/', views.toggle_subscriber_status, name='toggle_subscriber_status'),
+    path('dashboard/manage/subscribers/import/', views.import_subscribers_csv, name='import_subscribers_csv'),
+    path('dashboard/manage/subscribers/export/', views.export_subscribers_csv, name='export_subscribers_csv'),
 
     # Social Media Management API
     path('api/socialmedia/', views.social_media_list_create, name='social_media_list_create'),
@@ -1,47 +1,102 @@
-from django.core.mail import send_mail, EmailMessage
+from django.contrib.auth.models import User
+from django.core.mail import send_mail, EmailMessage, get_connection
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
 from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
 from .models import NewsletterSubscriber, Newsletter
+from .counters import SUBSCRIBERS_ACTIVE, SUBSCRIBERS_TOTAL, update_counters
+from .newsletter_render import compile_newsletter
+from .segments import newsletter_recipients
+import csv
 import logging
+import time
+from smtplib import SMTPServerDisconnected
 
 logger = logging.getLogger(__name__)
 
+# Rows are written/read in chunks so memory stays flat for very large lists
+SUBSCRIBER_CHUNK_SIZE = 2000
+SUBSCRIBER_CSV_HEADER = ['email', 'is_active', 'subscribed_at', 'unsubscribed_at']
+
 def send_newsletter_to_all(newsletter):
     """
-    Send newsletter to all active subscribers
+    Send newsletter to all active subscribers (or only its target segment)
+    Each copy is personalised from the pre-compiled newsletter body
     Returns the number of emails sent successfully
     """
-    subscribers = NewsletterSubscriber.objects.filter(is_active=True)
+    subscribers = newsletter_recipients(newsletter)
+    compiled = compile_newsletter(newsletter)
     sent_count = 0
 
-    for subscriber in subscribers:
-        try:
-            # Create email message
-            email = EmailMessage(
-                subject=newsletter.subject,
-                body=newsletter.html_content if newsletter.html_content else newsletter.content,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                to=[subscriber.email],
-            )
+    connection = get_connection()
+    # Messages sent on the open connection; None until one is open
+    sent_on_connection = None
+    try:
+        rows = subscribers.order_by('pk').values_list('pk', 'email').iterator(chunk_size=SUBSCRIBER_CHUNK_SIZE)
+        for chunk in _chunked(rows, SUBSCRIBER_CHUNK_SIZE):
+            names = {}
+            if 'name' in compiled.body.fields or 'name' in compiled.subject.fields:
+                names = dict(
+                    User.objects.filter(email__in=[email for _, email in chunk])
+                    .exclude(first_name='')
+                    .values_list('email', 'first_name')
+                )
 
-            # If HTML content exists, set it as HTML alternative
-            if newsletter.html_content:
-                email.content_subtype = "html"
-                email.body = newsletter.html_content
-            else:
-                # Plain text fallback
-                email.body = newsletter.content
+            for subscriber_id, subscriber_email in chunk:
+                try:
+                    values = compiled.merge_values(
+                        subscriber_id, subscriber_email, names.get(subscriber_email, ''), newsletter.pk or 0
+                    )
+                    subject, body = compiled.render(values)
 
-            # Send the email
-            email.send(fail_silently=False)
-            sent_count += 1
+                    email = EmailMessage(
+                        subject=subject,
+                        body=body,
+                        from_email=settings.DEFAULT_FROM_EMAIL,
+                        to=[subscriber_email],
+                        headers={
+                            'List-Unsubscribe': f"<{values['unsubscribe_url']}>",
+                            'List-Unsubscribe-Post': 'List-Unsubscribe=One-Click',
+                        },
+                        connection=connection,
+                    )
 
-        except Exception as e:
-            logger.error(f"Failed to send newsletter to {subscriber.email}: {e}")
-            continue
+                    # HTML newsletters are sent as text/html, otherwise plain text
+                    if compiled.is_html:
+                        email.content_subtype = "html"
+
+                    # Servers cap the messages per connection, so start a fresh one in good time
+                    if sent_on_connection is None or sent_on_connection >= settings.NEWSLETTER_MESSAGES_PER_CONNECTION:
+                        sent_on_connection = None
+                        _reconnect(connection)
+                        sent_on_connection = 0
+                    try:
+                        email.send(fail_silently=False)
+                    except SMTPServerDisconnected:
+                        # Dropped by the server (idle timeout, message limit): reconnect and retry once
+                        sent_on_connection = None
+                        _reconnect(connection)
+                        sent_on_connection = 0
+                        email.send(fail_silently=False)
+                    sent_on_connection += 1
+                    sent_count += 1
+
+                except Exception as e:
+                    logger.error(f"Failed to send newsletter to {subscriber_email}: {e}")
+                    continue
+    finally:
+        connection.close()
 
     return sent_count
 
 
+def _reconnect(connection):
+    connection.close()
+    connection.open()
+
+
 def send_newsletter_email(email, email_type):
     """Send newsletter-related emails"""
     subject_templates = {
@@ -91,4 +146,121 @@ def send_newsletter_email(email, email_type):
                 fail_silently=False,
             )
         except Exception as e:
-            logger.error(f"Failed to send {email_type} email to {email}: {e}")
\ No newline at end of file
+            logger.error(f"Failed to send {email_type} email to {email}: {e}")
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_csv_emails(rows, stats):
+    """
+    Yield normalised email addresses from CSV rows.
+    Accepts files with an 'email' header column or a bare first column.
+    """
+    email_index = 0
+    for line_number, row in enumerate(rows):
+        if not row:
+            continue
+        if line_number == 0:
+            header = [column.strip().lower() for column in row]
+            if 'email' in header:
+                email_index = header.index('email')
+                continue
+
+        stats['processed'] += 1
+        email = row[email_index].strip().lower() if len(row) > email_index else ''
+        try:
+            validate_email(email)
+        except ValidationError:
+            stats['invalid'] += 1
+            continue
+        yield email
+
+
+def import_subscribers(rows, chunk_size=SUBSCRIBER_CHUNK_SIZE, reactivate=False, stats=None):
+    """
+    Bulk import newsletter subscribers from CSV rows.
+    New emails are inserted with chunked bulk_create; existing inactive ones are
+    reactivated with a single UPDATE per chunk when reactivate is True.
+    Emails are matched case-insensitively (through the Lower(email) index), since
+    the subscribe form stores them as typed.
+    Each chunk is committed on its own, so a long import never holds one huge
+    transaction open; pass a stats dict to see how far an import that raised got.
+    Returns the stats dict including rows per second.
+    """
+    stats = stats if stats is not None else {}
+    for key in ('processed', 'invalid', 'created', 'reactivated', 'existing'):
+        stats.setdefault(key, 0)
+    started = time.monotonic()
+
+    for chunk in _chunked(iter_csv_emails(rows, stats), chunk_size):
+        emails = list(dict.fromkeys(chunk))
+        created, reactivated, existing = _import_chunk(emails, reactivate)
+        stats['created'] += created
+        stats['reactivated'] += reactivated
+        stats['existing'] += existing
+
+    stats['seconds'] = time.monotonic() - started
+    stats['rows_per_second'] = stats['processed'] / stats['seconds'] if stats['seconds'] else 0
+    return stats
+
+
+def _import_chunk(emails, reactivate, attempts=3):
+    """Insert/reactivate one chunk in its own transaction; returns (created, reactivated, existing)"""
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                # {lowercased email: email as stored}
+                existing = dict(
+                    NewsletterSubscriber.objects.annotate(email_lower=Lower('email'))
+                    .filter(email_lower__in=emails).values_list('email_lower', 'email')
+                )
+                new_subscribers = [NewsletterSubscriber(email=email) for email in emails if email not in existing]
+                # No ignore_conflicts: every row counted as created really is
+                NewsletterSubscriber.objects.bulk_create(new_subscribers)
+
+                reactivated = 0
+                if reactivate and existing:
+                    reactivated = NewsletterSubscriber.objects.filter(
+                        email__in=existing.values(), is_active=False
+                    ).update(is_active=True, unsubscribed_at=None)
+
+                # bulk_create() and update() send no signals, so adjust the counters here
+                update_counters({
+                    SUBSCRIBERS_TOTAL: len(new_subscribers),
+                    SUBSCRIBERS_ACTIVE: len(new_subscribers) + reactivated,
+                })
+                return len(new_subscribers), reactivated, len(existing)
+        except IntegrityError:
+            # Someone subscribed one of these emails meanwhile; look the chunk up again
+            if attempt == attempts - 1:
+                raise
+
+
+class _EchoBuffer:
+    """File-like object that hands back what csv.writer writes to it"""
+    def write(self, value):
+        return value
+
+
+def iter_subscribers_csv(queryset, chunk_size=SUBSCRIBER_CHUNK_SIZE):
+    """Yield CSV lines for a subscriber queryset without loading it into memory"""
+    writer = csv.writer(_EchoBuffer())
+    yield writer.writerow(SUBSCRIBER_CSV_HEADER)
+
+    rows = queryset.order_by('pk').values_list(*SUBSCRIBER_CSV_HEADER).iterator(chunk_size=chunk_size)
+    for email, is_active, subscribed_at, unsubscribed_at in rows:
+        yield writer.writerow([
+            email,
+            int(is_active),
+            subscribed_at.isoformat() if subscribed_at else '',
+            unsubscribed_at.isoformat() if unsubscribed_at else '',
+        ])
@@ -3,50 +3,55 @@ from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.core.paginator import Paginator
-from django.db.models import Q
-from django.views.decorators.http import require_POST
+from django.db.models import Count, Q, Sum
+from django.views.decorators.http import require_http_methods, require_POST, require_safe
+import csv
+import io
 import json
-from .models import AboutPage, ContactPage, ContactService, ContactMessage, UserAddress, Homepage, NewsletterSubscriber, Newsletter, SocialMedia
+from .models import AboutPage, ContactPage, ContactService, ContactMessage, UserAddress, Homepage, NewsletterSubscriber, Newsletter, SocialMedia, CustomerSegment, NewsletterDailyStat, QueryFingerprint
 from django.core.mail import send_mail
 from django.conf import settings
 from orders.models import Order
-from store.models import Product, Category, Color
+from store.models import Product, Category
 from cart.models import WishlistItem
 from django.utils import timezone
-from dateutil.relativedelta import relativedelta
-from .utils import send_newsletter_email
+from .utils import send_newsletter_email, import_subscribers, iter_subscribers_csv
+from .newsletter_render import read_subscriber_token, verify_value
+from .stats import get_dashboard_stats
+from .media import serve_media
+from . import content_cache, fragment_cache, memory, metrics, profiling, slow_queries, tracing
+from . import counters
+from .counters import CountedPaginator
+from . import newsletter_tracking
+from urllib.parse import urlsplit
 from django.views.decorators.csrf import csrf_exempt
 
 
 def home(request):
     # Get featured products for homepage carousel
     # Show latest 6 products as "New Arrivals"
-    products = Product.objects.all().order_by('-created_at')[:6]
+    products = Product.objects.select_related('category').order_by('-created_at')[:6]
 
     # Get all categories for the shop by category section
     categories = Category.objects.all().order_by('name')
 
-    # Get homepage content
-    homepage = Homepage.objects.first()
-
-    # Get active social media links
-    social_media_links = SocialMedia.objects.filter(is_active=True).order_by('display_order')
+    # Get homepage content (social media links come from the context processor)
+    homepage = content_cache.get_homepage()
 
     return render(request, 'core/index.html', {
         'products': products,
         'categories': categories,
         'homepage': homepage,
-        'social_media_links': social_media_links
     })
 
 def about(request):
-    about = AboutPage.objects.first()
+    about = content_cache.get_about_page()
     return render(request, "core/about.html", {"about": about})
 
 def contact(request):
-    contact_page = ContactPage.objects.first()
+    contact_page = content_cache.get_contact_page()
 
     if request.method == "POST":
         name = request.POST.get("name")
@@ -151,7 +156,7 @@ def signup_page(request):
             messages.error(request, f"Error creating account: {str(e)}")
             return redirect("signup")
 
-    return render(request, "core/auth.html", {"mode": "signup", "homepage": Homepage.objects.first()})
+    return render(request, "core/auth.html", {"mode": "signup", "homepage": content_cache.get_homepage()})
 
 
 def signin_page(request):
@@ -181,7 +186,7 @@ def signin_page(request):
         messages.success(request, "Logged in successfully!")
         return redirect("profile")
 
-    return render(request, "core/auth.html", {"mode": "signin", "homepage": Homepage.objects.first()})
+    return render(request, "core/auth.html", {"mode": "signin", "homepage": content_cache.get_homepage()})
 
 
 def forgot_password_view(request):
@@ -230,7 +235,7 @@ def profile(request):
         messages.success(request, "Profile updated successfully!")
 
     addresses = user.addresses.all()
-    orders = Order.objects.filter(user=user).order_by("-created_at")
+    orders = Order.objects.filter(user=user).annotate(item_count=Count("items")).order_by("-created_at")
 
     wishlist_products = Product.objects.filter(wishlistitem__user=user)
 
@@ -299,6 +304,68 @@ def newsletter_subscribe(request):
     return redirect("home")
 
 
+# Mail providers send the RFC 8058 one-click POST without a CSRF token; the signed token authorises it
+@csrf_exempt
+@require_http_methods(["GET", "HEAD", "POST"])
+def newsletter_unsubscribe(request, token):
+    """
+    Unsubscribe link in newsletter emails. GET only shows a confirmation page, so
+    link scanners and prefetchers cannot unsubscribe anyone; the change is made on
+    POST, from that page or from the List-Unsubscribe-Post one-click header.
+    """
+    parsed = read_subscriber_token(token)
+    subscriber = NewsletterSubscriber.objects.filter(pk=parsed[0]).first() if parsed is not None else None
+    if subscriber is None:
+        messages.error(request, "This unsubscribe link is invalid.")
+        return redirect("home")
+
+    if request.method != "POST":
+        return render(request, "core/newsletter_unsubscribe.html", {"subscriber": subscriber})
+
+    unsubscribed = NewsletterSubscriber.objects.filter(pk=subscriber.pk, is_active=True).update(
+        is_active=False, unsubscribed_at=timezone.now()
+    )
+    # Queryset updates bypass the counter signals
+    counters.update_counters({counters.SUBSCRIBERS_ACTIVE: -unsubscribed})
+    if request.POST.get("List-Unsubscribe") == "One-Click":
+        return HttpResponse("Unsubscribed", content_type="text/plain")
+    messages.success(request, "You have been unsubscribed from the Lavender Lily newsletter.")
+    return redirect("home")
+
+
+# 1x1 transparent GIF served by the open-tracking pixel
+TRACKING_PIXEL_GIF = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00'
+    b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+
+
+def newsletter_open(request, token):
+    """Open-tracking pixel embedded in HTML newsletters"""
+    parsed = read_subscriber_token(token)
+    if parsed is not None and parsed[1]:
+        subscriber_id, newsletter_id = parsed
+        newsletter_tracking.record_hit(newsletter_id, subscriber_id, newsletter_tracking.OPEN)
+
+    response = HttpResponse(TRACKING_PIXEL_GIF, content_type='image/gif')
+    response['Cache-Control'] = 'no-store, max-age=0'
+    return response
+
+
+def newsletter_click(request, token):
+    """Count a newsletter link click and redirect to its signed target URL"""
+    url = request.GET.get('u', '')
+    if urlsplit(url).scheme not in ('http', 'https') or not verify_value(url, request.GET.get('s')):
+        return redirect('home')
+
+    parsed = read_subscriber_token(token)
+    if parsed is not None and parsed[1]:
+        subscriber_id, newsletter_id = parsed
+        newsletter_tracking.record_hit(newsletter_id, subscriber_id, newsletter_tracking.CLICK)
+
+    return redirect(url)
+
+
 @login_required(login_url='signin')
 def newsletter_management(request):
     """Admin view for managing newsletters"""
@@ -307,8 +374,7 @@ def newsletter_management(request):
         return redirect("home")
 
     newsletters = Newsletter.objects.all().order_by('-created_at')
-    subscribers = NewsletterSubscriber.objects.filter(is_active=True)
-    subscriber_count = subscribers.count()
+    subscriber_count = counters.get_counter(counters.SUBSCRIBERS_ACTIVE)
 
     if request.method == "POST":
         if 'create_newsletter' in request.POST:
@@ -358,79 +424,124 @@ def admin_dashboard(request):
         messages.error(request, "You don't have permission to access this page.")
         return redirect("home")
 
-    # Product statistics
-    total_products = Product.objects.count()
-    total_categories = Category.objects.count()
-    total_colors = Color.objects.count()
+    # Counters come from one aggregate query per table, served from the cache
+    context = dict(get_dashboard_stats())
 
-    # Calculate product growth percentage
-    now = timezone.now()
-    this_month = now.replace(day=1)
-    last_month = this_month - relativedelta(months=1)
-    last_last_month = last_month - relativedelta(months=1)
+    # Recent activity
+    context['recent_orders'] = Order.objects.select_related('user').order_by('-created_at')[:10]
+    context['recent_messages'] = ContactMessage.objects.order_by('-created_at')[:5]
 
-    products_this_month = Product.objects.filter(created_at__gte=this_month).count()
-    products_last_month = Product.objects.filter(created_at__gte=last_month, created_at__lt=this_month).count()
+    return render(request, "admin/admin_dashboard.html", context)
 
-    if products_last_month > 0:
-        product_growth_percentage = ((products_this_month - products_last_month) / products_last_month) * 100
-    else:
-        product_growth_percentage = 0 if products_this_month == 0 else 100
 
-    # Order statistics
-    total_orders = Order.objects.count()
-    pending_orders = Order.objects.filter(status='processing').count()
-    shipped_orders = Order.objects.filter(status='shipped').count()
-    delivered_orders = Order.objects.filter(status='delivered').count()
-    cancelled_orders = Order.objects.filter(status='cancelled').count()
+@login_required(login_url='signin')
+@user_passes_test(lambda u: u.is_staff)
+def fragment_cache_stats(request):
+    """Hit/miss counts for every {% cachedfragment %} block"""
+    return JsonResponse({'fragments': fragment_cache.fragment_stats()})
+
 
-    # Recent orders
-    recent_orders = Order.objects.select_related('user').order_by('-created_at')[:10]
+@require_safe
+def prometheus_metrics(request):
+    """Prometheus scrape target; see core.metrics"""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if not metrics.scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-    # Newsletter statistics
-    total_subscribers = NewsletterSubscriber.objects.filter(is_active=True).count()
-    total_newsletters = Newsletter.objects.count()
-    sent_newsletters = Newsletter.objects.filter(status='sent').count()
 
-    # Contact messages
-    unread_messages = ContactMessage.objects.filter(is_replied=False).count()
-    recent_messages = ContactMessage.objects.order_by('-created_at')[:5]
+@login_required(login_url='signin')
+@user_passes_test(lambda u: u.is_staff)
+def memory_report(request):
+    """Allocation and RSS figures by view for the worker that serves this request"""
+    return render(request, 'admin/memory.html', {'memory': memory.report()})
 
-    # User statistics
-    from django.contrib.auth.models import User
-    total_users = User.objects.count()
-    active_users = User.objects.filter(is_active=True).count()
-    staff_users = User.objects.filter(is_staff=True).count()
 
+@login_required(login_url='signin')
+@user_passes_test(lambda u: u.is_staff)
+def slow_query_report(request):
+    """SQL fingerprints with the most total time, from every process's slow-query log"""
+    if settings.SLOW_QUERY_LOG_ENABLED:
+        # This process's latest statements would otherwise wait for its next flush
+        slow_queries.flush()
+    view = request.GET.get('view', '')
+    views = QueryFingerprint.objects.order_by('view').values_list('view', flat=True).distinct()
     context = {
-        'total_products': total_products,
-        'total_categories': total_categories,
-        'total_colors': total_colors,
-        'product_growth_percentage': product_growth_percentage,
-        'total_orders': total_orders,
-        'pending_orders': pending_orders,
-        'shipped_orders': shipped_orders,
-        'delivered_orders': delivered_orders,
-        'cancelled_orders': cancelled_orders,
-        'recent_orders': recent_orders,
-        'total_subscribers': total_subscribers,
-        'total_newsletters': total_newsletters,
-        'sent_newsletters': sent_newsletters,
-        'unread_messages': unread_messages,
-        'recent_messages': recent_messages,
-        'total_users': total_users,
-        'active_users': active_users,
-        'staff_users': staff_users,
+        'fingerprints': slow_queries.top_fingerprints(50, view or None),
+        'views': [name for name in views if name],
+        'selected_view': view,
     }
+    return render(request, 'admin/slow_queries.html', context)
 
-    return render(request, "admin/admin_dashboard.html", context)
+
+@login_required(login_url='signin')
+@user_passes_test(lambda u: u.is_staff)
+def traces(request):
+    """The slowest of the recent traces kept by core.tracing"""
+    context = {
+        'traces': tracing.slowest_traces(50, settings.TRACING_BROWSE_WINDOW),
+        'window': settings.TRACING_BROWSE_WINDOW,
+    }
+    return render(request, 'admin/traces.html', context)
+
+
+@login_required(login_url='signin')
+@user_passes_test(lambda u: u.is_staff)
+def trace_detail(request, trace_id):
+    trace = tracing.find_trace(trace_id, settings.TRACING_BROWSE_WINDOW)
+    if trace is None:
+        raise Http404('Trace not found')
+    return render(request, 'admin/trace_detail.html', {'trace': trace, 'spans': tracing.waterfall(trace)})
+
+
+@login_required(login_url='signin')
+@user_passes_test(lambda u: u.is_staff)
+def request_profiles(request):
+    """Stored ?_profile reports, and the comparison of two of them"""
+    profiles = profiling.list_profiles()
+    comparison = before = after = None
+    if request.GET.get('a') and request.GET.get('b'):
+        before, after = profiling.load(request.GET['a']), profiling.load(request.GET['b'])
+        if before is None or after is None:
+            messages.error(request, 'Profile not found.')
+        else:
+            comparison = profiling.compare(before, after)
+
+    context = {
+        'profiles': profiles,
+        'comparison': comparison,
+        'before': before,
+        'after': after,
+        'profile_param': settings.REQUEST_PROFILER_PARAM,
+    }
+    return render(request, 'admin/request_profiles.html', context)
+
+
+@login_required(login_url='signin')
+@user_passes_test(lambda u: u.is_staff)
+def request_profile_detail(request, profile_id):
+    profile = profiling.load(profile_id)
+    if profile is None:
+        raise Http404('Profile not found')
+    return render(request, 'admin/request_profile.html', {'profile': profile})
+
+
+@login_required(login_url='signin')
+@user_passes_test(lambda u: u.is_staff)
+def request_profile_download(request, profile_id, kind):
+    """The collapsed stacks (for flamegraph tools) or the pstats dump of a stored profile"""
+    path = profiling.download_path(profile_id, kind)
+    if path is None:
+        raise Http404('Profile file not found')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}{profiling.DOWNLOADS[kind]}')
 
 
 @login_required(login_url='signin')
 @user_passes_test(lambda u: u.is_staff)
 def manage_orders(request):
     """Custom order management page"""
-    orders = Order.objects.all().order_by('-created_at')
+    orders = Order.objects.select_related('user').order_by('-created_at')
 
     # Search functionality
     q = request.GET.get('q')
@@ -442,8 +553,14 @@ def manage_orders(request):
     if status:
         orders = orders.filter(status=status)
 
-    # Pagination
-    paginator = Paginator(orders, 20)
+    # Pagination; unsearched listings take their total from the site counters
+    counter = None
+    if not q:
+        if not status:
+            counter = counters.ORDERS_TOTAL
+        elif status in dict(Order.STATUS_CHOICES):
+            counter = counters.order_status_key(status)
+    paginator = CountedPaginator(orders, 20, counter=counter)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
 
@@ -511,8 +628,15 @@ def manage_users(request):
     if is_staff is not None:
         users = users.filter(is_staff=is_staff == '1')
 
-    # Pagination
-    paginator = Paginator(users, 20)
+    # Pagination; unsearched listings take their total from the site counters
+    counter = None
+    if not q:
+        counter = {
+            (None, None): counters.USERS_TOTAL,
+            ('1', None): counters.USERS_ACTIVE,
+            (None, '1'): counters.USERS_STAFF,
+        }.get((is_active, is_staff))
+    paginator = CountedPaginator(users, 20, counter=counter)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
 
@@ -576,8 +700,11 @@ def manage_messages(request):
     if q:
         messages_obj = messages_obj.filter(Q(name__icontains=q) | Q(email__icontains=q) | Q(message__icontains=q))
 
-    # Pagination
-    paginator = Paginator(messages_obj, 20)
+    # Pagination; unsearched listings take their total from the site counters
+    counter = None
+    if not q:
+        counter = {None: counters.MESSAGES_TOTAL, '0': counters.MESSAGES_UNREPLIED}.get(replied)
+    paginator = CountedPaginator(messages_obj, 20, counter=counter)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
 
@@ -842,6 +969,9 @@ def manage_newsletters(request):
             subject = request.POST.get('subject')
             content = request.POST.get('content')
             action = request.POST.get('action', 'draft')
+            target_segment = request.POST.get('target_segment', '')
+            if target_segment not in dict(CustomerSegment.SEGMENT_CHOICES):
+                target_segment = ''
             
             if subject and content:
                 status = 'draft'
@@ -863,7 +993,8 @@ def manage_newsletters(request):
                     subject=subject,
                     content=content,
                     status=status,
-                    scheduled_at=scheduled_at
+                    scheduled_at=scheduled_at,
+                    target_segment=target_segment
                 )
                 
                 if action == 'send':
@@ -947,8 +1078,22 @@ def manage_newsletters(request):
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
 
+    # Open/click rates from the aggregated daily counters
+    tracked = {
+        row['newsletter_id']: row
+        for row in NewsletterDailyStat.objects.filter(newsletter__in=[n.pk for n in page_obj])
+        .values('newsletter_id')
+        .annotate(opens=Sum('unique_opens'), clicks=Sum('unique_clicks'))
+    }
+    for newsletter in page_obj:
+        stats = tracked.get(newsletter.pk, {})
+        newsletter.opens = stats.get('opens') or 0
+        newsletter.clicks = stats.get('clicks') or 0
+        newsletter.open_rate = newsletter.opens * 100 / newsletter.sent_count if newsletter.sent_count else 0
+        newsletter.click_rate = newsletter.clicks * 100 / newsletter.sent_count if newsletter.sent_count else 0
+
     # Get subscriber count
-    subscriber_count = NewsletterSubscriber.objects.filter(is_active=True).count()
+    subscriber_count = counters.get_counter(counters.SUBSCRIBERS_ACTIVE)
 
     context = {
         'newsletters': page_obj,
@@ -956,6 +1101,7 @@ def manage_newsletters(request):
         'paginator': paginator,
         'query_params': request.GET.copy(),
         'status_choices': Newsletter.STATUS_CHOICES,
+        'segment_choices': CustomerSegment.SEGMENT_CHOICES,
         'subscriber_count': subscriber_count,
         'edit_newsletter': edit_newsletter,
     }
@@ -994,8 +1140,11 @@ def manage_subscribers(request):
     if q:
         subscribers = subscribers.filter(email__icontains=q)
 
-    # Pagination
-    paginator = Paginator(subscribers, 20)
+    # Pagination; unsearched listings take their total from the site counters
+    counter = None
+    if not q:
+        counter = {None: counters.SUBSCRIBERS_TOTAL, '1': counters.SUBSCRIBERS_ACTIVE}.get(is_active)
+    paginator = CountedPaginator(subscribers, 20, counter=counter)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
 
@@ -1023,6 +1172,52 @@ def toggle_subscriber_status(request, pk):
     return redirect('manage_subscribers')
 
 
+@login_required(login_url='signin')
+@user_passes_test(lambda u: u.is_staff)
+@require_POST
+def import_subscribers_csv(request):
+    """Bulk import subscribers from an uploaded CSV file"""
+    csv_file = request.FILES.get('csv_file')
+    if not csv_file:
+        messages.error(request, 'Please choose a CSV file to import.')
+        return redirect('manage_subscribers')
+
+    rows = csv.reader(io.TextIOWrapper(csv_file.file, encoding='utf-8-sig', newline=''))
+    stats = {}
+    try:
+        import_subscribers(rows, reactivate=request.POST.get('reactivate') == '1', stats=stats)
+    except (UnicodeDecodeError, csv.Error) as e:
+        messages.error(
+            request,
+            f"Could not read CSV file: {str(e)}. The chunks before the error were imported: "
+            f"{stats['created']} new, {stats['reactivated']} reactivated."
+        )
+        return redirect('manage_subscribers')
+
+    messages.success(
+        request,
+        f"Imported {stats['processed']} rows in {stats['seconds']:.1f}s "
+        f"({stats['rows_per_second']:.0f} rows/sec): {stats['created']} new, "
+        f"{stats['reactivated']} reactivated, {stats['invalid']} invalid."
+    )
+    return redirect('manage_subscribers')
+
+
+@login_required(login_url='signin')
+@user_passes_test(lambda u: u.is_staff)
+def export_subscribers_csv(request):
+    """Stream all subscribers as a CSV download"""
+    subscribers = NewsletterSubscriber.objects.all()
+
+    is_active = request.GET.get('is_active')
+    if is_active is not None:
+        subscribers = subscribers.filter(is_active=is_active == '1')
+
+    response = StreamingHttpResponse(iter_subscribers_csv(subscribers), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="subscribers.csv"'
+    return response
+
+
 # Social Media API Views
 @csrf_exempt
 def social_media_list_create(request):
@@ -1112,3 +1307,9 @@ def social_media_detail(request, pk):
         })
 
     return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+
+@require_safe
+def media(request, path):
+    """Serve uploaded files with ETags, ranges and optional proxy offload (see core.media)"""
+    return serve_media(request, path, settings.MEDIA_ROOT)
@@ -45,11 +45,18 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.StaticAssetsMiddleware',
+    'core.middleware.TracingMiddleware',
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.MemoryMonitorMiddleware',
+    'core.middleware.QueryInstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'core.middleware.RequestProfilerMiddleware',
+    'core.middleware.PageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -125,6 +132,16 @@ USE_TZ = True
 MEDIA_ROOT = BASE_DIR / 'media'
 MEDIA_URL = '/media/'
 
+# Hand media files of at least MEDIA_SENDFILE_MIN_SIZE bytes to the front proxy: None, 'x-accel-redirect' (nginx) or 'x-sendfile'
+MEDIA_SENDFILE_BACKEND = None
+MEDIA_SENDFILE_MIN_SIZE = 256 * 1024
+
+# Internal nginx location aliased to MEDIA_ROOT, used with X-Accel-Redirect
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Background threads computing image placeholders after uploads (store.placeholders)
+IMAGE_PLACEHOLDER_WORKERS = 2
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
@@ -133,12 +150,27 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# collectstatic writes content-hashed copies plus a manifest; run manage.py build_assets to also minify and precompress
+STORAGES = {
+    # Uploads are stored once per unique content, named by their SHA-256 (see gc_media)
+    'default': {'BACKEND': 'core.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'core.storage.AssetManifestStorage'},
+}
+
+# Serve STATIC_ROOT through core.middleware.StaticAssetsMiddleware (precompressed, immutable caching)
+SERVE_STATIC_ASSETS = True
+
+# Per-template critical CSS written by manage.py build_critical_css and inlined by {% critical_stylesheet %}
+CRITICAL_CSS_DIR = BASE_DIR / 'critical_css'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Mail goes out through INSTRUMENTED_EMAIL_BACKEND; the wrapper counts it for /metrics
+EMAIL_BACKEND = 'core.email_backends.InstrumentedEmailBackend'
+INSTRUMENTED_EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
@@ -147,4 +179,135 @@ EMAIL_HOST_USER = '1qrasayed002@gmail.com'
 EMAIL_HOST_PASSWORD = 'stqx yacb avrr mxig' 
 
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
-ADMIN_EMAIL = EMAIL_HOST_USER 
+ADMIN_EMAIL = EMAIL_HOST_USER
+
+# Public base URL used for absolute links in emails (e.g. unsubscribe links)
+SITE_URL = 'http://127.0.0.1:8000'
+
+# The page, fragment and content caches share versions and locks through the default cache;
+# production needs a backend every worker can see (Redis/Memcached), `check --deploy` warns otherwise
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Dashboard counters are cached; stale values are served while one request refreshes them
+DASHBOARD_STATS_TTL = 60
+DASHBOARD_STATS_STALE_TTL = 600
+
+# Newsletter open/click hits are buffered and written in batches
+NEWSLETTER_TRACKING_FLUSH_SECONDS = 30
+NEWSLETTER_TRACKING_FLUSH_SIZE = 500
+
+# SMTP connections are reopened after this many newsletter messages
+NEWSLETTER_MESSAGES_PER_CONNECTION = 100
+
+
+# Full-page cache for public pages: url name -> models (app_label.model) the page is built from
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_TIMEOUT = 60 * 10
+PAGE_CACHE_VIEWS = {
+    'home': ['store.product', 'store.category', 'store.color', 'core.homepage', 'core.socialmedia'],
+    'about': ['core.aboutpage', 'core.socialmedia'],
+    'contact': ['core.contactpage', 'core.contactservice', 'core.socialmedia'],
+    'size_chart': ['core.socialmedia'],
+}
+
+# Per-request SQL instrumentation (core.middleware.QueryInstrumentationMiddleware): log line per request, Server-Timing for staff
+QUERY_INSTRUMENTATION_ENABLED = True
+
+# Maximum queries per view name; views not listed use QUERY_BUDGET_DEFAULT (None = unlimited).
+# core.tests.ViewQueryBudgetTests holds these views to the same numbers, as a shopper and as staff
+QUERY_BUDGETS = {
+    'home': 8,
+    'about': 6,
+    'contact': 7,
+    'size_chart': 5,
+    'shop': 9,
+    'product_detail': 11,
+    'cart': 6,
+    'checkout': 12,
+    'profile': 9,
+    'order_detail': 8,
+    'admin_dashboard': 12,
+}
+QUERY_BUDGET_DEFAULT = None
+
+# What happens when a view goes over budget: 'warn' or 'error' (logged at that level) or 'raise'
+QUERY_BUDGET_ACTION = 'warn'
+
+# Keeps a test run's slow-query log and newsletter counters out of the real database (see core.test_runner)
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+# Slow-query log (see core.slow_queries): SQL aggregated by fingerprint and view, written to QueryFingerprint
+SLOW_QUERY_LOG_ENABLED = True
+SLOW_QUERY_LOG_FLUSH_SECONDS = 60
+# Most (fingerprint, view) entries a process keeps between flushes
+SLOW_QUERY_LOG_MAX_FINGERPRINTS = 1000
+# Store an EXPLAIN plan for each new SELECT fingerprint
+SLOW_QUERY_LOG_EXPLAIN = True
+
+# The per-request SQL lines are JSON messages on the core.queries logger; core.memory logs views over their
+# allocation threshold (also JSON) and the fastest-growing allocation sites
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.queries': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'core.memory': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Staff can add ?_profile (cProfile) or ?_profile=sample (stack sampling only) to any URL to get a profile report
+REQUEST_PROFILER_ENABLED = True
+REQUEST_PROFILER_PARAM = '_profile'
+
+# Stored profiles (report, collapsed stacks, pstats dump); only the newest REQUEST_PROFILER_KEEP are kept
+REQUEST_PROFILER_DIR = BASE_DIR / 'profiles'
+REQUEST_PROFILER_KEEP = 100
+
+# Seconds between stack samples for the collapsed-stack (flamegraph) output
+REQUEST_PROFILER_SAMPLE_INTERVAL = 0.001
+
+# Prometheus metrics at /metrics (see core.metrics)
+METRICS_ENABLED = True
+# Every worker process writes its totals here; all workers of one deployment must share the directory
+METRICS_DIR = BASE_DIR / 'metrics'
+METRICS_FLUSH_SECONDS = 5
+# Scrapers send 'Authorization: Bearer <token>' (empty disables tokens) or come from an allowed address/network
+METRICS_TOKEN = ''
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Request tracing (see core.tracing): the share of requests kept, and requests at least this slow are always kept
+TRACING_ENABLED = True
+TRACING_SAMPLE_RATE = 0.01
+TRACING_SLOW_MS = 500
+# Spans beyond this are counted but not recorded
+TRACING_MAX_SPANS = 2000
+
+# 'jsonl' appends kept traces to TRACING_FILE; 'otlp' POSTs OTLP/JSON to TRACING_OTLP_ENDPOINT
+TRACING_EXPORTER = 'jsonl'
+TRACING_FILE = BASE_DIR / 'traces' / 'traces.jsonl'
+TRACING_FILE_MAX_BYTES = 20 * 1024 * 1024
+TRACING_OTLP_ENDPOINT = 'http://127.0.0.1:4318/v1/traces'
+TRACING_SERVICE_NAME = 'lavenderlily'
+
+# How many of the latest traces the staff traces page looks through
+TRACING_BROWSE_WINDOW = 2000
+
+# Worker memory monitoring (see core.memory); off by default since tracemalloc slows allocations down
+MEMORY_MONITOR_ENABLED = False
+# Stack frames tracemalloc keeps per allocation; 1 is enough for per-line totals and the cheapest
+MEMORY_TRACEMALLOC_FRAMES = 1
+# How often to snapshot allocations and diff them against the previous snapshot, and how many sites to keep
+MEMORY_SNAPSHOT_SECONDS = 300
+MEMORY_SNAPSHOT_TOP = 25
+# Requests whose allocations peak this far above where they started are logged and listed for staff
+MEMORY_VIEW_ALLOCATION_THRESHOLD_MB = 50
+# Recycle a worker once its RSS reaches this many MB (None = never); the worker sends itself MEMORY_RECYCLE_SIGNAL
+MEMORY_RSS_LIMIT_MB = None
+MEMORY_RECYCLE_SIGNAL = 'SIGTERM'
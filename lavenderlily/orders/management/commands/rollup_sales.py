@@ -0,0 +1,61 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from orders.models import Order
+from orders.rollups import backfill, rollup_changed_days, set_watermark
+
+
+class Command(BaseCommand):
+    help = (
+        'Update the daily sales rollup tables (only days changed since the last run, or a full backfill). '
+        'Changed days are found through Order.updated_at, which OrderItem saves and deletes also touch; '
+        'deleted orders, queryset .update() calls that do not set updated_at and products moved to another '
+        'category are not picked up, so run --backfill --since after such changes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help='Rebuild rollups for the whole order history instead of changed days only',
+        )
+        parser.add_argument(
+            '--since',
+            help='First day to backfill (YYYY-MM-DD), defaults to the first order',
+        )
+        parser.add_argument(
+            '--chunk-days',
+            type=int,
+            default=31,
+            help='Number of days rebuilt per transaction during a backfill',
+        )
+
+    def handle(self, *args, **options):
+        if not options['backfill']:
+            processed, watermark = rollup_changed_days()
+            self.stdout.write(
+                self.style.SUCCESS(f'Rolled up {processed} changed day(s); watermark is now {watermark:%Y-%m-%d %H:%M:%S}')
+            )
+            return
+
+        if options['since']:
+            try:
+                start = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since must be a date in YYYY-MM-DD format')
+        else:
+            first_order = Order.objects.order_by('created_at').first()
+            if not first_order:
+                self.stdout.write('No orders to roll up.')
+                return
+            start = timezone.localtime(first_order.created_at).date()
+
+        started = timezone.now()
+        end = timezone.localdate()
+        for chunk_start, chunk_end, processed in backfill(start, end, options['chunk_days']):
+            self.stdout.write(f'{chunk_start} - {chunk_end} done ({processed} days)')
+
+        # Changes made during the backfill are picked up by the next incremental run
+        set_watermark(started)
+        self.stdout.write(self.style.SUCCESS(f'Backfill complete from {start} to {end}'))
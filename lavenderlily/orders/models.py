@@ -1,6 +1,7 @@
 from django.db import models
+from django.db.models import Prefetch
 from django.contrib.auth.models import User
-from store.models import Product
+from store.models import Product, Category
 from core.models import UserAddress
 
 class Order(models.Model):
@@ -26,6 +27,7 @@ class Order(models.Model):
     cancel_date = models.DateTimeField(null=True, blank=True)
     return_date = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.order_number
@@ -53,4 +55,66 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
     def subtotal(self):
-        return self.price * self.quantity
\ No newline at end of file
+        return self.price * self.quantity
+
+
+def items_with_products():
+    """Prefetch an order's items together with the product, category and color shown for each"""
+    return Prefetch('items', queryset=OrderItem.objects.select_related('product__category', 'product__color'))
+
+
+# Sales rollups: pre-aggregated per day by the rollup_sales command so that
+# analytics never need to scan Order/OrderItem.
+
+class DailySales(models.Model):
+    date = models.DateField(unique=True)
+    order_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['date']
+        verbose_name_plural = "Daily sales"
+
+    def __str__(self):
+        return f"{self.date}: AED {self.revenue}"
+
+
+class DailyStatusCount(models.Model):
+    date = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'status')
+
+
+class DailyProductSales(models.Model):
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('date', 'product')
+        verbose_name_plural = "Daily product sales"
+
+
+class DailyCategorySales(models.Model):
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('date', 'category')
+        verbose_name_plural = "Daily category sales"
+
+
+class RollupWatermark(models.Model):
+    """Point in time up to which order changes have been rolled up"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
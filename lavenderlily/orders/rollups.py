@@ -0,0 +1,129 @@
+"""
+Daily sales rollups.
+
+Each day is recomputed as a whole from Order/OrderItem and written to the
+Daily* tables. Incremental runs only touch days that contain orders changed
+since the last watermark (an OrderItem change touches its order, see
+orders.signals); backfills walk history in fixed-size chunks.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    Order, OrderItem, DailySales, DailyStatusCount, DailyProductSales, DailyCategorySales, RollupWatermark,
+)
+
+WATERMARK_NAME = 'sales'
+
+# Orders in these states are counted but do not contribute revenue or units
+NON_REVENUE_STATUSES = ('cancelled', 'returned')
+
+
+def _day_filter(days, prefix=''):
+    """
+    Filter kwargs selecting orders created on the given days.
+    An indexable datetime range is used, narrowed to the exact days when they are not contiguous.
+    """
+    start = timezone.make_aware(datetime.combine(days[0], time.min))
+    end = timezone.make_aware(datetime.combine(days[-1] + timedelta(days=1), time.min))
+    lookups = {f'{prefix}created_at__gte': start, f'{prefix}created_at__lt': end}
+    if (days[-1] - days[0]).days + 1 != len(days):
+        lookups[f'{prefix}created_at__date__in'] = days
+    return lookups
+
+
+def rollup_days(days):
+    """Recompute the rollup rows for the given dates. Returns the number of days written."""
+    days = sorted(set(days))
+    if not days:
+        return 0
+
+    orders = Order.objects.filter(**_day_filter(days)).annotate(day=TruncDate('created_at'))
+    status_rows = orders.values('day', 'status').annotate(
+        count=Count('id'), revenue=Sum('total_amount')
+    ).order_by()
+
+    items = (
+        OrderItem.objects.filter(**_day_filter(days, 'order__'))
+        .exclude(order__status__in=NON_REVENUE_STATUSES)
+        .annotate(day=TruncDate('order__created_at'))
+        .values('day', 'product_id', 'product__category_id')
+        .annotate(units=Sum('quantity'), revenue=Sum(F('price') * F('quantity')))
+        .order_by()
+    )
+
+    daily = {day: DailySales(date=day) for day in days}
+    status_counts = []
+    for row in status_rows:
+        sales = daily[row['day']]
+        sales.order_count += row['count']
+        if row['status'] not in NON_REVENUE_STATUSES:
+            sales.revenue += row['revenue'] or Decimal('0')
+        status_counts.append(DailyStatusCount(date=row['day'], status=row['status'], count=row['count']))
+
+    product_sales = []
+    category_totals = defaultdict(lambda: [0, Decimal('0')])
+    for row in items:
+        revenue = row['revenue'] or Decimal('0')
+        daily[row['day']].units += row['units']
+        product_sales.append(DailyProductSales(
+            date=row['day'], product_id=row['product_id'], units=row['units'], revenue=revenue
+        ))
+        totals = category_totals[(row['day'], row['product__category_id'])]
+        totals[0] += row['units']
+        totals[1] += revenue
+
+    category_sales = [
+        DailyCategorySales(date=day, category_id=category_id, units=units, revenue=revenue)
+        for (day, category_id), (units, revenue) in category_totals.items()
+    ]
+
+    with transaction.atomic():
+        for model in (DailySales, DailyStatusCount, DailyProductSales, DailyCategorySales):
+            model.objects.filter(date__in=days).delete()
+        DailySales.objects.bulk_create([sales for sales in daily.values() if sales.order_count])
+        DailyStatusCount.objects.bulk_create(status_counts)
+        DailyProductSales.objects.bulk_create(product_sales, batch_size=1000)
+        DailyCategorySales.objects.bulk_create(category_sales, batch_size=1000)
+
+    return len(days)
+
+
+def rollup_changed_days():
+    """
+    Roll up every day holding an order created or updated since the last run.
+    Returns (days_processed, new_watermark).
+    """
+    started = timezone.now()
+    watermark = RollupWatermark.objects.filter(name=WATERMARK_NAME).first()
+
+    orders = Order.objects.all()
+    if watermark:
+        orders = orders.filter(updated_at__gte=watermark.value)
+    days = [day.date() for day in orders.datetimes('created_at', 'day')]
+
+    processed = rollup_days(days)
+    set_watermark(started)
+    return processed, started
+
+
+def set_watermark(value):
+    RollupWatermark.objects.update_or_create(name=WATERMARK_NAME, defaults={'value': value})
+
+
+def backfill(start, end, chunk_days=31):
+    """Rebuild the rollups for every day between start and end (inclusive), chunk by chunk"""
+    processed = 0
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+        days = [chunk_start + timedelta(days=offset) for offset in range((chunk_end - chunk_start).days + 1)]
+        processed += rollup_days(days)
+        yield chunk_start, chunk_end, processed
+        chunk_start = chunk_end + timedelta(days=1)
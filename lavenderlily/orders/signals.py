@@ -0,0 +1,40 @@
+"""
+Signal handlers keeping the sales rollups' change tracking complete.
+
+Incremental rollups find changed days through Order.updated_at, so saving
+or deleting an OrderItem touches its order's updated_at as well. The orders
+are collected and touched in one UPDATE when the transaction commits, so
+deleting a product does not cost one query per order item it cascades to.
+"""
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+# Orders touched per UPDATE
+TOUCH_BATCH_SIZE = 500
+
+_pending = threading.local()
+
+
+def touch_order(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _pending.__dict__.setdefault('order_ids', set()).add(instance.order_id)
+    transaction.on_commit(touch_pending_orders)
+
+
+def touch_pending_orders():
+    """Touch the orders collected so far; later callbacks of the same commit find nothing left"""
+    from .models import Order
+
+    order_ids = sorted(_pending.__dict__.pop('order_ids', ()))
+    now = timezone.now()
+    for start in range(0, len(order_ids), TOUCH_BATCH_SIZE):
+        Order.objects.filter(pk__in=order_ids[start:start + TOUCH_BATCH_SIZE]).update(updated_at=now)
+
+
+def connect_rollup_signals():
+    post_save.connect(touch_order, sender='orders.OrderItem', dispatch_uid='rollups:orders.OrderItem')
+    post_delete.connect(touch_order, sender='orders.OrderItem', dispatch_uid='rollups:orders.OrderItem')
@@ -1,7 +1,8 @@
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.conf import settings
-from .models import Order
+from django.db.models import prefetch_related_objects
+from .models import Order, items_with_products
 
 def send_order_email(order, email_type):
     """
@@ -27,6 +28,7 @@ def send_order_email(order, email_type):
         return False
 
     # Render email content
+    prefetch_related_objects([order], items_with_products())
     context = {'order': order}
     html_message = render_to_string(template_name, context)
     plain_message = f"""
@@ -1,5 +1,5 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
@@ -7,11 +7,16 @@ import json
 import requests
 import hmac
 import hashlib
-from .models import Order, OrderItem
+from .models import Order, OrderItem, DailySales, DailyStatusCount, DailyProductSales, DailyCategorySales, items_with_products
 from store.models import Product
+from core import metrics
 from core.models import UserAddress
 from cart.models import CartItem
 from decimal import Decimal
+from datetime import timedelta
+from dateutil.relativedelta import relativedelta
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
 import uuid
 from .utils import send_order_email
 from django.utils import timezone
@@ -19,8 +24,8 @@ from django.conf import settings
 
 @login_required(login_url='signin')
 def checkout(request):
-    cart_items = CartItem.objects.filter(user=request.user).select_related('product')
-    if not cart_items.exists():
+    cart_items = list(CartItem.objects.filter(user=request.user).select_related('product__category', 'product__color'))
+    if not cart_items:
         messages.error(request, "Your cart is empty.")
         return redirect("cart")
 
@@ -43,11 +48,6 @@ def checkout(request):
     tax = subtotal * Decimal('0.05')  # 5% VAT (UAE standard)
     total = subtotal + shipping + tax
 
-    # Get user's default address or first address
-    default_address = UserAddress.objects.filter(user=request.user, is_default=True).first()
-    if not default_address:
-        default_address = UserAddress.objects.filter(user=request.user).first()
-
     if request.method == "POST":
         # Check if address already exists
         existing_address = UserAddress.objects.filter(
@@ -84,19 +84,25 @@ def checkout(request):
             shipping_address=address
         )
 
-        for item in products:
-            OrderItem.objects.create(
+        # One INSERT for the whole cart; skipping post_save is fine, the new order is already the latest change
+        order_items = OrderItem.objects.bulk_create([
+            OrderItem(
                 order=order,
                 product=item["product"],
                 quantity=item["qty"],
                 price=item["product"].price
             )
+            for item in products
+        ])
 
         payment_method = request.POST.get("payment_method", "Fake Payment")
+        metrics.CHECKOUT.inc(step=metrics.ORDER_PLACED)
 
         # For fake payment, redirect to payment processing page
         return render(request, 'orders/payment.html', {
             'order': order,
+            # The new items already hold their products; order.items.all would query them again per item
+            'order_items': order_items,
             'payment_method': 'Fake Payment',
             'amount': int(total * 100),
             'currency': 'AED',
@@ -110,6 +116,12 @@ def checkout(request):
             'tax': tax,
         })
 
+    # Get user's default address or first address
+    default_address = UserAddress.objects.filter(user=request.user, is_default=True).first()
+    if not default_address:
+        default_address = UserAddress.objects.filter(user=request.user).first()
+
+    metrics.CHECKOUT.inc(step=metrics.CHECKOUT_VIEWED)
     return render(request, "orders/checkout.html", {
         "cart_items": products,
         "subtotal": subtotal,
@@ -123,7 +135,7 @@ def checkout(request):
 
 @login_required(login_url='signin')
 def cancel_order(request, pk):
-    order = get_object_or_404(Order, pk=pk, user=request.user)
+    order = get_object_or_404(Order.objects.select_related('user'), pk=pk, user=request.user)
     if request.method == "POST" and order.status == 'processing':
         order.cancel_requested = True
         order.cancel_reason = request.POST.get('reason', '')
@@ -152,10 +164,11 @@ def return_order(request, pk):
 
 @login_required(login_url='signin')
 def order_detail(request, pk):
+    orders = Order.objects.prefetch_related(items_with_products())
     if request.user.is_staff:
-        order = get_object_or_404(Order, pk=pk)
+        order = get_object_or_404(orders, pk=pk)
     else:
-        order = get_object_or_404(Order, pk=pk, user=request.user)
+        order = get_object_or_404(orders, pk=pk, user=request.user)
     return render(request, "orders/order_detail.html", {"order": order})
 
 
@@ -173,7 +186,7 @@ def payment_callback(request):
         
         if order_number:
             try:
-                order = Order.objects.get(order_number=order_number)
+                order = Order.objects.select_related('user').get(order_number=order_number)
                 
                 # Mark as paid
                 order.is_paid = True
@@ -188,6 +201,7 @@ def payment_callback(request):
                 # Send order confirmation email
                 send_order_email(order, 'confirmation')
 
+                metrics.CHECKOUT.inc(step=metrics.PAYMENT_COMPLETED)
                 return redirect("payment_status", status="success")
 
             except Order.DoesNotExist:
@@ -199,4 +213,64 @@ def payment_callback(request):
 
     else:
         # Handle GET request (payment cancelled or failed)
+        metrics.CHECKOUT.inc(step=metrics.PAYMENT_FAILED)
         return redirect("payment_status", status="failed")
+
+
+@login_required(login_url='signin')
+@user_passes_test(lambda u: u.is_staff)
+def dashboard_charts(request):
+    """Sales chart data for the dashboard, read only from the daily rollup tables"""
+    today = timezone.localdate()
+    start = today.replace(day=1) - relativedelta(months=11)
+
+    # Top products/categories cover the last N days (30 by default)
+    days = request.GET.get('days', '30')
+    top_since = today - timedelta(days=int(days) if days.isdigit() else 30)
+
+    monthly = (
+        DailySales.objects.filter(date__gte=start)
+        .annotate(month=TruncMonth('date'))
+        .values('month')
+        .annotate(revenue=Sum('revenue'), orders=Sum('order_count'), units=Sum('units'))
+        .order_by('month')
+    )
+    top_products = (
+        DailyProductSales.objects.filter(date__gte=top_since)
+        .values('product_id', 'product__name')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('-revenue')[:10]
+    )
+    top_categories = (
+        DailyCategorySales.objects.filter(date__gte=top_since)
+        .values('category_id', 'category__name')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('-revenue')[:10]
+    )
+    statuses = (
+        DailyStatusCount.objects.filter(date__gte=start)
+        .values('status')
+        .annotate(count=Sum('count'))
+        .order_by('status')
+    )
+
+    return JsonResponse({
+        'monthly_revenue': [
+            {
+                'month': row['month'].strftime('%Y-%m'),
+                'revenue': float(row['revenue']),
+                'orders': row['orders'],
+                'units': row['units'],
+            }
+            for row in monthly
+        ],
+        'top_products': [
+            {'id': row['product_id'], 'name': row['product__name'], 'units': row['units'], 'revenue': float(row['revenue'])}
+            for row in top_products
+        ],
+        'top_categories': [
+            {'id': row['category_id'], 'name': row['category__name'], 'units': row['units'], 'revenue': float(row['revenue'])}
+            for row in top_categories
+        ],
+        'orders_by_status': {row['status']: row['count'] for row in statuses},
+    })
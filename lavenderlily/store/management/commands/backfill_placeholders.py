@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from store import placeholders
+
+
+class Command(BaseCommand):
+    help = 'Compute image placeholders for products and categories that do not have one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Recompute existing placeholders as well')
+        parser.add_argument('--workers', type=int, default=4, help='Images processed in parallel')
+        parser.add_argument('--batch-size', type=int, default=200, help='Rows loaded per batch')
+
+    def handle(self, *args, **options):
+        for label, (image_field, placeholder_field) in placeholders.PLACEHOLDER_FIELDS.items():
+            queryset = apps.get_model(label)._default_manager.exclude(**{image_field: ''}).exclude(
+                **{f'{image_field}__isnull': True}
+            )
+            if not options['force']:
+                queryset = queryset.filter(**{placeholder_field: ''})
+            rows = queryset.order_by('pk').values_list('pk', image_field)
+
+            done = failed = size = 0
+            last_pk = None
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                while True:
+                    # Keyset pagination: only one batch of rows is held in memory at a time
+                    page = rows if last_pk is None else rows.filter(pk__gt=last_pk)
+                    batch = list(page[:options['batch_size']])
+                    if not batch:
+                        break
+                    last_pk = batch[-1][0]
+                    for placeholder in pool.map(lambda row: self.generate(label, *row), batch):
+                        if placeholder is None:
+                            failed += 1
+                        else:
+                            done += 1
+                            size += len(placeholder)
+
+            average = f', {size / done:.0f} bytes on average' if done else ''
+            self.stdout.write(self.style.SUCCESS(f'{label}: {done} placeholders written{average}, {failed} failed'))
+
+    def generate(self, label, pk, image_name):
+        try:
+            return placeholders.generate(label, pk, image_name)
+        finally:
+            connections.close_all()
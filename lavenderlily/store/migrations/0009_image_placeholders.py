@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_product_variant_group_alter_category_cover_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='cover_placeholder',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
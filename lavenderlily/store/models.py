@@ -8,6 +8,7 @@ class Category(models.Model):
     slug = models.SlugField(max_length=50, unique=True, blank=True)
     description = models.TextField(blank=True)
     cover_image = models.ImageField(upload_to='categories/', blank=True, null=True, help_text="Upload a cover image for this category (recommended size: 300x350px for best display on homepage)")
+    cover_placeholder = models.TextField(blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -84,6 +85,8 @@ class Product(models.Model):
     image2 = models.ImageField(upload_to="products/", blank=True, null=True)
     image3 = models.ImageField(upload_to="products/", blank=True, null=True)
     image4 = models.ImageField(upload_to="products/", blank=True, null=True)
+    # Tiny data URI preview of image_main, filled in the background (store.placeholders)
+    image_placeholder = models.TextField(blank=True, editable=False)
 
     def save(self, *args, **kwargs):
         if not self.slug and self.name:
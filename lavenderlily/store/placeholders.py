@@ -0,0 +1,85 @@
+"""
+Low-quality image placeholders (LQIP).
+
+Each product's main image and each category cover get a ~20px WebP (JPEG
+where Pillow lacks WebP) stored on the row as a data URI, a few hundred
+bytes. Templates paint it as the <img> background so grids show a blurred
+preview while the real, lazily loaded image arrives.
+
+Placeholders are computed in a small thread pool once the saving
+transaction commits, never on the request thread. The result is written
+with a conditional UPDATE, so a placeholder for an image that has been
+replaced meanwhile is discarded.
+"""
+import base64
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+from PIL import Image, features
+
+from core import page_cache
+
+logger = logging.getLogger(__name__)
+
+# Model label -> (image field, placeholder field)
+PLACEHOLDER_FIELDS = {
+    'store.Product': ('image_main', 'image_placeholder'),
+    'store.Category': ('cover_image', 'cover_placeholder'),
+}
+
+PLACEHOLDER_SIZE = 20
+PLACEHOLDER_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+
+# Threads are only started once work is submitted
+_executor = ThreadPoolExecutor(max_workers=settings.IMAGE_PLACEHOLDER_WORKERS, thread_name_prefix='placeholders')
+
+
+def make_placeholder(file):
+    """Return a data URI with a tiny version of the image in file"""
+    with Image.open(file) as image:
+        image.draft('RGB', (PLACEHOLDER_SIZE * 4, PLACEHOLDER_SIZE * 4))
+        image = image.convert('RGB')
+        image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+        buffer = io.BytesIO()
+        image.save(buffer, PLACEHOLDER_FORMAT, quality=40)
+    encoded = base64.b64encode(buffer.getvalue()).decode('ascii')
+    return f'data:image/{PLACEHOLDER_FORMAT.lower()};base64,{encoded}'
+
+
+def generate(label, pk, image_name):
+    """Compute and store the placeholder for one row; returns it, or None if the image cannot be read"""
+    model = apps.get_model(label)
+    image_field, placeholder_field = PLACEHOLDER_FIELDS[label]
+    storage = model._meta.get_field(image_field).storage
+    try:
+        with storage.open(image_name) as f:
+            placeholder = make_placeholder(f)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        logger.warning('Could not build a placeholder for %s %s (%s): %s', label, pk, image_name, exc)
+        return None
+
+    updated = model._default_manager.filter(pk=pk, **{image_field: image_name}).update(
+        **{placeholder_field: placeholder}
+    )
+    if updated:
+        # UPDATE skips post_save, so retire cached pages and fragments here
+        page_cache.bump_tag(model._meta.label_lower)
+    return placeholder
+
+
+def _run(label, pk, image_name):
+    try:
+        generate(label, pk, image_name)
+    except Exception:
+        logger.exception('Placeholder generation failed for %s %s', label, pk)
+    finally:
+        connections.close_all()
+
+
+def schedule(label, pk, image_name):
+    """Build the placeholder in the background once the current transaction commits"""
+    transaction.on_commit(lambda: _executor.submit(_run, label, pk, image_name))
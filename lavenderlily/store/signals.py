@@ -0,0 +1,38 @@
+"""
+Signal handlers scheduling image placeholder generation.
+
+post_init remembers the stored image name; when a save changes it (or a
+new row has an image) the placeholder is rebuilt in the background.
+"""
+from django.db.models.signals import post_init, post_save
+
+from . import placeholders
+
+
+def snapshot_image_name(sender, instance, **kwargs):
+    image_field, _ = placeholders.PLACEHOLDER_FIELDS[sender._meta.label]
+    # Read the raw value: going through the descriptor would build a FieldFile for every row
+    instance._placeholder_source = instance.__dict__.get(image_field)
+
+
+def schedule_placeholder(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    image_field, placeholder_field = placeholders.PLACEHOLDER_FIELDS[sender._meta.label]
+    if raw or (update_fields is not None and image_field not in update_fields):
+        return
+
+    name = getattr(instance, image_field).name
+    previous = instance.__dict__.get('_placeholder_source')
+    instance._placeholder_source = name
+    if not name:
+        if previous:
+            sender._default_manager.filter(pk=instance.pk).update(**{placeholder_field: ''})
+        return
+    if created or name != previous:
+        placeholders.schedule(sender._meta.label, instance.pk, name)
+
+
+def connect_placeholder_signals():
+    for label in placeholders.PLACEHOLDER_FIELDS:
+        uid = f'placeholders:{label}'
+        post_init.connect(snapshot_image_name, sender=label, dispatch_uid=uid)
+        post_save.connect(schedule_placeholder, sender=label, dispatch_uid=uid)
@@ -1,16 +1,17 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from .models import Product, Review, Category, Color, Size
-from django.core.paginator import Paginator
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from cart.models import WishlistItem
+from core import counters
+from core.counters import CountedPaginator
 
 @login_required(login_url='signin')
 def shop(request):
-    qs = Product.objects.all().order_by("-created_at")
+    qs = Product.objects.select_related("category", "color").order_by("-created_at")
 
     # SEARCH
     q = request.GET.get("q")
@@ -48,8 +49,9 @@ def shop(request):
     elif sort == "newest":
         qs = qs.order_by("-created_at")
 
-    # PAGINATION
-    paginator = Paginator(qs, 8)  # 8 per page
+    # PAGINATION (the unfiltered catalogue takes its total from the site counters)
+    filtered = q or categories or color or max_price
+    paginator = CountedPaginator(qs, 8, counter=None if filtered else counters.PRODUCTS_TOTAL)  # 8 per page
     page_number = request.GET.get("page")
     page_obj = paginator.get_page(page_number)
 
@@ -71,7 +73,7 @@ def shop(request):
 
 @login_required(login_url='signin')
 def product_detail(request, pk):
-    product = get_object_or_404(Product, pk=pk)
+    product = get_object_or_404(Product.objects.select_related('category', 'color'), pk=pk)
     # images list (image_main first)
     images = [product.image_main.url]
     for f in [product.image1, product.image2, product.image3, product.image4]:
@@ -98,13 +100,16 @@ def product_detail(request, pk):
     available_sizes = product.sizes.all()
 
     # Get product variants (same variant_group, different colors)
-    variants = Product.objects.filter(variant_group=product.variant_group).exclude(pk=product.pk).order_by('color__name')
+    variants = (
+        Product.objects.filter(variant_group=product.variant_group).exclude(pk=product.pk)
+        .select_related('color').order_by('color__name')
+    )
     all_variants = [product] + list(variants)
 
     # Get related products from same category, excluding current product and its variants
     related_products = Product.objects.filter(
         category=product.category
-    ).exclude(
+    ).select_related('category').exclude(
         Q(pk=product.pk) | Q(variant_group=product.variant_group)
     ).order_by('?')[:4]  # Random order, limit to 4
 
@@ -149,7 +154,7 @@ def size_chart(request):
 @user_passes_test(lambda u: u.is_staff)
 def manage_products(request):
     """Custom product management page"""
-    products = Product.objects.all().order_by('-created_at')
+    products = Product.objects.select_related('category', 'color').order_by('-created_at')
 
     # Search functionality
     q = request.GET.get('q')
@@ -166,8 +171,9 @@ def manage_products(request):
     if color:
         products = products.filter(color__name=color)
 
-    # Pagination
-    paginator = Paginator(products, 20)
+    # Pagination; the unfiltered listing takes its total from the site counters
+    counter = counters.PRODUCTS_TOTAL if not (q or category or color) else None
+    paginator = CountedPaginator(products, 20, counter=counter)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
 
@@ -371,7 +377,8 @@ def delete_product(request, pk):
 @user_passes_test(lambda u: u.is_staff)
 def manage_categories(request):
     """Manage categories"""
-    categories = Category.objects.all().order_by('name')
+    # Live counts: the Delete button must not be offered for a category that still has products
+    categories = Category.objects.annotate(product_count=Count('product')).order_by('name')
 
     if request.method == 'POST':
         action = request.POST.get('action')
@@ -412,8 +419,12 @@ def manage_categories(request):
                 try:
                     category = get_object_or_404(Category, pk=category_id)
                     category_name = category.name
-                    category.delete()
-                    messages.success(request, f'Category "{category_name}" has been deleted.')
+                    # Deleting a category would cascade to its products
+                    if category.product_set.exists():
+                        messages.error(request, f'Category "{category_name}" still has products and cannot be deleted.')
+                    else:
+                        category.delete()
+                        messages.success(request, f'Category "{category_name}" has been deleted.')
                 except Exception as e:
                     messages.error(request, f'Error deleting category: {str(e)}')
 
@@ -429,7 +440,7 @@ def manage_categories(request):
 @user_passes_test(lambda u: u.is_staff)
 def manage_colors(request):
     """Manage colors"""
-    colors = Color.objects.all().order_by('name')
+    colors = Color.objects.annotate(product_count=Count('product')).order_by('name')
 
     if request.method == 'POST':
         action = request.POST.get('action')